@@ -0,0 +1,13 @@
+"""airfrog - Python host tooling for airfrog's binary and REST APIs
+
+Add `scripts/lib` to `sys.path` (the scripts in `scripts/` do this
+themselves) and import the modules you need, e.g.:
+
+    from airfrog.bin import Client
+
+See docs/BINARY-API.md and docs/REST-API.md for the API specifications.
+"""
+
+from .bin import Client, BinApiError, ResponseError, ConnectionClosed
+from .memory import Memory
+from .plan import ReadPlan
@@ -0,0 +1,319 @@
+"""airfrog.aio - asyncio client for airfrog's binary API
+
+`AsyncClient` provides the same commands as `airfrog.bin.Client`, as
+coroutines.  Each command is written to the connection as soon as there is
+room in the pipeline, so concurrent commands (e.g. from `asyncio.gather()`)
+are kept in flight together.  Responses are parsed in order by a reader task
+and delivered to the waiting commands.
+
+Backpressure is applied in two places - commands wait for space in the
+in-flight window before being written, and then for the transport's write
+buffer to drain.  Each command has a per-device timeout.  A timeout leaves
+the response stream in an unknown state, so it closes the connection.
+
+One event loop can drive many airfrogs at once:
+
+    async def idcode(client):
+        return await client.dp_read(DP_IDCODE)
+
+    results = asyncio.run(run_many(["192.168.0.103", "192.168.0.104"], idcode))
+"""
+
+import asyncio
+import collections
+import socket
+
+from . import codec
+from .bin import (
+    PORT, VERSION, RSP_OK, SPEED_NAMES,
+    CMD_DP_READ, CMD_DP_WRITE, CMD_AP_READ, CMD_AP_WRITE, CMD_AP_BULK_READ,
+    CMD_AP_BULK_WRITE, CMD_MULTI_REG_WRITE, CMD_PING, CMD_RESET_TARGET,
+    CMD_CLOCK, CMD_SET_SPEED, CMD_DISCONNECT,
+    DEFAULT_MAX_INFLIGHT, DEFAULT_MAX_INFLIGHT_BYTES,
+    BinApiError, ResponseError, ConnectionClosed, check_count,
+)
+
+
+class AsyncClient:
+    """asyncio airfrog binary API client
+
+    Arguments:
+    - host: IP address or hostname of the airfrog
+    - port: binary API port
+    - timeout: seconds allowed to connect, and for each command's response
+    - max_inflight: maximum number of commands awaiting responses
+    - max_inflight_bytes: maximum number of response bytes outstanding
+    """
+
+    def __init__(self, host, port=PORT, timeout=5.0,
+                 max_inflight=DEFAULT_MAX_INFLIGHT,
+                 max_inflight_bytes=DEFAULT_MAX_INFLIGHT_BYTES):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_inflight = max_inflight
+        self.max_inflight_bytes = max_inflight_bytes
+
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = collections.deque()
+        self._pending_bytes = 0
+        self._window = None
+        self._response = None
+        self._error = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.disconnect()
+        else:
+            await self.close()
+
+    #
+    # Connection management
+    #
+
+    async def connect(self):
+        """Connect to airfrog and perform the version handshake"""
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+        sock = self._writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        try:
+            version = (await asyncio.wait_for(self._reader.readexactly(1), self.timeout))[0]
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            await self.close()
+            raise ConnectionClosed("Binary API handshake failed")
+        if version != VERSION:
+            await self.close()
+            raise BinApiError(f"Unsupported binary API version 0x{version:02X}")
+        self._writer.write(codec.CMD.pack(VERSION))
+
+        self._error = None
+        self._window = asyncio.Condition()
+        self._response = asyncio.Event()
+        self._reader_task = asyncio.create_task(self._reader_loop())
+
+    async def close(self):
+        """Close the connection without sending a disconnect"""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+            self._writer = None
+        self._fail_pending(ConnectionClosed("Connection closed"))
+
+    async def disconnect(self):
+        """Send Disconnect, wait for its acknowledgement and close"""
+        if self._writer is None:
+            return
+        try:
+            await self._command("Disconnect", CMD_DISCONNECT, 0, codec.CMD.pack(CMD_DISCONNECT))
+        except (OSError, BinApiError, asyncio.TimeoutError):
+            pass
+        await self.close()
+
+    #
+    # Commands
+    #
+
+    async def dp_read(self, reg):
+        """Read a DP register"""
+        return await self._command("DP Read", CMD_DP_READ, 4,
+                                   codec.SINGLE_READ.pack(CMD_DP_READ, reg))
+
+    async def dp_write(self, reg, value):
+        """Write a DP register"""
+        await self._command("DP Write", CMD_DP_WRITE, 0,
+                            codec.SINGLE_WRITE.pack(CMD_DP_WRITE, reg, value))
+
+    async def ap_read(self, reg):
+        """Read an AP register"""
+        return await self._command("AP Read", CMD_AP_READ, 4,
+                                   codec.SINGLE_READ.pack(CMD_AP_READ, reg))
+
+    async def ap_write(self, reg, value):
+        """Write an AP register"""
+        await self._command("AP Write", CMD_AP_WRITE, 0,
+                            codec.SINGLE_WRITE.pack(CMD_AP_WRITE, reg, value))
+
+    async def ap_bulk_read(self, reg, count):
+        """Bulk read `count` words from an AP register, returning an array('I')"""
+        check_count(count)
+        return await self._command("AP Bulk Read", CMD_AP_BULK_READ, 2 + count * 4,
+                                   codec.BULK_HEADER.pack(CMD_AP_BULK_READ, reg, count),
+                                   count=count)
+
+    async def ap_bulk_write(self, reg, words):
+        """Bulk write words (ints, array('I') or little-endian bytes) to an AP register"""
+        payload = codec.words_to_bytes(words)
+        count = len(payload) // 4
+        check_count(count)
+        header = codec.BULK_HEADER.pack(CMD_AP_BULK_WRITE, reg, count)
+        await self._command("AP Bulk Write", CMD_AP_BULK_WRITE, 0, header, payload)
+
+    async def multi_reg_write(self, writes):
+        """Write multiple (reg_type, reg, value) registers in one command"""
+        check_count(len(writes))
+        frame = codec.FrameBuffer(codec.MULTI_HEADER.size + len(writes) * codec.MULTI_ENTRY.size)
+        frame.multi_write(CMD_MULTI_REG_WRITE, writes)
+        await self._command("Multi-reg Write", CMD_MULTI_REG_WRITE, 0, frame.buf)
+
+    async def ping(self):
+        """Ping airfrog"""
+        await self._command("Ping", CMD_PING, 0, codec.CMD.pack(CMD_PING))
+
+    async def reset_target(self):
+        """Reset the target"""
+        await self._command("Reset Target", CMD_RESET_TARGET, 0, codec.CMD.pack(CMD_RESET_TARGET))
+
+    async def clock(self, level, post, cycles):
+        """Clock SWCLK `cycles` times"""
+        levels = (level & 0x0F) | (post << 4)
+        await self._command("Clock", CMD_CLOCK, 0, codec.CLOCK.pack(CMD_CLOCK, levels, cycles))
+
+    async def set_speed(self, speed):
+        """Set the SWD speed, using one of the SPEED_* values"""
+        if speed not in SPEED_NAMES:
+            raise ValueError(f"Invalid speed {speed}")
+        await self._command("Set Speed", CMD_SET_SPEED, 0,
+                            codec.SET_SPEED.pack(CMD_SET_SPEED, speed))
+
+    #
+    # Internals
+    #
+
+    async def _command(self, name, cmd, rsp_bytes, frame, payload=None, count=0):
+        # An abort drops the connection, so report why before "Not connected"
+        if self._error is not None:
+            raise self._error
+        if self._writer is None:
+            raise BinApiError("Not connected")
+
+        # Wait for room in the in-flight window.  Nothing has been sent yet,
+        # so the connection is still usable if this times out.
+        try:
+            async with self._window:
+                await asyncio.wait_for(self._window.wait_for(
+                    lambda: self._error is not None or not self._pending or (
+                        len(self._pending) < self.max_inflight
+                        and self._pending_bytes + rsp_bytes <= self.max_inflight_bytes)),
+                    self.timeout)
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError(
+                f"{name} timed out waiting to be sent after {self.timeout}s") from None
+        if self._error is not None:
+            raise self._error
+
+        # Nothing between here and the write may yield, so that the pending
+        # queue stays in the same order as the commands on the wire
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((name, cmd, count, rsp_bytes, future))
+        self._pending_bytes += rsp_bytes
+        self._response.set()
+        self._writer.write(frame)
+        if payload is not None:
+            self._writer.write(payload)
+
+        try:
+            await asyncio.wait_for(self._writer.drain(), self.timeout)
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            if self._error is not None:
+                # Another command timed out first, and aborted
+                raise self._error from None
+            error = asyncio.TimeoutError(f"{name} timed out after {self.timeout}s")
+            await self._abort(error)
+            raise error from None
+
+    async def _reader_loop(self):
+        reader = self._reader
+        try:
+            while True:
+                while not self._pending:
+                    self._response.clear()
+                    await self._response.wait()
+                name, cmd, count, rsp_bytes, future = self._pending[0]
+
+                status = (await reader.readexactly(1))[0]
+                if status != RSP_OK:
+                    # airfrog sends only the status byte on error
+                    result = ResponseError(name, status)
+                elif cmd == CMD_DP_READ or cmd == CMD_AP_READ:
+                    result = codec.WORD.unpack(await reader.readexactly(4))[0]
+                elif cmd == CMD_AP_BULK_READ:
+                    got = codec.COUNT.unpack(await reader.readexactly(2))[0]
+                    if got != count:
+                        raise BinApiError(f"{name} returned {got} words, expected {count}")
+                    result = codec.bytes_to_words(await reader.readexactly(count * 4))
+                else:
+                    result = None
+
+                self._pending.popleft()
+                self._pending_bytes -= rsp_bytes
+                if not future.done():
+                    if isinstance(result, ResponseError):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+                async with self._window:
+                    self._window.notify_all()
+        except asyncio.CancelledError:
+            raise
+        except asyncio.IncompleteReadError:
+            await self._abort(ConnectionClosed("airfrog closed the connection"), cancel=False)
+        except (OSError, BinApiError) as e:
+            await self._abort(e, cancel=False)
+
+    async def _abort(self, error, cancel=True):
+        """Fail everything outstanding with `error` and drop the connection"""
+        self._error = error
+        if cancel and self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._fail_pending(error)
+        if self._window is not None:
+            async with self._window:
+                self._window.notify_all()
+
+    def _fail_pending(self, error):
+        while self._pending:
+            future = self._pending.popleft()[-1]
+            if not future.done():
+                future.set_exception(error)
+                # Don't warn about exceptions nobody was waiting for
+                future.exception()
+        self._pending_bytes = 0
+
+
+async def run_many(hosts, func, port=PORT, timeout=5.0, **kwargs):
+    """Connect to each airfrog in `hosts` concurrently and run `func` on it
+
+    `func` is a coroutine function taking an `AsyncClient`.  Returns a dict
+    mapping each host to func's result, or to the exception it raised, so
+    one failing airfrog doesn't stop the others.
+    """
+    async def one(host):
+        async with AsyncClient(host, port=port, timeout=timeout, **kwargs) as client:
+            return await func(client)
+
+    results = await asyncio.gather(*(one(host) for host in hosts), return_exceptions=True)
+    return dict(zip(hosts, results))
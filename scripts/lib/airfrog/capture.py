@@ -0,0 +1,307 @@
+"""airfrog.capture - Streaming capture of counter samples, and offline analysis
+
+`CaptureWriter` appends samples (dicts of field values) to a file, in
+batches, so memory use stays bounded however long a capture runs:
+
+    with CaptureWriter("run.npy", PERF_FIELDS) as capture:
+        for tick in Scheduler(0.1):
+            capture.append(read_counters())
+
+The format is chosen by extension:
+- .csv - plain CSV with a header row
+- .npy - a NumPy structured array.  The header is rewritten with the final
+  row count when the capture is closed - if it isn't, `load_capture()`
+  recovers the complete rows.
+- .parquet - requires pyarrow
+
+Raw counter values are stored, so the analysis can be repeated without
+re-running the hardware.  `load_capture()` reads any of these formats back
+into a NumPy structured array, and `deltas()`, `rates()`, `windowed_mean()`
+and `summarise()` process whole captures with NumPy.  Analysis requires
+NumPy - pip install numpy.
+"""
+
+import ast
+import csv
+import os
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# Samples buffered before each write
+DEFAULT_BATCH_SIZE = 1024
+
+# Fields captured by stm32f4-perf-check.py, as (name, NumPy type code).
+# time is the perf_counter() sample time and latency the time taken to read
+# the sample, in seconds.
+PERF_FIELDS = (
+    ('time', 'f8'),
+    ('latency', 'f8'),
+    ('cycles', 'u4'),
+    ('cpi_extra', 'u4'),
+    ('exception', 'u4'),
+    ('sleep', 'u4'),
+    ('lsu', 'u4'),
+    ('folded', 'u4'),
+    ('rom_bytes', 'u4'),
+)
+
+# Counter width in bits of each wrapping PERF_FIELDS field
+PERF_WIDTHS = {
+    'cycles': 32,
+    'cpi_extra': 8,
+    'exception': 8,
+    'sleep': 8,
+    'lsu': 8,
+    'folded': 8,
+    'rom_bytes': 32,
+}
+
+FORMATS = ('csv', 'npy', 'parquet')
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+# .npy headers are padded so the data starts on this boundary
+NPY_ALIGNMENT = 64
+
+# The widest row count the .npy header leaves room for
+NPY_MAX_ROWS = (1 << 64) - 1
+
+STRUCT_CODES = {'f8': 'd', 'f4': 'f', 'u4': 'I', 'i4': 'i', 'u8': 'Q', 'i8': 'q'}
+
+
+def capture_format(path):
+    """Return the capture format implied by a file's extension"""
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    if ext not in FORMATS:
+        raise ValueError(f"Unknown capture format '.{ext}' - use one of "
+                         f"{', '.join('.' + f for f in FORMATS)}")
+    return ext
+
+
+class CaptureWriter:
+    """Appends samples to a capture file in batches
+
+    Arguments:
+    - path: file to write, replacing any existing file
+    - fields: sequence of (name, NumPy type code) - codes are 'f8', 'f4',
+      'u4', 'i4', 'u8' or 'i8'
+    - batch_size: samples to buffer before writing
+    - format: one of FORMATS, or None to use the file extension
+    """
+
+    def __init__(self, path, fields, batch_size=DEFAULT_BATCH_SIZE, format=None):
+        self.path = path
+        self.fields = tuple(fields)
+        self.names = tuple(name for name, _ in self.fields)
+        self.batch_size = batch_size
+        self.format = format or capture_format(path)
+        self.rows = 0
+        self._batch = []
+
+        for name, code in self.fields:
+            if code not in STRUCT_CODES:
+                raise ValueError(f"Unsupported type '{code}' for field {name}")
+        if self.format == 'parquet' and pyarrow is None:
+            raise RuntimeError("pyarrow is required for Parquet - pip install pyarrow")
+
+        self._parquet = None
+        if self.format == 'csv':
+            self._file = open(path, 'w', newline='')
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(self.names)
+        elif self.format == 'npy':
+            self._file = open(path, 'wb')
+            self._row = struct.Struct('<' + ''.join(STRUCT_CODES[c] for _, c in self.fields))
+            # Sized for the widest shape, so the header can be rewritten in
+            # place with the final row count
+            prefix = len(NPY_MAGIC) + 2
+            widest = prefix + len(self._npy_header(NPY_MAX_ROWS)) + 1
+            self._header_len = -(-widest // NPY_ALIGNMENT) * NPY_ALIGNMENT - prefix
+            if self._header_len > 0xFFFF:
+                self._file.close()
+                raise ValueError(f"Too many fields for a .npy header - {len(self.fields)}")
+            self._write_npy_header()
+        else:
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def append(self, sample):
+        """Add a sample - a dict containing at least every field"""
+        self._batch.append(tuple(sample[name] for name in self.names))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write any buffered samples"""
+        if not self._batch:
+            return
+        if self.format == 'csv':
+            self._csv.writerows(self._batch)
+        elif self.format == 'npy':
+            self._file.write(b''.join(self._row.pack(*row) for row in self._batch))
+        else:
+            self._write_parquet()
+        self.rows += len(self._batch)
+        self._batch.clear()
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        """Write any buffered samples and finish the file"""
+        self.flush()
+        if self.format == 'npy' and not self._file.closed:
+            self._file.seek(0)
+            self._write_npy_header()
+        if self._file is not None:
+            self._file.close()
+        if self._parquet is not None:
+            self._parquet.close()
+            self._parquet = None
+
+    def _npy_header(self, rows):
+        descr = [(name, '<' + code) for name, code in self.fields]
+        return f"{{'descr': {descr!r}, 'fortran_order': False, 'shape': ({rows},), }}"
+
+    def _write_npy_header(self):
+        header = self._npy_header(self.rows).ljust(self._header_len - 1) + '\n'
+        self._file.write(NPY_MAGIC + struct.pack('<H', len(header)) + header.encode('latin1'))
+
+    def _write_parquet(self):
+        columns = list(zip(*self._batch))
+        types = {'f8': pyarrow.float64(), 'f4': pyarrow.float32(), 'u4': pyarrow.uint32(),
+                 'i4': pyarrow.int32(), 'u8': pyarrow.uint64(), 'i8': pyarrow.int64()}
+        table = pyarrow.table({name: pyarrow.array(column, type=types[code])
+                               for (name, code), column in zip(self.fields, columns)})
+        if self._parquet is None:
+            self._parquet = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self._parquet.write_table(table)
+
+
+#
+# Analysis
+#
+
+def _require_numpy():
+    if numpy is None:
+        raise RuntimeError("NumPy is required for capture analysis - pip install numpy")
+
+
+def load_capture(path):
+    """Load a capture file as a NumPy structured array"""
+    _require_numpy()
+    fmt = capture_format(path)
+    if fmt == 'npy':
+        return _load_npy(path)
+    if fmt == 'csv':
+        data = numpy.genfromtxt(path, delimiter=',', names=True, dtype=None, encoding='ascii')
+        return numpy.atleast_1d(data)
+    if pyarrow is None:
+        raise RuntimeError("pyarrow is required for Parquet - pip install pyarrow")
+    table = pyarrow.parquet.read_table(path)
+    dtype = [(name, table.column(name).type.to_pandas_dtype()) for name in table.column_names]
+    data = numpy.empty(table.num_rows, dtype=dtype)
+    for name in table.column_names:
+        data[name] = table.column(name).to_numpy()
+    return data
+
+
+def _load_npy(path):
+    with open(path, 'rb') as f:
+        if f.read(len(NPY_MAGIC))[:6] != NPY_MAGIC[:6]:
+            raise ValueError(f"{path} is not a .npy file")
+        header_len = struct.unpack('<H', f.read(2))[0]
+        header = ast.literal_eval(f.read(header_len).decode('latin1'))
+        offset = f.tell()
+    dtype = numpy.dtype(header['descr'])
+    # Use the file size rather than the header, in case the capture wasn't
+    # closed cleanly
+    rows = (os.path.getsize(path) - offset) // dtype.itemsize
+    return numpy.fromfile(path, dtype=dtype, count=rows, offset=offset)
+
+
+def deltas(values, width=32):
+    """Return the differences between successive samples of a wrapping counter
+
+    Each difference is taken modulo 2^width, so assumes at most one wrap
+    between samples.  Returns an int64 array one shorter than `values`.
+    """
+    _require_numpy()
+    values = numpy.asarray(values, dtype=numpy.int64)
+    return numpy.diff(values) % (1 << width)
+
+
+def rates(capture, field, width=None):
+    """Return the per-second rate of a counter field between samples"""
+    _require_numpy()
+    if width is None:
+        width = PERF_WIDTHS.get(field, 32)
+    return deltas(capture[field], width) / numpy.diff(capture['time'])
+
+
+def windowed_mean(capture, field, window, width=None):
+    """Return the true average rate of a counter over each `window` samples
+
+    Each rate is the counter's total change over the window divided by the
+    window's elapsed time - not the mean of per-sample rates, which
+    over-weights short intervals.
+    """
+    _require_numpy()
+    if width is None:
+        width = PERF_WIDTHS.get(field, 32)
+    counts = numpy.concatenate(([0], numpy.cumsum(deltas(capture[field], width))))
+    times = capture['time']
+    if len(times) <= window:
+        return numpy.empty(0)
+    return (counts[window:] - counts[:-window]) / (times[window:] - times[:-window])
+
+
+def summarise(capture, fields=None, percentiles=(1, 50, 99)):
+    """Return {field: stats} for the counter fields of a whole capture
+
+    stats holds the total count, the true average rate (total / elapsed),
+    and percentiles of the per-sample rate.  'period' and 'latency' give
+    percentiles of the sample period and read latency in seconds.
+    """
+    _require_numpy()
+    if fields is None:
+        fields = [name for name in capture.dtype.names if name in PERF_WIDTHS]
+    if len(capture) < 2:
+        return {}
+
+    elapsed = capture['time'][-1] - capture['time'][0]
+    result = {}
+    for field in fields:
+        counts = deltas(capture[field], PERF_WIDTHS.get(field, 32))
+        per_sample = counts / numpy.diff(capture['time'])
+        result[field] = {
+            'total': int(counts.sum()),
+            'mean_rate': counts.sum() / elapsed,
+            'percentiles': dict(zip(percentiles, numpy.percentile(per_sample, percentiles))),
+        }
+    result['period'] = {
+        'mean': elapsed / (len(capture) - 1),
+        'percentiles': dict(zip(percentiles, numpy.percentile(numpy.diff(capture['time']),
+                                                              percentiles))),
+    }
+    if 'latency' in capture.dtype.names:
+        result['latency'] = {
+            'mean': float(capture['latency'].mean()),
+            'percentiles': dict(zip(percentiles, numpy.percentile(capture['latency'],
+                                                                  percentiles))),
+        }
+    return result
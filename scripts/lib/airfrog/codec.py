@@ -0,0 +1,235 @@
+"""airfrog.codec - Fixed, exact-length frame codec for airfrog's binary API
+
+Requests are packed with precompiled `struct.Struct` objects directly into a
+preallocated `FrameBuffer`.  Responses are received with `recv_into()` into
+a `RecvRing`, a `memoryview`-backed receive buffer, and decoded in place.
+
+Bulk data is copied as raw little-endian bytes in both directions, so a 256
+word 0x12/0x13 frame costs a couple of memory copies rather than 256 Python
+ints.  Short reads are handled - the ring keeps receiving until the exact
+number of bytes needed is available.
+"""
+
+import array
+import struct
+import sys
+
+# Precompiled frame layouts.  All multi-byte fields are little-endian.
+CMD = struct.Struct('<B')
+SINGLE_READ = struct.Struct('<BB')
+SINGLE_WRITE = struct.Struct('<BBI')
+BULK_HEADER = struct.Struct('<BBH')
+MULTI_HEADER = struct.Struct('<BH')
+MULTI_ENTRY = struct.Struct('<BBI')
+CLOCK = struct.Struct('<BBH')
+SET_SPEED = struct.Struct('<BB')
+STATUS = struct.Struct('<B')
+WORD = struct.Struct('<I')
+COUNT = struct.Struct('<H')
+
+# Whether array('I') needs byteswapping to/from the wire format
+SWAP_WORDS = sys.byteorder != 'little'
+
+# Default buffer sizes.  Large enough for many maximum size bulk frames.
+DEFAULT_TX_SIZE = 64 * 1024
+DEFAULT_RX_SIZE = 64 * 1024
+
+
+def words_to_bytes(words):
+    """Return a little-endian byte view of `words`
+
+    `words` may be a bytes-like object (used as-is), an array('I') or any
+    other sequence of ints.
+    """
+    if isinstance(words, array.array):
+        if words.itemsize != 4:
+            raise ValueError("Word arrays must have 4 byte items")
+        if SWAP_WORDS:
+            words = array.array(words.typecode, words)
+            words.byteswap()
+        return memoryview(words).cast('B')
+    if isinstance(words, (bytes, bytearray, memoryview)):
+        view = memoryview(words).cast('B')
+        if len(view) % 4:
+            raise ValueError("Word data must be a multiple of 4 bytes")
+        return view
+    return memoryview(struct.pack(f'<{len(words)}I', *words))
+
+
+def bytes_to_words(data):
+    """Return an array('I') of the little-endian words in `data`"""
+    words = array.array('I')
+    words.frombytes(data)
+    if SWAP_WORDS:
+        words.byteswap()
+    return words
+
+
+class FrameBuffer:
+    """Preallocated transmit buffer that request frames are packed into
+
+    Each method packs one complete frame at the current offset and returns
+    False, without packing anything, if there isn't room for it.
+    """
+
+    __slots__ = ('buf', 'view', 'used')
+
+    def __init__(self, size=DEFAULT_TX_SIZE):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.used = 0
+
+    def __len__(self):
+        return self.used
+
+    def room(self):
+        """Return the number of free bytes"""
+        return len(self.buf) - self.used
+
+    def frame(self):
+        """Return a view of the packed frames"""
+        return self.view[:self.used]
+
+    def clear(self):
+        """Discard the packed frames"""
+        self.used = 0
+
+    def cmd(self, cmd):
+        """Pack a command with no parameters"""
+        return self._pack(CMD, cmd)
+
+    def single_read(self, cmd, reg):
+        """Pack a DP/AP Read"""
+        return self._pack(SINGLE_READ, cmd, reg)
+
+    def single_write(self, cmd, reg, value):
+        """Pack a DP/AP Write"""
+        return self._pack(SINGLE_WRITE, cmd, reg, value)
+
+    def bulk_read(self, cmd, reg, count):
+        """Pack an AP Bulk Read"""
+        return self._pack(BULK_HEADER, cmd, reg, count)
+
+    def bulk_write(self, cmd, reg, payload):
+        """Pack an AP Bulk Write, `payload` being little-endian word bytes"""
+        length = len(payload)
+        start = self.used + BULK_HEADER.size
+        if start + length > len(self.buf):
+            return False
+        BULK_HEADER.pack_into(self.buf, self.used, cmd, reg, length // 4)
+        self.view[start:start + length] = payload
+        self.used = start + length
+        return True
+
+    def multi_write(self, cmd, writes):
+        """Pack a Multi-reg Write of (reg_type, reg, value) tuples"""
+        length = MULTI_HEADER.size + len(writes) * MULTI_ENTRY.size
+        if self.used + length > len(self.buf):
+            return False
+        offset = self.used
+        MULTI_HEADER.pack_into(self.buf, offset, cmd, len(writes))
+        offset += MULTI_HEADER.size
+        for reg_type, reg, value in writes:
+            MULTI_ENTRY.pack_into(self.buf, offset, reg_type, reg, value)
+            offset += MULTI_ENTRY.size
+        self.used = offset
+        return True
+
+    def clock(self, cmd, levels, cycles):
+        """Pack a Clock"""
+        return self._pack(CLOCK, cmd, levels, cycles)
+
+    def set_speed(self, cmd, speed):
+        """Pack a Set Speed"""
+        return self._pack(SET_SPEED, cmd, speed)
+
+    def _pack(self, layout, *fields):
+        if self.used + layout.size > len(self.buf):
+            return False
+        layout.pack_into(self.buf, self.used, *fields)
+        self.used += layout.size
+        return True
+
+
+class RecvRing:
+    """memoryview-backed receive buffer
+
+    Data is received with `recv_into()` at the tail and consumed from the
+    head.  When a read needs more contiguous space than remains at the end of
+    the buffer, the unconsumed bytes are moved back to the start.  Each read
+    method blocks until exactly the number of bytes it needs is available.
+    """
+
+    __slots__ = ('buf', 'view', 'head', 'tail', 'sock', 'closed')
+
+    def __init__(self, size=DEFAULT_RX_SIZE):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.head = 0
+        self.tail = 0
+        self.sock = None
+        self.closed = None
+
+    def attach(self, sock, closed):
+        """Attach to a socket.  `closed` is the exception class raised on EOF."""
+        self.sock = sock
+        self.closed = closed
+        self.clear()
+
+    def clear(self):
+        """Discard any buffered data"""
+        self.head = 0
+        self.tail = 0
+
+    def available(self):
+        """Return the number of buffered bytes"""
+        return self.tail - self.head
+
+    def read_u8(self):
+        """Read a single byte"""
+        self._fill(1)
+        value = self.buf[self.head]
+        self.head += 1
+        return value
+
+    def read_u16(self):
+        """Read a little-endian u16"""
+        self._fill(2)
+        value = COUNT.unpack_from(self.buf, self.head)[0]
+        self.head += 2
+        return value
+
+    def read_u32(self):
+        """Read a little-endian u32"""
+        self._fill(4)
+        value = WORD.unpack_from(self.buf, self.head)[0]
+        self.head += 4
+        return value
+
+    def read_into(self, dest):
+        """Fill the writable bytes-like `dest` exactly"""
+        dest = memoryview(dest).cast('B')
+        offset = 0
+        length = len(dest)
+        while offset < length:
+            chunk = min(length - offset, len(self.buf))
+            self._fill(chunk)
+            dest[offset:offset + chunk] = self.view[self.head:self.head + chunk]
+            self.head += chunk
+            offset += chunk
+
+    def _fill(self, length):
+        if self.tail - self.head >= length:
+            return
+        if self.head == self.tail:
+            self.head = self.tail = 0
+        elif len(self.buf) - self.head < length:
+            pending = self.tail - self.head
+            self.view[:pending] = self.view[self.head:self.tail]
+            self.head = 0
+            self.tail = pending
+        while self.tail - self.head < length:
+            received = self.sock.recv_into(self.view[self.tail:])
+            if received == 0:
+                raise self.closed("airfrog closed the connection")
+            self.tail += received
@@ -0,0 +1,533 @@
+"""airfrog.defmt - Streaming decoder for defmt logs, e.g. from RTT
+
+defmt firmware doesn't send log text.  Each frame is the index of an
+interned format string, followed by the arguments in binary.  The format
+strings live in the firmware ELF, as the names of symbols in its `.defmt`
+section, whose values are the indices.  `Table.load()` reads them once and
+caches the table on disk (in ~/.cache/airfrog/defmt), keyed by the ELF's
+build ID or content hash:
+
+    table = Table.load("firmware.elf")
+    decoder = Decoder(table)
+    for data in chunks:                 # e.g. from airfrog.rtt.Rtt.poll()
+        for frame in decoder.feed(data):
+            print(format_frame(frame))
+
+`decode()` does the same for any iterable or generator of byte chunks.
+
+Frames are rzCOBS encoded by default: each is terminated by a zero byte,
+and decoded from its end.  The decoder splits the stream on zero bytes with
+`bytes.find()`, so the per-byte work is in the rzCOBS decoding alone, and
+format strings are compiled once per index, so it comfortably keeps up with
+a saturated RTT channel.  A frame which doesn't decode - for example the
+partial frame seen when attaching mid-stream, or after RTT dropped data -
+is counted in `Decoder.errors` and skipped.  Firmware using the raw
+encoding is decoded too, but raw frames can't be resynchronised.
+
+This follows the defmt 0.3 wire format (version 4) - 16-bit indices and
+32-bit lengths.  Source locations, which need DWARF, aren't decoded.
+"""
+
+import collections
+import json
+import os
+import re
+import struct
+
+from .elf import ElfFile
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'airfrog', 'defmt')
+
+# Bump when the cached table format changes
+TABLE_VERSION = 1
+
+DEFMT_SECTION = '.defmt'
+VERSION_SYMBOL = '_defmt_version_ = '
+ENCODING_SYMBOL = '_defmt_encoding_ = '
+
+ENCODING_RZCOBS = 'rzcobs'
+ENCODING_RAW = 'raw'
+
+# Log level by format string tag
+LEVELS = {
+    'defmt_trace': 'TRACE',
+    'defmt_debug': 'DEBUG',
+    'defmt_info': 'INFO',
+    'defmt_warn': 'WARN',
+    'defmt_error': 'ERROR',
+}
+TAG_PRINTLN = 'defmt_println'
+TAG_TIMESTAMP = 'defmt_timestamp'
+TAG_DERIVED = 'defmt_derived'
+
+# Fixed size argument types
+PRIMITIVES = {
+    'u8': struct.Struct('<B'),
+    'u16': struct.Struct('<H'),
+    'u32': struct.Struct('<I'),
+    'u64': struct.Struct('<Q'),
+    'i8': struct.Struct('<b'),
+    'i16': struct.Struct('<h'),
+    'i32': struct.Struct('<i'),
+    'i64': struct.Struct('<q'),
+    'usize': struct.Struct('<I'),
+    'isize': struct.Struct('<i'),
+    'f32': struct.Struct('<f'),
+    'f64': struct.Struct('<d'),
+}
+INDEX = struct.Struct('<H')
+LENGTH = struct.Struct('<I')
+
+# Terminates __internal_Debug and __internal_Display strings
+STRING_END = 0xFF
+
+# A parameter: `{0=u8:x}` or `{}`
+PARAM = re.compile(r'\{(\d*)(?:=([^}:]*))?(?::([^}]*))?\}|\{\{|\}\}')
+BITFIELD = re.compile(r'(\d+)\.\.(=?)(\d+)$')
+NUMBER_HINT = re.compile(r'(#?)(0\d+)?([xXbo])$')
+
+# A decoded log frame - level is None for println! and write! output, and
+# timestamp None if the firmware has none
+Frame = collections.namedtuple('Frame', 'index level timestamp message')
+
+
+class DefmtError(Exception):
+    """The ELF has no defmt table, or a frame is malformed"""
+
+
+class _Truncated(DefmtError):
+    """A frame ended before all of its arguments"""
+
+
+def rzcobs_decode(frame):
+    """Decode one rzCOBS frame, without its terminating zero, returning a bytearray
+
+    The frame is read from its end - each code byte follows the data it
+    describes:
+    - 0x01-0x7F: a group of 7 bytes, a set bit meaning a zero byte and a
+      clear one a literal byte
+    - 0x80-0xFE: 7 + (code & 0x7F) literal bytes, then a zero byte
+    - 0xFF: 134 literal bytes
+    Groups and runs left incomplete at the end of the frame decode as
+    trailing zeros, which the frame decoder ignores.
+    """
+    out = bytearray()
+    pos = len(frame)
+    while pos:
+        pos -= 1
+        code = frame[pos]
+        if code < 0x80:
+            if not code:
+                raise DefmtError("Zero byte within rzCOBS frame")
+            for bit in (0x40, 0x20, 0x10, 0x08, 0x04, 0x02, 0x01):
+                if code & bit:
+                    out.append(0)
+                else:
+                    if not pos:
+                        raise DefmtError("Truncated rzCOBS frame")
+                    pos -= 1
+                    out.append(frame[pos])
+            continue
+        if code == 0xFF:
+            count = 134
+        else:
+            count = (code & 0x7F) + 7
+            out.append(0)
+        if count > pos:
+            raise DefmtError("Truncated rzCOBS frame")
+        out += frame[pos - count:pos][::-1]
+        pos -= count
+    out.reverse()
+    return out
+
+
+class _Format:
+    """A compiled format string
+
+    segments is a list of literal strings and (arg, kind, hint) tuples, and
+    reads the (arg, kind) to read from the frame, in order.  Bitfields
+    sharing an argument are read together as one ('bitfield', first byte,
+    bytes) kind.
+    """
+
+    def __init__(self, string):
+        self.segments = []
+        types = {}
+        bitfields = {}
+        implicit = 0
+        literal = []
+        pos = 0
+        for match in PARAM.finditer(string):
+            literal.append(string[pos:match.start()])
+            pos = match.end()
+            token = match.group(0)
+            if token in ('{{', '}}'):
+                literal.append(token[0])
+                continue
+            index, kind, hint = match.groups()
+            if index:
+                arg = int(index)
+            else:
+                arg = implicit
+                implicit += 1
+            kind = kind or '?'
+            hint = hint or ''
+            bitfield = BITFIELD.match(kind)
+            if bitfield:
+                start = int(bitfield.group(1))
+                end = int(bitfield.group(3)) + (1 if bitfield.group(2) else 0)
+                low, high = bitfields.get(arg, (start, end))
+                bitfields[arg] = (min(low, start), max(high, end))
+                kind = (start, end)
+            else:
+                types.setdefault(arg, kind)
+            if literal:
+                self.segments.append(''.join(literal))
+                literal = []
+            self.segments.append((arg, kind, hint))
+        literal.append(string[pos:])
+        if ''.join(literal):
+            self.segments.append(''.join(literal))
+
+        for arg, (low, high) in bitfields.items():
+            first = low // 8
+            types[arg] = ('bitfield', first, (high - 1) // 8 + 1 - first)
+        self.reads = sorted(types.items())
+
+
+class Table:
+    """A firmware's defmt format strings
+
+    Arguments:
+    - entries: {index: (tag, format string)}
+    - encoding: ENCODING_RZCOBS or ENCODING_RAW
+    - version: the firmware's defmt wire format version, if known
+    """
+
+    def __init__(self, entries, encoding=ENCODING_RZCOBS, version=None):
+        self.entries = entries
+        self.encoding = encoding
+        self.version = version
+        self.timestamp = None
+        for index, (tag, _) in entries.items():
+            if tag == TAG_TIMESTAMP:
+                self.timestamp = index
+        self._compiled = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def from_elf(cls, elf):
+        """Build a table from an ElfFile's .defmt symbols"""
+        section_index = None
+        for index, section in enumerate(elf.sections):
+            if section.name == DEFMT_SECTION:
+                section_index = index
+        if section_index is None:
+            raise DefmtError(f"No {DEFMT_SECTION} section - is this defmt firmware?")
+
+        entries = {}
+        encoding = ENCODING_RZCOBS
+        version = None
+        for symbol in elf.symbols():
+            if symbol.name.startswith(VERSION_SYMBOL):
+                version = symbol.name[len(VERSION_SYMBOL):]
+            elif symbol.name.startswith(ENCODING_SYMBOL):
+                encoding = symbol.name[len(ENCODING_SYMBOL):]
+            elif symbol.shndx == section_index and symbol.name.startswith('{'):
+                try:
+                    info = json.loads(symbol.name)
+                    entries[symbol.value] = (info['tag'], info['data'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+        if encoding not in (ENCODING_RZCOBS, ENCODING_RAW):
+            raise DefmtError(f"Unsupported defmt encoding '{encoding}'")
+        return cls(entries, encoding, version)
+
+    @classmethod
+    def load(cls, path, cache_dir=DEFAULT_CACHE_DIR):
+        """Return the table for an ELF file, using the cached copy if there is one"""
+        elf = ElfFile(path)
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, f"{elf.fingerprint()}.json")
+            try:
+                with open(cache_path) as f:
+                    cached = json.load(f)
+                if cached.get('version') == TABLE_VERSION:
+                    return cls({index: (tag, string) for index, tag, string in cached['entries']},
+                               cached['encoding'], cached['defmt_version'])
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+        table = cls.from_elf(elf)
+        if cache_path is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp = f"{cache_path}.tmp"
+                with open(tmp, 'w') as f:
+                    json.dump({'version': TABLE_VERSION, 'elf': os.path.abspath(path),
+                               'encoding': table.encoding, 'defmt_version': table.version,
+                               'entries': [[index, tag, string] for index, (tag, string)
+                                           in sorted(table.entries.items())]}, f)
+                os.replace(tmp, cache_path)
+            except OSError:
+                pass
+        return table
+
+    def compiled(self, index):
+        """Return the tag and _Format for an index, compiling it on first use
+
+        Derived enums' formats are a list of a _Format per variant.
+        """
+        try:
+            return self._compiled[index]
+        except KeyError:
+            pass
+        try:
+            tag, string = self.entries[index]
+        except KeyError:
+            raise DefmtError(f"Unknown format index {index}") from None
+        if tag == TAG_DERIVED and '|' in string:
+            compiled = (tag, [_Format(variant) for variant in _split_variants(string)])
+        else:
+            compiled = (tag, _Format(string))
+        self._compiled[index] = compiled
+        return compiled
+
+
+def _split_variants(string):
+    """Split a derived enum's format string on the '|'s between its variants"""
+    variants = []
+    depth = 0
+    start = 0
+    for pos, char in enumerate(string):
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+        elif char == '|' and not depth:
+            variants.append(string[start:pos])
+            start = pos + 1
+    variants.append(string[start:])
+    return variants
+
+
+class Decoder:
+    """Incremental defmt frame decoder
+
+    Arguments:
+    - table: the firmware's Table
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.frames = 0
+        self.errors = 0
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        """Add received bytes, yielding each Frame they complete"""
+        buffer = self._buffer
+        buffer += data
+        if self.table.encoding == ENCODING_RAW:
+            yield from self._feed_raw()
+            return
+
+        start = 0
+        while True:
+            end = buffer.find(0, start)
+            if end < 0:
+                break
+            if end > start:
+                try:
+                    frame = self.decode_frame(rzcobs_decode(buffer[start:end]))
+                except DefmtError:
+                    self.errors += 1
+                else:
+                    self.frames += 1
+                    yield frame
+            start = end + 1
+        del buffer[:start]
+
+    def _feed_raw(self):
+        buffer = self._buffer
+        while buffer:
+            try:
+                frame, length = self._decode(buffer)
+            except _Truncated:
+                return
+            except DefmtError:
+                # Raw frames can't be resynchronised
+                self.errors += 1
+                buffer.clear()
+                return
+            del buffer[:length]
+            self.frames += 1
+            yield frame
+
+    def decode_frame(self, data):
+        """Decode one complete, unencoded frame, returning a Frame
+
+        Trailing zero bytes are ignored, as rzCOBS can leave them.
+        """
+        frame, length = self._decode(data)
+        if any(data[length:]):
+            raise DefmtError("Data after end of frame")
+        return frame
+
+    def _decode(self, data):
+        reader = _Reader(self.table, data)
+        index = reader.index()
+        tag, _ = self.table.compiled(index)
+        timestamp = None
+        if (tag in LEVELS or tag == TAG_PRINTLN) and self.table.timestamp is not None:
+            timestamp = reader.format(self.table.timestamp)
+        message = reader.format(index)
+        return Frame(index, LEVELS.get(tag), timestamp, message), reader.pos
+
+
+class _Reader:
+    """Reads a frame's arguments, rendering them through their format strings"""
+
+    def __init__(self, table, data):
+        self.table = table
+        self.data = data
+        self.pos = 0
+
+    def take(self, count):
+        end = self.pos + count
+        if end > len(self.data):
+            raise _Truncated("Truncated defmt frame")
+        data = self.data[self.pos:end]
+        self.pos = end
+        return data
+
+    def unpack(self, layout):
+        if self.pos + layout.size > len(self.data):
+            raise _Truncated("Truncated defmt frame")
+        value, = layout.unpack_from(self.data, self.pos)
+        self.pos += layout.size
+        return value
+
+    def index(self):
+        return self.unpack(INDEX)
+
+    def format(self, index):
+        """Read the arguments of format `index`, returning the rendered string"""
+        tag, compiled = self.table.compiled(index)
+        if isinstance(compiled, list):
+            discriminant = self.unpack(PRIMITIVES['u8'] if len(compiled) <= 256 else INDEX)
+            if discriminant >= len(compiled):
+                raise DefmtError(f"Bad enum discriminant {discriminant} for format {index}")
+            compiled = compiled[discriminant]
+
+        values = {arg: self.value(kind) for arg, kind in compiled.reads}
+        parts = []
+        for segment in compiled.segments:
+            if isinstance(segment, str):
+                parts.append(segment)
+            else:
+                arg, kind, hint = segment
+                parts.append(render(values[arg], kind, hint))
+        return ''.join(parts)
+
+    def value(self, kind):
+        layout = PRIMITIVES.get(kind)
+        if layout is not None:
+            return self.unpack(layout)
+        if isinstance(kind, tuple):
+            _, first, count = kind
+            return int.from_bytes(self.take(count), 'little') << (first * 8)
+        if kind == '?':
+            return self.format(self.index())
+        if kind == 'bool':
+            return bool(self.unpack(PRIMITIVES['u8']))
+        if kind == 'char':
+            return chr(self.unpack(PRIMITIVES['u32']))
+        if kind in ('u128', 'i128'):
+            return int.from_bytes(self.take(16), 'little', signed=kind == 'i128')
+        if kind == 'str':
+            return bytes(self.take(self.unpack(LENGTH))).decode('utf-8', 'replace')
+        if kind == 'istr':
+            index = self.index()
+            try:
+                return self.table.entries[index][1]
+            except KeyError:
+                raise DefmtError(f"Unknown interned string {index}") from None
+        if kind == '[u8]':
+            return bytes(self.take(self.unpack(LENGTH)))
+        if kind == '[?]':
+            # The length, then the elements' format index once, then each
+            # element's data
+            count = self.unpack(LENGTH)
+            index = self.index()
+            return [self.format(index) for _ in range(count)]
+        if kind in ('__internal_Debug', '__internal_Display'):
+            end = self.data.find(STRING_END, self.pos)
+            if end < 0:
+                raise _Truncated("Truncated defmt frame")
+            text = bytes(self.data[self.pos:end]).decode('utf-8', 'replace')
+            self.pos = end + 1
+            return text
+        if kind == '__internal_FormatSequence':
+            parts = []
+            while True:
+                index = self.index()
+                if not index:
+                    return ''.join(parts)
+                parts.append(self.format(index))
+        if kind.startswith('[u8;'):
+            return bytes(self.take(int(kind[4:-1])))
+        raise DefmtError(f"Unsupported defmt type '{kind}'")
+
+
+def render(value, kind, hint):
+    """Render a decoded value with its display hint"""
+    if isinstance(kind, tuple) and len(kind) == 2:
+        start, end = kind
+        value = (value >> start) & ((1 << (end - start)) - 1)
+        if not hint:
+            hint = '#b'
+    if isinstance(value, bytes):
+        if hint == 'a':
+            return "b\"" + ''.join(chr(byte) if 0x20 <= byte < 0x7F and byte != 0x22
+                                   else f"\\x{byte:02x}" for byte in value) + "\""
+        return '[' + ', '.join(render(byte, 'u8', hint) for byte in value) + ']'
+    if isinstance(value, list):
+        return '[' + ', '.join(value) + ']'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, int):
+        if hint in ('us', 'ms'):
+            divisor = 1_000_000 if hint == 'us' else 1000
+            return f"{value // divisor}.{value % divisor:0{len(str(divisor)) - 1}}"
+        number = NUMBER_HINT.match(hint)
+        if number:
+            alternate, width, base = number.groups()
+            return format(value, f"{alternate}{width or ''}{base}")
+        return str(value)
+    if isinstance(value, float):
+        return repr(value)
+    if kind == 'str' and hint == '?':
+        return f'"{value}"'
+    return str(value)
+
+
+def decode(table, chunks):
+    """Yield the Frames decoded from an iterable of byte chunks"""
+    decoder = Decoder(table)
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+
+
+def format_frame(frame):
+    """Return a frame as a log line"""
+    parts = []
+    if frame.timestamp is not None:
+        parts.append(frame.timestamp)
+    if frame.level is not None:
+        parts.append(f"{frame.level:<5}")
+    parts.append(frame.message)
+    return ' '.join(parts)
@@ -0,0 +1,186 @@
+"""airfrog.dump - Resumable target memory dumps
+
+`dump()` reads a region of target memory over either transport (see
+`airfrog.transport`) straight into a memory-mapped output file, which is
+preallocated to the region's size, so data is never copied through
+intermediate buffers:
+
+    with open_transport("bin://192.168.0.103") as transport:
+        transport.reset_target()
+        result = dump(transport, 0x08000000, 1024 * 1024, "flash.bin")
+        print(result)
+
+Progress is checkpointed to a sidecar file (`flash.bin.progress`) as the
+dump runs - the mapped file is flushed first, so the sidecar never claims
+data which isn't on disk.  If the dump is interrupted, by Ctrl+C or a lost
+connection, running it again with the same address and size resumes from
+the last checkpoint.  The sidecar is removed once the dump completes.
+
+With `verify`, each chunk is read a second time and compared, and re-read
+until two reads agree.  That catches corrupted transfers when dumping
+flash, but RAM which the target is changing will rarely verify.
+"""
+
+import collections
+import json
+import mmap
+import os
+import time
+
+# Appended to the output path to name the progress sidecar
+PROGRESS_SUFFIX = '.progress'
+
+# Bump when the sidecar format changes
+PROGRESS_VERSION = 1
+
+# Bytes read per chunk - each is a pipelined run of bulk reads
+DEFAULT_CHUNK_BYTES = 64 * 1024
+
+# Reads of a chunk, beyond the first pair, to get two which agree
+DEFAULT_RETRIES = 3
+
+# Seconds between progress checkpoints
+CHECKPOINT_INTERVAL = 1.0
+
+# A finished dump - nbytes is the whole region, resumed_from the offset the
+# dump resumed at, and read the bytes read this time (excluding verify reads)
+DumpResult = collections.namedtuple('DumpResult', 'path nbytes resumed_from read elapsed retries')
+
+
+class DumpError(Exception):
+    """A chunk never read the same way twice"""
+
+
+def progress_path(path):
+    """Return the progress sidecar's path for an output file"""
+    return path + PROGRESS_SUFFIX
+
+
+def load_progress(path, addr, nbytes):
+    """Return the offset an interrupted dump of this region got to, or 0"""
+    try:
+        with open(progress_path(path)) as f:
+            progress = json.load(f)
+        if (progress.get('version') != PROGRESS_VERSION or progress.get('addr') != addr
+                or progress.get('nbytes') != nbytes or os.path.getsize(path) != nbytes):
+            return 0
+        done = progress['done']
+    except (OSError, ValueError, KeyError, TypeError):
+        return 0
+    return done if isinstance(done, int) and 0 <= done <= nbytes else 0
+
+
+def save_progress(path, addr, nbytes, done):
+    """Record how far a dump has got"""
+    sidecar = progress_path(path)
+    tmp = f"{sidecar}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({'version': PROGRESS_VERSION, 'addr': addr, 'nbytes': nbytes, 'done': done}, f)
+    os.replace(tmp, sidecar)
+
+
+def dump(transport, addr, nbytes, path, chunk_bytes=DEFAULT_CHUNK_BYTES, verify=False,
+         retries=DEFAULT_RETRIES, resume=True, progress=None):
+    """Dump `nbytes` of target memory from `addr` to the file `path`
+
+    Arguments:
+    - transport: an `airfrog.transport` transport, with the target connected
+    - addr, nbytes: the region, which must be word aligned
+    - path: the output file
+    - chunk_bytes: bytes to read between checks for a checkpoint
+    - verify: read each chunk twice, re-reading until two reads agree
+    - retries: re-reads allowed per chunk when verifying
+    - resume: carry on from an interrupted dump of the same region, rather
+      than starting again
+    - progress: called with (done, nbytes, elapsed) at each checkpoint
+
+    Returns a DumpResult.  Raises DumpError if a chunk doesn't verify - the
+    dump can then be resumed from that chunk.
+    """
+    if addr % 4 or nbytes % 4:
+        raise ValueError("Address and size must be word aligned")
+    if nbytes <= 0:
+        raise ValueError("Size must be positive")
+    if chunk_bytes <= 0 or chunk_bytes % 4:
+        raise ValueError("Chunk size must be a positive number of words")
+
+    done = load_progress(path, addr, nbytes) if resume else 0
+    resumed_from = done
+    retried = 0
+    start = last_checkpoint = time.perf_counter()
+
+    with open(path, 'r+b' if done else 'w+b') as f:
+        _preallocate(f, nbytes)
+        mapped = mmap.mmap(f.fileno(), nbytes)
+        view = memoryview(mapped)
+        check = bytearray(min(chunk_bytes, nbytes)) if verify else None
+        try:
+            while done < nbytes:
+                count = min(chunk_bytes, nbytes - done)
+                with view[done:done + count] as chunk:
+                    transport.read_memory_into(addr + done, chunk)
+                    if verify:
+                        retried += _verify(transport, addr + done, chunk,
+                                           memoryview(check)[:count], retries)
+                done += count
+
+                now = time.perf_counter()
+                if now - last_checkpoint >= CHECKPOINT_INTERVAL and done < nbytes:
+                    _checkpoint(mapped, path, addr, nbytes, done)
+                    last_checkpoint = now
+                    if progress is not None:
+                        progress(done, nbytes, now - start)
+        finally:
+            view.release()
+            if done < nbytes:
+                # Interrupted - record what was read, for a resume
+                _checkpoint(mapped, path, addr, nbytes, done)
+            else:
+                mapped.flush()
+            _close(mapped)
+
+    try:
+        os.remove(progress_path(path))
+    except FileNotFoundError:
+        pass
+    elapsed = time.perf_counter() - start
+    if progress is not None:
+        progress(done, nbytes, elapsed)
+    return DumpResult(path, nbytes, resumed_from, nbytes - resumed_from, elapsed, retried)
+
+
+def _verify(transport, addr, chunk, check, retries):
+    """Re-read a chunk until two reads agree, returning the re-reads needed beyond one"""
+    for attempt in range(retries + 1):
+        transport.read_memory_into(addr, check)
+        if check == chunk:
+            return attempt
+        # Keep the latest read, to compare against the next
+        chunk[:] = check
+    raise DumpError(f"Chunk at 0x{addr:08X} read differently {retries + 2} times")
+
+
+def _close(mapped):
+    try:
+        mapped.close()
+    except BufferError:
+        # An interrupted read's traceback still holds views of the map - it
+        # is unmapped once they're freed
+        pass
+
+
+def _checkpoint(mapped, path, addr, nbytes, done):
+    mapped.flush()
+    save_progress(path, addr, nbytes, done)
+
+
+def _preallocate(f, nbytes):
+    """Size the file, allocating its blocks up front where the OS can"""
+    if os.fstat(f.fileno()).st_size != nbytes:
+        f.truncate(nbytes)
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(f.fileno(), 0, nbytes)
+        except OSError:
+            # Not supported by every filesystem - the file is still sized
+            pass
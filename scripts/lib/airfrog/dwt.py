@@ -0,0 +1,163 @@
+"""airfrog.dwt - Unwrapping and interpreting Cortex-M DWT profiling counters
+
+The DWT's CYCCNT is 32 bits, but CPICNT, EXCCNT, SLEEPCNT, LSUCNT and
+FOLDCNT are only 8 bits (ARM DDI0403), so they wrap every 256 events.
+`Unwrapper` extends each counter to 64 bits by accumulating the modular
+difference between samples:
+
+    unwrapper = Unwrapper(sysclk=100_000_000)
+    for sample in samples:
+        deltas = unwrapper.update(sample, sample['time'])
+        if deltas is not None:
+            print(workload_profile(deltas))
+
+A modular difference is only correct if the counter wrapped at most once
+between samples.  Each 8-bit counter counts at most once per cycle, so a
+delta is ambiguous once 256 or more cycles have elapsed -
+`required_sample_rate()` gives the rate needed to avoid that.  At typical
+SYSCLKs this is hundreds of thousands of samples per second, well beyond
+what airfrog can manage, so ambiguous deltas are reported in
+`Deltas.ambiguous` rather than silently trusted.
+
+CYCCNT wraps every 2^32 cycles (43s at 100MHz).  If the sample times and
+SYSCLK are known, whole wraps between samples are recovered from the
+elapsed time.
+"""
+
+import collections
+
+DWT_CTRL = 0xE0001000
+DWT_CYCCNT = 0xE0001004
+
+# DWT_CTRL bits enabling CYCCNT and the CPI, EXC, SLEEP, LSU and FOLD counters
+DWT_CTRL_COUNTERS = (1 << 21) | (1 << 20) | (1 << 19) | (1 << 18) | (1 << 17) | (1 << 0)
+
+# Counter widths in bits, by the sample keys used by stm32f4-perf-check.py,
+# in register order from DWT_CYCCNT
+COUNTER_WIDTHS = {
+    'cycles': 32,       # CYCCNT
+    'cpi_extra': 8,     # CPICNT - extra cycles taken by multi-cycle instructions
+    'exception': 8,     # EXCCNT - exception entry and exit overhead cycles
+    'sleep': 8,         # SLEEPCNT - cycles spent sleeping
+    'lsu': 8,           # LSUCNT - extra cycles taken by loads and stores
+    'folded': 8,        # FOLDCNT - instructions folded, taking no cycles
+}
+
+CYCLES = 'cycles'
+
+MASK_64 = (1 << 64) - 1
+
+# The change in each counter since the previous sample, and the names of
+# those which may have wrapped more than once
+Deltas = collections.namedtuple('Deltas', 'counts elapsed ambiguous')
+
+
+def required_sample_rate(sysclk, width=8):
+    """Return the samples per second needed to see every wrap of a counter
+
+    A counter of `width` bits incrementing at most once per cycle wraps at
+    most once between samples if they are less than 2^width cycles apart.
+    """
+    return sysclk / (1 << width)
+
+
+class Unwrapper:
+    """Extends wrapping DWT counters to 64 bits
+
+    Arguments:
+    - sysclk: the CPU clock in Hz, used to recover whole CYCCNT wraps from
+      sample times - None to ignore sample times
+    - widths: {name: width in bits} of the counters to track
+    """
+
+    def __init__(self, sysclk=None, widths=COUNTER_WIDTHS):
+        self.sysclk = sysclk
+        self.widths = dict(widths)
+        self.totals = None
+        self.elapsed = 0.0
+        self.samples = 0
+        self.ambiguous_samples = 0
+        self._previous = None
+        self._previous_time = None
+
+    def update(self, sample, time=None):
+        """Add a sample of raw counter values, returning Deltas
+
+        Returns None for the first sample, which only sets the starting
+        point.  `time` is the sample time in seconds, e.g. its perf_counter()
+        timestamp.
+        """
+        raw = {name: sample[name] for name in self.widths}
+        if self._previous is None:
+            self._previous = raw
+            self._previous_time = time
+            self.totals = {name: 0 for name in self.widths}
+            return None
+
+        elapsed = None
+        if time is not None and self._previous_time is not None:
+            elapsed = time - self._previous_time
+
+        counts = {}
+        for name, width in self.widths.items():
+            counts[name] = (raw[name] - self._previous[name]) % (1 << width)
+
+        if CYCLES in counts and elapsed is not None and self.sysclk:
+            # Add any whole wraps of CYCCNT that the elapsed time implies
+            period = 1 << self.widths[CYCLES]
+            wraps = round((elapsed * self.sysclk - counts[CYCLES]) / period)
+            counts[CYCLES] += max(0, wraps) * period
+
+        ambiguous = self._ambiguous(counts, elapsed)
+
+        for name, count in counts.items():
+            self.totals[name] = (self.totals[name] + count) & MASK_64
+        self.samples += 1
+        if elapsed is not None:
+            self.elapsed += elapsed
+        if ambiguous:
+            self.ambiguous_samples += 1
+        self._previous = raw
+        self._previous_time = time
+        return Deltas(counts, elapsed, ambiguous)
+
+    def _ambiguous(self, counts, elapsed):
+        if CYCLES in counts:
+            cycles = counts[CYCLES]
+        elif elapsed is not None and self.sysclk:
+            cycles = elapsed * self.sysclk
+        else:
+            # No way to tell how many cycles passed
+            return tuple(name for name, width in self.widths.items() if width < 64)
+        return tuple(name for name, width in self.widths.items()
+                     if name != CYCLES and cycles >= 1 << width)
+
+
+def workload_profile(counts):
+    """Return the percentage of cycles spent in each activity
+
+    `counts` maps counter names to the number of events over some interval,
+    e.g. `Deltas.counts` or `Unwrapper.totals`.  Returns a dict with 'busy',
+    'sleep', 'exception', 'lsu' and 'cpi' percentages, plus 'instructions'
+    executed (estimated per ARM DDI0403) and 'ipc'.
+    """
+    if isinstance(counts, Deltas):
+        counts = counts.counts
+    cycles = counts[CYCLES]
+    if not cycles:
+        return None
+
+    def percent(name):
+        return 100.0 * counts[name] / cycles
+
+    instructions = max(0, cycles - counts['cpi_extra'] - counts['exception']
+                       - counts['sleep'] - counts['lsu'] + counts['folded'])
+    return {
+        'busy': 100.0 - percent('sleep'),
+        'sleep': percent('sleep'),
+        'exception': percent('exception'),
+        'lsu': percent('lsu'),
+        'cpi': percent('cpi_extra'),
+        'instructions': instructions,
+        'ipc': instructions / cycles,
+    }
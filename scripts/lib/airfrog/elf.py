@@ -0,0 +1,256 @@
+"""airfrog.elf - Minimal ELF reader and address symbolisation for target firmware
+
+Reads the section headers, symbol table and GNU build ID of a firmware ELF
+file, without any dependencies:
+
+    elf = ElfFile("firmware.elf")
+    print(elf.build_id, elf.section('.text'))
+
+`SymbolIndex` maps code addresses to function names with a binary search
+over a sorted index of the ELF's function symbols.  Building the index
+means parsing the whole symbol table, so `SymbolIndex.load()` caches it on
+disk (in ~/.cache/airfrog/symbols), keyed by the ELF's build ID or content
+hash, and memoises lookups - profiles look up the same few addresses many
+times:
+
+    symbols = SymbolIndex.load("firmware.elf")
+    print(symbols.lookup(0x08001234))      # ('main', 0x1C)
+"""
+
+import bisect
+import collections
+import hashlib
+import json
+import os
+import struct
+
+ELF_MAGIC = b'\x7fELF'
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+
+SHT_SYMTAB = 2
+SHT_NOTE = 7
+SHT_NOBITS = 8
+
+STT_NOTYPE = 0
+STT_OBJECT = 1
+STT_FUNC = 2
+
+SHN_UNDEF = 0
+
+NT_GNU_BUILD_ID = 3
+
+# Index cache file format version
+INDEX_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'airfrog', 'symbols')
+
+Section = collections.namedtuple('Section', 'name type flags addr offset size')
+
+Symbol = collections.namedtuple('Symbol', 'name value size type bind shndx')
+
+
+class ElfError(Exception):
+    """The file isn't an ELF file this module can read"""
+
+
+class ElfFile:
+    """An ELF file's sections and symbols
+
+    Arguments:
+    - path: the ELF file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        data = self.data
+        if data[:4] != ELF_MAGIC:
+            raise ElfError(f"{path} is not an ELF file")
+        elf_class, encoding = data[4], data[5]
+        if elf_class not in (ELFCLASS32, ELFCLASS64):
+            raise ElfError(f"{path} has unknown ELF class {elf_class}")
+        self.is64 = elf_class == ELFCLASS64
+        self.endian = '<' if encoding == ELFDATA2LSB else '>'
+
+        if self.is64:
+            shoff, = struct.unpack_from(self.endian + 'Q', data, 0x28)
+            shentsize, shnum, shstrndx = struct.unpack_from(self.endian + 'HHH', data, 0x3A)
+        else:
+            shoff, = struct.unpack_from(self.endian + 'I', data, 0x20)
+            shentsize, shnum, shstrndx = struct.unpack_from(self.endian + 'HHH', data, 0x2E)
+
+        headers = []
+        for index in range(shnum):
+            offset = shoff + index * shentsize
+            if self.is64:
+                name, type_, flags, addr, off, size = struct.unpack_from(
+                    self.endian + 'IIQQQQ', data, offset)
+                link, = struct.unpack_from(self.endian + 'I', data, offset + 0x28)
+            else:
+                name, type_, flags, addr, off, size, link = struct.unpack_from(
+                    self.endian + 'IIIIIII', data, offset)
+            headers.append((name, type_, flags, addr, off, size, link))
+
+        names_offset = headers[shstrndx][4] if headers else 0
+        self.sections = []
+        self._links = []
+        for name, type_, flags, addr, off, size, link in headers:
+            self.sections.append(Section(self._string(names_offset + name), type_, flags,
+                                         addr, off, size))
+            self._links.append(link)
+
+    def section(self, name):
+        """Return the named Section, or None"""
+        for section in self.sections:
+            if section.name == name:
+                return section
+        return None
+
+    def section_data(self, section):
+        """Return a section's contents, given a Section or its name"""
+        if isinstance(section, str):
+            section = self.section(section)
+            if section is None:
+                return b''
+        if section.type == SHT_NOBITS:
+            return bytes(section.size)
+        return self.data[section.offset:section.offset + section.size]
+
+    def symbols(self):
+        """Yield every Symbol in the symbol table"""
+        for index, section in enumerate(self.sections):
+            if section.type != SHT_SYMTAB:
+                continue
+            strtab = self.sections[self._links[index]].offset
+            if self.is64:
+                layout, entry_size = self.endian + 'IBBHQQ', 24
+            else:
+                layout, entry_size = self.endian + 'IIIBBH', 16
+            for offset in range(section.offset, section.offset + section.size, entry_size):
+                if self.is64:
+                    name, info, _, shndx, value, size = struct.unpack_from(layout, self.data, offset)
+                else:
+                    name, value, size, info, _, shndx = struct.unpack_from(layout, self.data, offset)
+                yield Symbol(self._string(strtab + name), value, size, info & 0xF, info >> 4, shndx)
+
+    def symbol(self, name):
+        """Return the first Symbol with this name, or None"""
+        for symbol in self.symbols():
+            if symbol.name == name:
+                return symbol
+        return None
+
+    @property
+    def build_id(self):
+        """The GNU build ID as a hex string, or None if there isn't one"""
+        for section in self.sections:
+            if section.type != SHT_NOTE:
+                continue
+            data = self.section_data(section)
+            offset = 0
+            while offset + 12 <= len(data):
+                namesz, descsz, note_type = struct.unpack_from(self.endian + 'III', data, offset)
+                name_end = offset + 12 + ((namesz + 3) & ~3)
+                desc_end = name_end + ((descsz + 3) & ~3)
+                if note_type == NT_GNU_BUILD_ID and data[offset + 12:offset + 15] == b'GNU':
+                    return data[name_end:name_end + descsz].hex()
+                offset = desc_end
+        return None
+
+    def fingerprint(self):
+        """Return a string identifying this exact build - its build ID, or a content hash"""
+        return self.build_id or hashlib.sha256(self.data).hexdigest()
+
+    def _string(self, offset):
+        end = self.data.find(b'\0', offset)
+        return self.data[offset:end].decode('utf-8', 'replace')
+
+
+class SymbolIndex:
+    """Sorted index of function address ranges
+
+    Arguments:
+    - functions: iterable of (start, size, name)
+    """
+
+    def __init__(self, functions):
+        functions = sorted(functions)
+        self.starts = [start for start, _, _ in functions]
+        self.ends = []
+        self.names = [name for _, _, name in functions]
+        for index, (start, size, _) in enumerate(functions):
+            if not size:
+                # Unsized symbols (e.g. from assembly) run to the next one
+                size = functions[index + 1][0] - start if index + 1 < len(functions) else 0
+            self.ends.append(start + size)
+        self._memo = {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def from_elf(cls, elf):
+        """Build an index from an ElfFile's function symbols"""
+        functions = {}
+        for symbol in elf.symbols():
+            if symbol.type != STT_FUNC or symbol.shndx == SHN_UNDEF or not symbol.name:
+                continue
+            # Clear the Thumb bit
+            start = symbol.value & ~1
+            # Prefer sized and global symbols where several share an address
+            existing = functions.get(start)
+            if existing is None or (symbol.size, symbol.bind) > (existing[1], existing[2]):
+                functions[start] = (symbol.name, symbol.size, symbol.bind)
+        return cls((start, size, name) for start, (name, size, _) in functions.items())
+
+    @classmethod
+    def load(cls, path, cache_dir=DEFAULT_CACHE_DIR):
+        """Return the index for an ELF file, using the cached copy if there is one"""
+        elf = ElfFile(path)
+        cache_path = None
+        if cache_dir is not None:
+            cache_path = os.path.join(cache_dir, f"{elf.fingerprint()}.json")
+            try:
+                with open(cache_path) as f:
+                    cached = json.load(f)
+                if cached.get('version') == INDEX_VERSION:
+                    return cls(zip(cached['starts'], cached['sizes'], cached['names']))
+            except (OSError, ValueError, KeyError):
+                pass
+
+        index = cls.from_elf(elf)
+        if cache_path is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp = f"{cache_path}.tmp"
+                with open(tmp, 'w') as f:
+                    json.dump({'version': INDEX_VERSION, 'elf': os.path.abspath(path),
+                               'starts': index.starts,
+                               'sizes': [end - start for start, end in zip(index.starts, index.ends)],
+                               'names': index.names}, f)
+                os.replace(tmp, cache_path)
+            except OSError:
+                pass
+        return index
+
+    def lookup(self, addr):
+        """Return (function name, offset) containing addr, or None"""
+        try:
+            return self._memo[addr]
+        except KeyError:
+            pass
+        result = None
+        index = bisect.bisect_right(self.starts, addr) - 1
+        if index >= 0 and addr < self.ends[index]:
+            result = (self.names[index], addr - self.starts[index])
+        self._memo[addr] = result
+        return result
+
+    def name(self, addr):
+        """Return the name of the function containing addr, or a placeholder"""
+        found = self.lookup(addr)
+        return found[0] if found is not None else f"[0x{addr:08X}]"
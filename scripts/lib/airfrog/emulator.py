@@ -0,0 +1,1268 @@
+"""airfrog.emulator - airfrog binary and REST API emulators
+
+`Emulator` serves airfrog's binary API (docs/BINARY-API.md) on a TCP port,
+and `RestEmulator` serves the target, raw, SWD config and RTT parts of its
+REST API (docs/REST-API.md) over HTTP.  Both are backed by an
+`airfrog.sim.SimTarget`, so host tooling can be developed and benchmarked
+without hardware:
+
+    target = SimTarget()
+    with Emulator(target, port=4146, link=LinkModel(rtt=0.004)) as emu:
+        with Client("127.0.0.1") as client:
+            ...
+
+Binary API commands are handled as the firmware handles them - responses are
+a status byte plus any data, errors send the status byte alone, an invalid
+argument sends RSP_ERR_API and closes the connection, and an unknown command
+closes the connection without a response.  Bulk transfers turn on TAR
+auto-increment and always transfer via DRW.
+
+REST responses have the firmware's JSON shapes, error kinds and status codes,
+including its quirks - errors detected while parsing a request aren't wrapped
+in an "error" object, and target errors other than 400, 404 and 500 are
+returned with status 200.  Errors and extra latency can be injected.
+
+`LinkModel` delays each response by the time it would take a real airfrog:
+half the network round trip each way, the link's bandwidth, and the SWD time
+for the command's transactions at the current speed.  The target is only
+ever busy with one transaction at a time, so pipelined commands overlap their
+network latency but not their SWD time, as on hardware.  Share one LinkModel
+between an Emulator and a RestEmulator to emulate both APIs of one airfrog.
+"""
+
+import collections
+import http.server
+import json
+import random
+import re
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from . import sim
+from .bin import (
+    PORT, VERSION, MAX_WORD_COUNT, SPEED_TURBO, SPEED_NAMES, SPEED_KHZ,
+    CMD_DP_READ, CMD_DP_WRITE, CMD_AP_READ, CMD_AP_WRITE, CMD_AP_BULK_READ,
+    CMD_AP_BULK_WRITE, CMD_MULTI_REG_WRITE, CMD_PING, CMD_RESET_TARGET,
+    CMD_CLOCK, CMD_SET_SPEED, CMD_DISCONNECT,
+    RSP_OK, RSP_ERR_SWD, RSP_ERR_API,
+    REG_TYPE_DP, REG_TYPE_AP, DP_ABORT, DP_CTRL_STAT, DP_SELECT,
+    AP_CSW, AP_TAR, AP_DRW,
+)
+from .sim import SimFault
+
+# Clocks per SWD transaction - 8 request, 1 turnaround, 3 ACK, 1 turnaround,
+# 33 data and parity
+SWD_TRANSACTION_CLOCKS = 46
+
+# Clocks in a line reset and JTAG-to-SWD sequence
+SWD_RESET_CLOCKS = 50 + 16 + 50 + 8
+
+# Transactions in the connection sequence after the line reset
+RESET_TRANSACTIONS = 12
+
+# Fixed size of each command, after the command byte
+COMMAND_BYTES = {
+    CMD_DP_READ: 1,
+    CMD_DP_WRITE: 5,
+    CMD_AP_READ: 1,
+    CMD_AP_WRITE: 5,
+    CMD_AP_BULK_READ: 3,
+    CMD_AP_BULK_WRITE: 3,
+    CMD_MULTI_REG_WRITE: 2,
+    CMD_PING: 0,
+    CMD_RESET_TARGET: 0,
+    CMD_CLOCK: 3,
+    CMD_SET_SPEED: 1,
+    CMD_DISCONNECT: 0,
+}
+
+# Approximate link profiles
+WIFI = {'rtt': 0.004, 'jitter': 0.001, 'bandwidth': 1_000_000, 'overhead': 20e-6}
+LOCAL = {'rtt': 0.0, 'jitter': 0.0, 'bandwidth': None, 'overhead': 0.0, 'model_swd': False}
+
+
+class ArgError(Exception):
+    """A command had an invalid argument"""
+
+
+class LinkModel:
+    """Latency and bandwidth model of an airfrog and its network link
+
+    Arguments:
+    - rtt: network round trip time in seconds
+    - jitter: maximum extra random delay added to each response, in seconds
+    - bandwidth: link bandwidth in bytes per second, or None for unlimited
+    - overhead: firmware time to handle each command, in seconds
+    - speed: initial SWD speed, one of the SPEED_* values
+    - swd_khz: SWD clock rate for each speed, overriding SPEED_KHZ
+    - model_swd: whether to include SWD transaction time
+    """
+
+    def __init__(self, rtt=WIFI['rtt'], jitter=WIFI['jitter'],
+                 bandwidth=WIFI['bandwidth'], overhead=WIFI['overhead'],
+                 speed=SPEED_TURBO, swd_khz=None, model_swd=True):
+        self.rtt = rtt
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.overhead = overhead
+        self.speed = speed
+        self.swd_khz = dict(SPEED_KHZ if swd_khz is None else swd_khz)
+        self.model_swd = model_swd
+
+        # The time the target will finish its last queued SWD transaction
+        self._target_free = 0.0
+        self._timing = threading.Lock()
+
+    @classmethod
+    def local(cls, **kwargs):
+        """A model which adds no delay at all"""
+        return cls(**{**LOCAL, **kwargs})
+
+    def swd_time(self, transactions, clocks=0):
+        """Return the time taken by SWD transactions at the current speed"""
+        if not self.model_swd:
+            return 0.0
+        hz = self.swd_khz[self.speed] * 1000
+        return (transactions * SWD_TRANSACTION_CLOCKS + clocks) / hz
+
+    def transfer_time(self, nbytes):
+        """Return the time taken to transfer `nbytes` over the link"""
+        if not self.bandwidth:
+            return 0.0
+        return nbytes / self.bandwidth
+
+    def run(self, arrival, func):
+        """Run `func(start)` on the target once it is free after `arrival`
+
+        `func` returns the time it finished with the target, which is then
+        busy until that time.  Returns (start, end).
+        """
+        with self._timing:
+            start = max(arrival, self._target_free)
+            self._target_free = func(start)
+            return start, self._target_free
+
+    def schedule(self, arrival, swd_time):
+        """Reserve the target for `swd_time` from `arrival`, returning start and end times"""
+        return self.run(arrival, lambda start: start + self.overhead + swd_time)
+
+
+class Emulator:
+    """airfrog binary API emulator
+
+    Arguments:
+    - target: the `airfrog.sim.SimTarget` to serve
+    - host: address to listen on
+    - port: port to listen on
+    - link: a `LinkModel`, shared by all connections - share it with a
+      `RestEmulator` to emulate both APIs of one airfrog
+    """
+
+    def __init__(self, target, host='127.0.0.1', port=PORT, link=None):
+        self.target = target
+        self.link = LinkModel() if link is None else link
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self.commands = 0
+        # Commands served, by command type
+        self.command_counts = collections.Counter()
+
+        emulator = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                Connection(emulator, self.request).serve()
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler,
+                                                       bind_and_activate=False)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        """Start serving in a background thread"""
+        self._listen()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        """Serve in the calling thread, until interrupted"""
+        self._listen()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        """Stop serving"""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _listen(self):
+        self._server.server_bind()
+        self._server.server_activate()
+        self.port = self._server.server_address[1]
+        # airfrog connects to the target when it starts
+        self.target.attach()
+
+
+class Connection:
+    """One emulated binary API connection
+
+    Commands are parsed and executed against the target as soon as they
+    arrive.  Each response is queued with the time the link model says it
+    would reach the client, and a sender thread writes it out then.
+    """
+
+    def __init__(self, emulator, sock):
+        self.emulator = emulator
+        self.target = emulator.target
+        self.link = emulator.link
+        self.sock = sock
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.file = sock.makefile('rb')
+
+        self._responses = collections.deque()
+        self._ready = threading.Condition()
+        self._closing = False
+        self._link_free = 0.0
+        self._rng = random.Random()
+
+    def serve(self):
+        self.emulator.connections += 1
+        sender = threading.Thread(target=self._sender, daemon=True)
+        sender.start()
+        try:
+            self.sock.sendall(bytes([VERSION]))
+            ack = self.file.read(1)
+            if ack != bytes([VERSION]):
+                return
+            self._serve_commands()
+        except OSError:
+            pass
+        finally:
+            with self._ready:
+                self._closing = True
+                self._ready.notify()
+            sender.join()
+            self.file.close()
+
+    def _serve_commands(self):
+        while True:
+            cmd = self.file.read(1)
+            if not cmd:
+                return
+            cmd = cmd[0]
+            arrival = time.perf_counter() + self.link.rtt / 2
+            if cmd not in COMMAND_BYTES:
+                # airfrog closes the connection without a response
+                return
+            args = self._read(COMMAND_BYTES[cmd])
+            if args is None:
+                return
+            if cmd == CMD_DISCONNECT:
+                self._respond(arrival, bytes([RSP_OK]))
+                return
+
+            try:
+                payload = self._read_payload(cmd, args)
+                if payload is None:
+                    return
+                self.emulator.commands += 1
+                self.emulator.command_counts[cmd] += 1
+                swd_time = self._swd_time(cmd, args)
+                start, done = self.link.schedule(arrival, swd_time)
+                response = self._execute(cmd, args, payload, start)
+            except ArgError:
+                self._respond(arrival, bytes([RSP_ERR_API]))
+                return
+            self._respond(done, response)
+
+    def _read(self, nbytes):
+        data = self.file.read(nbytes) if nbytes else b''
+        if len(data) != nbytes:
+            return None
+        return data
+
+    def _read_payload(self, cmd, args):
+        """Read and return the variable length part of a command"""
+        if cmd == CMD_AP_BULK_WRITE:
+            count = struct.unpack_from('<H', args, 1)[0]
+            if count > MAX_WORD_COUNT:
+                raise ArgError()
+            return self._read(count * 4)
+        if cmd == CMD_MULTI_REG_WRITE:
+            count = struct.unpack_from('<H', args, 0)[0]
+            if count > MAX_WORD_COUNT:
+                raise ArgError()
+            payload = self._read(count * 6)
+            if payload is not None and any(payload[i] not in (REG_TYPE_DP, REG_TYPE_AP)
+                                           for i in range(0, len(payload), 6)):
+                raise ArgError()
+            return payload
+        if cmd == CMD_CLOCK:
+            if args[0] & 0x0F > 2 or args[0] >> 4 > 2:
+                raise ArgError()
+        elif cmd == CMD_SET_SPEED:
+            if args[0] not in self.link.swd_khz:
+                raise ArgError()
+        return b''
+
+    def _swd_time(self, cmd, args):
+        link = self.link
+        if cmd in (CMD_DP_READ, CMD_DP_WRITE, CMD_AP_WRITE):
+            return link.swd_time(1)
+        if cmd == CMD_AP_READ:
+            # AP reads are posted, and need a DP RDBUFF read
+            return link.swd_time(2)
+        if cmd in (CMD_AP_BULK_READ, CMD_AP_BULK_WRITE):
+            # CSW read-modify-write, then the transfers
+            count = struct.unpack_from('<H', args, 1)[0]
+            return link.swd_time(3 + count + 1)
+        if cmd == CMD_MULTI_REG_WRITE:
+            return link.swd_time(struct.unpack_from('<H', args, 0)[0])
+        if cmd == CMD_RESET_TARGET:
+            return link.swd_time(RESET_TRANSACTIONS, SWD_RESET_CLOCKS)
+        if cmd == CMD_CLOCK:
+            return link.swd_time(0, struct.unpack_from('<H', args, 1)[0])
+        return 0.0
+
+    def _execute(self, cmd, args, payload, now):
+        """Run a command against the target, returning the response bytes"""
+        target = self.target
+        try:
+            if cmd == CMD_DP_READ:
+                return struct.pack('<BI', RSP_OK, target.dp_read(args[0], now))
+            if cmd == CMD_DP_WRITE:
+                target.dp_write(args[0], struct.unpack_from('<I', args, 1)[0], now)
+            elif cmd == CMD_AP_READ:
+                return struct.pack('<BI', RSP_OK, self._ap_read(args[0], now))
+            elif cmd == CMD_AP_WRITE:
+                self._ap_write(args[0], struct.unpack_from('<I', args, 1)[0], now)
+            elif cmd == CMD_AP_BULK_READ:
+                count = struct.unpack_from('<H', args, 1)[0]
+                with target.lock:
+                    self._select_bank(args[0], now)
+                    target.set_addr_inc(True)
+                    data = target.drw_read_block(count, now)
+                return struct.pack('<BH', RSP_OK, count) + data
+            elif cmd == CMD_AP_BULK_WRITE:
+                count = len(payload) // 4
+                with target.lock:
+                    self._select_bank(args[0], now)
+                    target.set_addr_inc(True)
+                    for word in struct.unpack(f'<{count}I', payload):
+                        target.ap_write(AP_DRW, word, now)
+            elif cmd == CMD_MULTI_REG_WRITE:
+                with target.lock:
+                    for reg_type, reg, value in struct.iter_unpack('<BBI', payload):
+                        if reg_type == REG_TYPE_DP:
+                            target.dp_write(reg, value, now)
+                        else:
+                            self._ap_write(reg, value, now)
+            elif cmd == CMD_RESET_TARGET:
+                target.attach()
+            elif cmd == CMD_SET_SPEED:
+                self.link.speed = args[0]
+        except SimFault:
+            return bytes([RSP_ERR_SWD])
+        return bytes([RSP_OK])
+
+    def _select_bank(self, reg, now):
+        # airfrog selects AP 0 and the register's bank itself
+        self.target.dp_write(DP_SELECT, reg & 0xF0, now)
+
+    def _ap_read(self, reg, now):
+        with self.target.lock:
+            self._select_bank(reg, now)
+            return self.target.ap_read(reg, now)
+
+    def _ap_write(self, reg, value, now):
+        with self.target.lock:
+            self._select_bank(reg, now)
+            self.target.ap_write(reg, value, now)
+
+    def _respond(self, ready, response):
+        """Queue a response for delivery once the link model says it arrives"""
+        link = self.link
+        self._link_free = max(self._link_free, ready) + link.transfer_time(len(response))
+        deliver = self._link_free + link.rtt / 2
+        if link.jitter:
+            deliver += self._rng.uniform(0, link.jitter)
+        with self._ready:
+            self._responses.append((deliver, response))
+            self._ready.notify()
+
+    def _sender(self):
+        while True:
+            with self._ready:
+                while not self._responses and not self._closing:
+                    self._ready.wait()
+                if not self._responses:
+                    return
+                deliver = self._responses[0][0]
+            delay = deliver - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            # Send everything which is now due in one go
+            now = time.perf_counter()
+            due = []
+            with self._ready:
+                while self._responses and self._responses[0][0] <= now:
+                    due.append(self._responses.popleft()[1])
+            try:
+                self.sock.sendall(b''.join(due))
+            except OSError:
+                return
+
+
+#
+# REST API
+#
+
+# Firmware time to parse a REST request and build its response, plus the time
+# to format each word of bulk data as JSON
+HTTP_OVERHEAD = 0.002
+HTTP_WORD_TIME = 10e-6
+
+# airfrog runs this many HTTP server tasks, each serving one connection at a
+# time.  Further connections are refused.
+HTTPD_TASKS = 4
+
+# Largest request body airfrog accepts
+HTTPD_BODY_BUF_SIZE = 4096
+
+# Interval at which airfrog polls the flash controller while it is busy
+FLASH_POLL_INTERVAL = 0.001
+
+# HTTP status code of each error kind, by error source
+ERROR_STATUS = {
+    'swd': {
+        'wait ack': 408,
+        'fault ack': 500,
+        'no ack': 500,
+        'read parity': 500,
+        'debug port': 500,
+        'operation failed': 400,
+        'not ready': 503,
+        'unsupported': 501,
+    },
+    'airfrog': {
+        'bad request': 400,
+        'invalid body': 400,
+        'invalid path': 404,
+        'invalid method': 405,
+        'timeout': 408,
+        'request too large': 413,
+        'internal server error': 500,
+        'api error': 400,
+        'network error': 503,
+    },
+}
+
+# SWD errors injected by default
+INJECTED_ERRORS = ('wait ack', 'fault ack')
+
+HEX_WORD = re.compile(r'(?:0x)*([0-9a-fA-F]{1,8})')
+
+LINE_LEVELS = ('low', 'high', 'input')
+
+
+class RestError(Exception):
+    """A REST API error
+
+    Arguments:
+    - source: 'swd' or 'airfrog'
+    - kind: the error kind, as in ERROR_STATUS
+    - detail: extra detail, e.g. the ACK for a 'no ack' error
+    """
+
+    def __init__(self, source, kind, detail=''):
+        super().__init__(f"{source} {kind}")
+        self.source = source
+        self.kind = kind
+        self.detail = detail
+
+    def status(self):
+        return ERROR_STATUS[self.source][self.kind]
+
+    def json(self):
+        return {self.source: {'kind': self.kind, 'detail': self.detail}}
+
+
+def airfrog_error(kind):
+    return RestError('airfrog', kind)
+
+
+class RestEmulator:
+    """airfrog REST API emulator
+
+    Arguments:
+    - target: the `airfrog.sim.SimTarget` to serve
+    - host: address to listen on
+    - port: port to listen on
+    - link: a `LinkModel`, shared by all connections
+    - latency: extra time added to every response, in seconds
+    - error_rate: probability that a target operation fails with an SWD error
+    - error_kinds: SWD error kinds to choose from when injecting errors
+    - drop_rate: probability that a request's connection is closed without a
+      response
+    - max_connections: connections served at once - further connections are
+      refused, as airfrog has no free task to accept them
+    - seed: seed for error injection
+    """
+
+    def __init__(self, target, host='127.0.0.1', port=80, link=None, latency=0.0,
+                 error_rate=0.0, error_kinds=INJECTED_ERRORS, drop_rate=0.0,
+                 max_connections=HTTPD_TASKS, seed=None):
+        self.target = target
+        self.link = LinkModel() if link is None else link
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_kinds = tuple(error_kinds)
+        self.drop_rate = drop_rate
+        self.settings = {'auto_connect': True, 'keepalive': True, 'refresh': True}
+        self.connected = True
+        self.connections = 0
+        self.refused = 0
+        self.requests = 0
+
+        # RTT data waiting to be read - None until the RTT reader is started
+        # by feeding it data
+        self.rtt = None
+        self._rtt_lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._tasks = threading.Semaphore(max_connections)
+
+        emulator = self
+
+        class Handler(RestHandler):
+            pass
+
+        Handler.emulator = emulator
+        self._server = http.server.ThreadingHTTPServer((host, port), Handler,
+                                                       bind_and_activate=False)
+        self._server.daemon_threads = True
+        self._server.allow_reuse_address = True
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        """Start serving in a background thread"""
+        self._listen()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        """Serve in the calling thread, until interrupted"""
+        self._listen()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        """Stop serving"""
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def feed_rtt(self, data):
+        """Queue bytes as if the target had written them to RTT up-channel 0"""
+        with self._rtt_lock:
+            if self.rtt is None:
+                self.rtt = bytearray()
+            self.rtt += data
+
+    def _listen(self):
+        self._server.server_bind()
+        self._server.server_activate()
+        self.port = self._server.server_address[1]
+        self.target.attach()
+
+    #
+    # Request handling
+    #
+
+    def handle(self, method, path, body, arrival):
+        """Handle a request, returning (status, response dict, ready time)"""
+        self.requests += 1
+        ready = arrival
+        try:
+            if not path.startswith('/api/'):
+                return 404, {}, ready + HTTP_OVERHEAD
+            path = path[4:]
+            if path.startswith('/rtt'):
+                return self._rtt(method, path[4:], arrival)
+
+            if path.startswith('/target'):
+                op = self._parse_target(method, path[7:], body)
+            elif path.startswith('/raw'):
+                op = self._parse_raw(method, path[4:], body)
+            elif path.startswith('/config/swd'):
+                op = self._parse_config(method, path[11:], body)
+            else:
+                return 404, {}, ready + HTTP_OVERHEAD
+        except RestError as e:
+            # Errors found while parsing the request are returned bare
+            return e.status(), e.json(), ready + HTTP_OVERHEAD
+
+        swd = SwdSession(self)
+        try:
+            _, ready = self.link.run(arrival, lambda start: swd.run(op, start))
+            response = swd.response
+            status = 200
+        except RestError as e:
+            ready = swd.now
+            response = {'error': e.json()}
+            if swd.with_status:
+                response['status'] = self.status()
+            status = e.status() if e.status() in (400, 404, 500) else 200
+
+        words = len(response.get('data', ())) if isinstance(response.get('data'), list) else 0
+        return status, response, ready + HTTP_OVERHEAD + words * HTTP_WORD_TIME
+
+    def status(self):
+        """Return the target status object"""
+        connected = self.connected
+        return {
+            'connected': connected,
+            'version': 'V1' if connected else None,
+            'idcode': f"0x{sim.DP_IDCODE:08X}" if connected else None,
+            'mcu': 'STM32F411' if connected else None,
+            'settings': {'speed': SPEED_NAMES[self.link.speed], **self.settings},
+        }
+
+    def inject_error(self):
+        """Maybe raise an injected SWD error"""
+        if self.error_rate and self._rng.random() < self.error_rate:
+            raise RestError('swd', self._rng.choice(self.error_kinds))
+
+    def drop(self):
+        return self.drop_rate and self._rng.random() < self.drop_rate
+
+    def _rtt(self, method, path, arrival):
+        # The firmware serves /api/rtt/data - /api/rtt/read is as documented
+        if method != 'GET' or path not in ('/data', '/read'):
+            return 404, {}, arrival + HTTP_OVERHEAD
+        with self._rtt_lock:
+            if self.rtt is None:
+                # RTT reader not running
+                return 503, {}, arrival + HTTP_OVERHEAD
+            data = bytes(self.rtt[:256])
+            del self.rtt[:256]
+        return 200, {'data': [f"0x{b:02X}" for b in data]}, arrival + HTTP_OVERHEAD
+
+    #
+    # Request parsing - returns a function which performs the operation
+    # against an SwdSession
+    #
+
+    def _parse_target(self, method, path, body):
+        body = parse_body(body)
+        if method == 'GET':
+            if path == '/status':
+                return lambda swd: swd.get_status()
+            if path == '/details':
+                return lambda swd: swd.get_details()
+            if path == '/errors':
+                return lambda swd: swd.get_errors()
+            if path.startswith('/memory/read/'):
+                addr = path[13:]
+                return lambda swd: swd.read_mem(addr)
+        elif method == 'POST':
+            if path == '/reset':
+                return lambda swd: swd.reset()
+            if path == '/clear-errors':
+                return lambda swd: swd.clear_errors()
+            if path.startswith('/memory/write/'):
+                addr, data = path[14:], body_str(body, 'data')
+                return lambda swd: swd.write_mem(addr, data)
+            if path.startswith('/memory/bulk/read/'):
+                addr, count = path[18:], body_count(body)
+                return lambda swd: swd.read_mem_bulk(addr, count)
+            if path.startswith('/memory/bulk/write/'):
+                addr, data = path[19:], body_strs(body)
+                return lambda swd: swd.write_mem_bulk(addr, data)
+            if path == '/flash/unlock':
+                return lambda swd: swd.unlock_flash()
+            if path == '/flash/lock':
+                return lambda swd: swd.lock_flash()
+            if path.startswith('/flash/erase-sector/'):
+                sector = path[20:]
+                if not sector.isdigit():
+                    raise airfrog_error('invalid path')
+                return lambda swd: swd.erase(sector=int(sector))
+            if path == '/flash/erase-all':
+                return lambda swd: swd.erase()
+            if path.startswith('/flash/write/'):
+                addr, data = path[13:], body_str(body, 'data')
+                return lambda swd: swd.write_flash(addr, [data])
+            if path.startswith('/flash/bulk/write/'):
+                addr, data = path[18:], body_strs(body)
+                return lambda swd: swd.write_flash(addr, data, bulk=True)
+        raise airfrog_error('invalid path')
+
+    def _parse_raw(self, method, path, body):
+        body = parse_body(body)
+        if method == 'GET':
+            if path.startswith('/dp/read/'):
+                reg = path[9:]
+                return lambda swd: swd.raw_dp_read(reg)
+            if path.startswith('/ap/read/'):
+                ap, reg = ap_path(path[9:])
+                return lambda swd: swd.raw_ap_read(ap, reg)
+        elif method == 'POST':
+            if path == '/reset':
+                return lambda swd: swd.raw_reset()
+            if path.startswith('/dp/write/'):
+                reg, data = path[10:], body_str(body, 'data')
+                return lambda swd: swd.raw_dp_write(reg, data)
+            if path.startswith('/ap/write/'):
+                (ap, reg), data = ap_path(path[10:]), body_str(body, 'data')
+                return lambda swd: swd.raw_ap_write(ap, reg, data)
+            if path.startswith('/ap/bulk/read/'):
+                (ap, reg), count = ap_path(path[14:]), body_count(body)
+                return lambda swd: swd.raw_ap_bulk_read(ap, reg, count)
+            if path.startswith('/ap/bulk/write/'):
+                (ap, reg), count, data = ap_path(path[15:]), body_count(body), body_strs(body)
+                return lambda swd: swd.raw_ap_bulk_write(ap, reg, count, data)
+            if path == '/clock':
+                line_level(body_str(body, 'level'))
+                # The firmware reads "post_level" - the documentation says "post"
+                post = body.get('post_level', body.get('post'))
+                line_level(post if isinstance(post, str) else None)
+                count = body_count(body)
+                return lambda swd: swd.clock(count)
+        raise airfrog_error('invalid path')
+
+    def _parse_config(self, method, path, body):
+        body = parse_body(body)
+        if method == 'GET' and path == '/runtime/speed':
+            return lambda swd: swd.get_speed()
+        if method == 'POST':
+            if path == '/runtime/speed':
+                speed = speed_from_name(body_str(body, 'speed'))
+                return lambda swd: swd.set_speed(speed)
+            if path in ('/runtime', '/flash', '/swd/flash'):
+                settings = body_settings(body)
+                if path == '/runtime':
+                    return lambda swd: swd.update_settings(settings)
+                # Stored settings only apply after a reboot
+                return lambda swd: {}
+        raise airfrog_error('invalid path')
+
+
+class SwdSession:
+    """One REST request's operations on the target
+
+    Tracks the time as each SWD transaction is performed, so the target sees
+    accesses when they would really happen.
+    """
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.target = emulator.target
+        self.link = emulator.link
+        self.now = 0.0
+        self.response = {}
+        self.with_status = False
+
+    def run(self, op, start):
+        self.now = start
+        with self.target.lock:
+            self.emulator.inject_error()
+            self.response = op(self)
+        return self.now
+
+    #
+    # SWD primitives
+    #
+
+    def _swd(self, transactions):
+        self.now += self.link.swd_time(transactions)
+
+    def _check_connected(self):
+        if not self.emulator.connected:
+            raise RestError('swd', 'not ready')
+
+    def dp_read(self, reg):
+        self._swd(1)
+        return self._fault(self.target.dp_read, reg, self.now)
+
+    def dp_write(self, reg, value):
+        self._swd(1)
+        self._fault(self.target.dp_write, reg, value, self.now)
+
+    def ap_read(self, reg, ap=0):
+        self.dp_write(DP_SELECT, (ap << 24) | (reg & 0xF0))
+        self._swd(2)
+        if ap != 0:
+            # Only AP 0 exists - others read as zero
+            return 0
+        return self._fault(self.target.ap_read, reg, self.now)
+
+    def ap_write(self, reg, value, ap=0):
+        self.dp_write(DP_SELECT, (ap << 24) | (reg & 0xF0))
+        self._swd(1)
+        if ap == 0:
+            self._fault(self.target.ap_write, reg, value, self.now)
+
+    def set_addr_inc(self, enable):
+        csw = self.ap_read(AP_CSW)
+        if bool(csw & 0x30) != enable:
+            self._swd(1)
+            self.target.set_addr_inc(enable)
+
+    def read_word(self, addr):
+        self.ap_write(AP_TAR, addr)
+        if self.ap_read(AP_TAR) != addr:
+            raise RestError('swd', 'operation failed', f"unexpected tar 0x{addr:08X}")
+        return self.ap_read(AP_DRW)
+
+    def write_word(self, addr, value):
+        self.ap_write(AP_TAR, addr)
+        if self.ap_read(AP_TAR) != addr:
+            raise RestError('swd', 'operation failed', f"unexpected tar 0x{addr:08X}")
+        self.ap_write(AP_DRW, value)
+
+    def read_block(self, addr, count):
+        """Read `count` words in 1KB chunks, with auto-increment already on"""
+        words = []
+        while len(words) < count:
+            chunk = min(count - len(words), (0x400 - (addr & 0x3FF)) // 4)
+            self.ap_write(AP_TAR, addr)
+            self._swd(chunk + 1)
+            data = self._fault(self.target.drw_read_block, chunk, self.now)
+            words.extend(struct.unpack(f'<{chunk}I', data))
+            addr += chunk * 4
+        return words
+
+    def write_block(self, addr, words):
+        """Write words in 1KB chunks, with auto-increment already on"""
+        done = 0
+        while done < len(words):
+            chunk = min(len(words) - done, (0x400 - (addr & 0x3FF)) // 4)
+            self.ap_write(AP_TAR, addr)
+            self._swd(chunk)
+            for word in words[done:done + chunk]:
+                self._fault(self.target.ap_write, AP_DRW, word, self.now)
+            addr += chunk * 4
+            done += chunk
+
+    def _fault(self, func, *args):
+        try:
+            return func(*args)
+        except SimFault:
+            raise RestError('swd', 'fault ack')
+
+    #
+    # Target control
+    #
+
+    def get_status(self):
+        return {'status': self.emulator.status()}
+
+    def reset(self):
+        self.emulator.settings.update(auto_connect=True, keepalive=True, refresh=True)
+        self.now += self.link.swd_time(RESET_TRANSACTIONS, SWD_RESET_CLOCKS)
+        self.target.attach()
+        self.emulator.connected = True
+        return {'status': self.emulator.status()}
+
+    def get_details(self):
+        self._check_connected()
+        uid = ''.join(f"{word:08X}" for word in self.target.uid)
+        return {
+            'status': self.emulator.status(),
+            'data': {
+                'idcode': f"0x{sim.DP_IDCODE:08X}",
+                'mcu_family': 'STM32F4',
+                'mcu_line': 'STM32F411',
+                'mcu_device_id': f"0x{sim.DBGMCU_IDCODE_VALUE & 0xFFF:03X}",
+                'mcu_revision': 'A/1/Z',
+                'flash_size_kb': sim.FLASH_SIZE // 1024,
+                'unique_id': f"0x{uid}",
+                'mem_ap_idr': f"0x{sim.AP_IDR:08X}",
+            },
+        }
+
+    def get_errors(self):
+        self.with_status = True
+        ctrl_stat = self.dp_read(DP_CTRL_STAT)
+        return {
+            'status': self.emulator.status(),
+            'data': {
+                'stkerr': bool(ctrl_stat & 0x20),
+                'stkcmp': bool(ctrl_stat & 0x10),
+                'wderr': bool(ctrl_stat & 0x80),
+                'orunerr': bool(ctrl_stat & 0x02),
+                'readok': bool(ctrl_stat & 0x40),
+            },
+        }
+
+    def clear_errors(self):
+        self.with_status = True
+        self.dp_write(DP_ABORT, 0x1E)
+        return {'status': self.emulator.status()}
+
+    #
+    # Memory
+    #
+
+    def read_mem(self, addr):
+        self._check_connected()
+        addr = rest_addr(addr)
+        return {'data': f"0x{self.read_word(addr):08X}"}
+
+    def write_mem(self, addr, data):
+        self._check_connected()
+        addr = rest_addr(addr)
+        self.write_word(addr, rest_word(data))
+        return {}
+
+    def read_mem_bulk(self, addr, count):
+        self._check_connected()
+        addr = rest_addr(addr)
+        check_count(count)
+        self.set_addr_inc(True)
+        words = self.read_block(addr, count)
+        self.set_addr_inc(False)
+        return {'data': [f"0x{word:08X}" for word in words]}
+
+    def write_mem_bulk(self, addr, data):
+        self._check_connected()
+        addr = rest_addr(addr)
+        words = rest_words(data)
+        self.set_addr_inc(True)
+        self.write_block(addr, words)
+        self.set_addr_inc(False)
+        return {}
+
+    #
+    # Flash
+    #
+
+    def unlock_flash(self):
+        self._check_connected()
+        self.write_word(sim.FLASH_KEYR, sim.FLASH_KEY1)
+        self.write_word(sim.FLASH_KEYR, sim.FLASH_KEY2)
+        return {}
+
+    def lock_flash(self):
+        self._check_connected()
+        cr = self.read_word(sim.FLASH_CR)
+        self.write_word(sim.FLASH_CR, cr | sim.FLASH_CR_LOCK)
+        return {}
+
+    def erase(self, sector=None):
+        self._check_connected()
+        cr = self.read_word(sim.FLASH_CR)
+        if sector is None:
+            cr |= sim.FLASH_CR_MER
+        else:
+            # Erase with 64-bit parallelism
+            cr |= sim.FLASH_CR_SER | ((sector & 0xF) << sim.FLASH_CR_SNB_SHIFT) | (3 << 8)
+        self.write_word(sim.FLASH_CR, cr)
+        self.write_word(sim.FLASH_CR, cr | sim.FLASH_CR_STRT)
+        self._wait_flash('erase')
+        return {}
+
+    def write_flash(self, addr, data, bulk=False):
+        self._check_connected()
+        addr = rest_addr(addr)
+        words = rest_words(data) if bulk else [rest_word(data[0])]
+        cr = self.read_word(sim.FLASH_CR)
+        cr &= ~(sim.FLASH_CR_SER | sim.FLASH_CR_MER | (3 << 8))
+        self.write_word(sim.FLASH_CR, cr | (2 << 8) | sim.FLASH_CR_PG)
+        for offset, word in enumerate(words):
+            self.write_word(addr + offset * 4, word)
+            self._wait_flash('program')
+        return {}
+
+    def _wait_flash(self, operation):
+        while True:
+            sr = self.read_word(sim.FLASH_SR)
+            if sr & sim.FLASH_SR_ERRORS:
+                raise RestError('swd', 'operation failed', f"flash {operation} failure 0x{sr:08X}")
+            if not sr & sim.FLASH_SR_BSY:
+                return
+            self.now += FLASH_POLL_INTERVAL
+
+    #
+    # Config
+    #
+
+    def get_speed(self):
+        return {'speed': SPEED_NAMES[self.link.speed]}
+
+    def set_speed(self, speed):
+        self.link.speed = speed
+        return {}
+
+    def update_settings(self, settings):
+        self.link.speed = settings.pop('speed')
+        self.emulator.settings.update(settings)
+        return {}
+
+    #
+    # Raw
+    #
+
+    def raw_reset(self):
+        self.emulator.settings.update(auto_connect=False, keepalive=False, refresh=False)
+        self.now += self.link.swd_time(RESET_TRANSACTIONS, SWD_RESET_CLOCKS)
+        self.target.attach()
+        return {}
+
+    def raw_dp_read(self, reg):
+        reg = rest_dp_register(reg)
+        return {'data': f"0x{self.dp_read(reg):08X}"}
+
+    def raw_dp_write(self, reg, data):
+        reg = rest_dp_register(reg)
+        self.dp_write(reg, rest_word(data))
+        return {}
+
+    def raw_ap_read(self, ap, reg):
+        ap, reg = rest_ap(ap), rest_word(reg) & 0xFF
+        return {'data': f"0x{self.ap_read(reg, ap):08X}"}
+
+    def raw_ap_write(self, ap, reg, data):
+        ap, reg = rest_ap(ap), rest_word(reg) & 0xFF
+        self.ap_write(reg, rest_word(data), ap)
+        return {}
+
+    def raw_ap_bulk_read(self, ap, reg, count):
+        ap, reg = rest_ap(ap), rest_word(reg) & 0xFF
+        check_count(count)
+        self.set_addr_inc(True)
+        self.dp_write(DP_SELECT, (ap << 24) | (reg & 0xF0))
+        self._swd(count + 1)
+        if ap == 0:
+            data = self._fault(self.target.drw_read_block, count, self.now)
+            words = struct.unpack(f'<{count}I', data)
+        else:
+            words = [0] * count
+        self.set_addr_inc(False)
+        return {'data': [f"0x{word:08X}" for word in words]}
+
+    def raw_ap_bulk_write(self, ap, reg, count, data):
+        ap, reg = rest_ap(ap), rest_word(reg) & 0xFF
+        words = rest_words(data)
+        check_count(count)
+        self.set_addr_inc(True)
+        self.dp_write(DP_SELECT, (ap << 24) | (reg & 0xF0))
+        self._swd(len(words))
+        if ap == 0:
+            for word in words:
+                self._fault(self.target.ap_write, AP_DRW, word, self.now)
+        self.set_addr_inc(False)
+        return {}
+
+    def clock(self, count):
+        self.now += self.link.swd_time(0, count)
+        return {}
+
+
+class RestHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP/1.1 keep-alive handler for `RestEmulator`"""
+
+    protocol_version = 'HTTP/1.1'
+    emulator = None
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._accepted = self.emulator._tasks.acquire(blocking=False)
+        # The first request on a connection also pays for the TCP handshake
+        self._handshake = self.emulator.link.rtt
+        if self._accepted:
+            self.emulator.connections += 1
+        else:
+            self.emulator.refused += 1
+
+    def handle(self):
+        if self._accepted:
+            super().handle()
+
+    def finish(self):
+        if self._accepted:
+            self.emulator._tasks.release()
+        super().finish()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._request('GET')
+
+    def do_POST(self):
+        self._request('POST')
+
+    def _request(self, method):
+        emulator = self.emulator
+        link = emulator.link
+        received = time.perf_counter()
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length > HTTPD_BODY_BUF_SIZE:
+            self._send(413, None, received)
+            self.close_connection = True
+            return
+        body = self.rfile.read(length) if length else None
+        if emulator.drop():
+            self.close_connection = True
+            return
+
+        request_bytes = len(self.requestline) + len(str(self.headers)) + length
+        arrival = received + link.rtt / 2 + link.transfer_time(request_bytes) + self._handshake
+        self._handshake = 0.0
+        status, response, ready = emulator.handle(method, self.path, body, arrival)
+        self._send(status, response, ready + emulator.latency)
+
+    def _send(self, status, response, ready):
+        link = self.emulator.link
+        content = b'' if response is None else json.dumps(response, separators=(',', ':')).encode()
+        deliver = ready + link.transfer_time(len(content)) + link.rtt / 2
+        if link.jitter:
+            deliver += self.emulator._rng.uniform(0, link.jitter)
+        delay = deliver - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        self.send_response_only(status)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Content-Type', 'application/json' if response is not None
+                         else 'text/plain')
+        self.end_headers()
+        self.wfile.write(content)
+        self.wfile.flush()
+
+
+#
+# REST request parsing helpers, following the firmware's choice of error kind
+#
+
+def parse_body(body):
+    if body is None:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise airfrog_error('invalid body')
+
+
+def body_str(body, key):
+    value = body.get(key) if isinstance(body, dict) else None
+    if not isinstance(value, str):
+        raise airfrog_error('invalid body')
+    return value
+
+
+def body_strs(body):
+    values = body.get('data') if isinstance(body, dict) else None
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        raise airfrog_error('invalid body')
+    return values
+
+
+def body_count(body):
+    count = body.get('count') if isinstance(body, dict) else None
+    if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+        raise airfrog_error('invalid body')
+    return count
+
+
+def body_settings(body):
+    if not isinstance(body, dict):
+        raise airfrog_error('invalid body')
+    settings = {'speed': speed_from_name(body_str(body, 'speed'))}
+    for key in ('auto_connect', 'keepalive', 'refresh'):
+        if not isinstance(body.get(key), bool):
+            raise airfrog_error('invalid body')
+        settings[key] = body[key]
+    return settings
+
+
+def speed_from_name(name):
+    for speed, speed_name in SPEED_NAMES.items():
+        if name == speed_name:
+            return speed
+    raise airfrog_error('invalid body')
+
+
+def line_level(level):
+    if level is None or level.lower() not in LINE_LEVELS:
+        raise airfrog_error('invalid body')
+    return LINE_LEVELS.index(level.lower())
+
+
+def ap_path(params):
+    parts = params.split('/')
+    if len(parts) != 2:
+        raise airfrog_error('invalid path')
+    return parts
+
+
+def rest_word(value, kind='invalid body'):
+    match = HEX_WORD.fullmatch(value)
+    if match is None:
+        raise airfrog_error(kind)
+    return int(match.group(1), 16)
+
+
+def rest_words(values):
+    check_count(len(values))
+    return [rest_word(value) for value in values]
+
+
+def rest_addr(value):
+    addr = rest_word(value, 'invalid path')
+    if addr & 3:
+        raise airfrog_error('invalid body')
+    return addr
+
+
+def rest_dp_register(value):
+    reg = rest_word(value)
+    if reg > 0xF:
+        raise airfrog_error('invalid path')
+    return reg
+
+
+def rest_ap(value):
+    ap = rest_word(value)
+    if ap > 0xFF:
+        raise airfrog_error('invalid path')
+    return ap
+
+
+def check_count(count):
+    if count > MAX_WORD_COUNT:
+        raise airfrog_error('request too large')
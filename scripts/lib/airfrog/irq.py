@@ -0,0 +1,274 @@
+"""airfrog.irq - Statistical interrupt activity profiler
+
+Each sample reads SCB_ICSR, whose VECTACTIVE field gives the exception
+currently executing, and NVIC_IABR0-15, whose bits show every external
+interrupt that is active - executing, or preempted by a higher priority
+one.  Both are queued as one pipelined batch, and `IrqSampler` pipelines
+several samples per round trip, so a sample costs about as much as its
+reads take on the wire:
+
+    with Client("192.168.0.103") as client:
+        sampler = IrqSampler(client)
+        profile = IrqProfile()
+        for _ in range(1000):
+            profile.add(sampler.sample().samples)
+        profile.finish()
+        for stats in profile.stats():
+            print(stats['name'], stats['executing'], stats['active'])
+
+`IrqProfile` accumulates, per exception:
+- the share of samples in which it was executing - its share of CPU time -
+  and in which it was active at all
+- histograms of how many consecutive samples it stayed active
+- how often it was preempted, and by what
+along with the distribution of nesting depths.  Samples where ICSR and
+IABR disagree, having been read moments apart, are counted in `torn` and
+fall back to ICSR alone.
+
+Handlers are usually far shorter than the sample interval, so these are
+statistical estimates.  EXCCNT (see `airfrog.dwt`) only counts exception
+entry and exit overhead, so the two are complementary - `IrqSampler` can
+also read the DWT counters once per batch for comparison.
+"""
+
+import collections
+import time
+
+from .dwt import COUNTER_WIDTHS, DWT_CYCCNT
+from .memory import Memory
+
+SCB_ICSR = 0xE000ED04
+NVIC_IABR0 = 0xE000E300
+NUM_NVIC_IABR = 16
+
+ICSR_VECTACTIVE_MASK = 0x1FF
+ICSR_VECTPENDING_SHIFT = 12
+ICSR_VECTPENDING_MASK = 0x1FF
+ICSR_ISRPENDING = 1 << 22
+
+# Exception number of external interrupt 0
+IRQ_BASE = 16
+
+# Cortex-M system exceptions, by exception number
+EXCEPTION_NAMES = {
+    1: 'Reset',
+    2: 'NMI',
+    3: 'HardFault',
+    4: 'MemManage',
+    5: 'BusFault',
+    6: 'UsageFault',
+    11: 'SVCall',
+    12: 'DebugMon',
+    14: 'PendSV',
+    15: 'SysTick',
+}
+
+THREAD = 0
+
+# Samples per pipelined batch
+DEFAULT_BATCH = 16
+
+# A sample's time, raw SCB_ICSR and NVIC_IABR0-15 words
+IrqSample = collections.namedtuple('IrqSample', 'time icsr iabr')
+
+# A batch of samples, and the raw DWT counters (with 'time') if requested
+IrqBatch = collections.namedtuple('IrqBatch', 'samples counters')
+
+
+def active_exceptions(sample):
+    """Return the set of exception numbers active in a sample, and whether it was torn
+
+    ICSR and IABR are read a few microseconds apart, so they can disagree -
+    an IRQ active with the core in Thread mode, or VECTACTIVE an IRQ whose
+    IABR bit is clear.  Such torn samples return just VECTACTIVE.
+    """
+    active = set()
+    for index, word in enumerate(sample.iabr):
+        while word:
+            bit = (word & -word).bit_length() - 1
+            active.add(IRQ_BASE + index * 32 + bit)
+            word &= word - 1
+    vectactive = sample.icsr & ICSR_VECTACTIVE_MASK
+    if (vectactive == THREAD and active) or (vectactive >= IRQ_BASE and vectactive not in active):
+        return ({vectactive} if vectactive else set()), True
+    # IABR only covers external interrupts - system exceptions only show up
+    # when executing
+    if vectactive:
+        active.add(vectactive)
+    return active, False
+
+
+class IrqSampler:
+    """Reads SCB_ICSR and NVIC_IABR0-15 in pipelined batches
+
+    Arguments:
+    - client: a connected `airfrog.bin.Client`
+    - batch: samples to read per round trip
+    - dwt: also read the DWT counters once per batch - they must have been
+      enabled, e.g. with DWT_CTRL_COUNTERS
+    """
+
+    def __init__(self, client, batch=DEFAULT_BATCH, dwt=False):
+        if batch <= 0:
+            raise ValueError("batch must be positive")
+        self.memory = Memory(client)
+        self.batch = batch
+        self.dwt = dwt
+        self._spans = [(NVIC_IABR0, NUM_NVIC_IABR), (SCB_ICSR, 1)] * batch
+        if dwt:
+            self._spans.append((DWT_CYCCNT, len(COUNTER_WIDTHS)))
+
+    def sample(self):
+        """Read a batch of samples, returning an IrqBatch
+
+        Samples are timed by interpolating across the batch's read time, as
+        the reads are spread evenly over it.
+        """
+        start = time.perf_counter()
+        results = self.memory.read_spans(self._spans)
+        end = time.perf_counter()
+
+        step = (end - start) / self.batch
+        samples = [IrqSample(start + (i + 0.5) * step, results[i * 2 + 1][0], results[i * 2])
+                   for i in range(self.batch)]
+        counters = None
+        if self.dwt:
+            counters = dict(zip(COUNTER_WIDTHS, results[-1]))
+            counters['time'] = (start + end) / 2
+        return IrqBatch(samples, counters)
+
+
+def run_bucket(length):
+    """Return the power-of-2 histogram bucket for a run of `length` samples"""
+    return 1 << (length - 1).bit_length()
+
+
+class IrqProfile:
+    """Accumulates interrupt activity statistics from IrqSamples
+
+    Arguments:
+    - names: {IRQ number: name} for external interrupts, e.g. from the MCU's
+      SVD file
+    """
+
+    def __init__(self, names=None):
+        self.names = names or {}
+        self.samples = 0
+        self.torn = 0
+        self.first_time = None
+        self.last_time = None
+        self.executing = collections.Counter()
+        self.active = collections.Counter()
+        self.preempted = collections.Counter()
+        self.pending = collections.Counter()
+        self.depths = collections.Counter()
+        # {(preempting, preempted): count} of new preemptions seen
+        self.preemptions = collections.Counter()
+        # {exception: Counter of run_bucket(): runs}
+        self.runs = collections.defaultdict(collections.Counter)
+        self._run_lengths = {}
+        self._previous_vect = THREAD
+        self._previous_active = set()
+
+    def name(self, exception):
+        """Return a display name for an exception number"""
+        if exception == THREAD:
+            return 'Thread'
+        if exception < IRQ_BASE:
+            return EXCEPTION_NAMES.get(exception, f"Exception{exception}")
+        irq = exception - IRQ_BASE
+        return self.names.get(irq, f"IRQ{irq}")
+
+    def add(self, samples):
+        """Add IrqSamples, in time order"""
+        for sample in samples:
+            self._add(sample)
+
+    def _add(self, sample):
+        if self.first_time is None:
+            self.first_time = sample.time
+        self.last_time = sample.time
+        self.samples += 1
+
+        vect = sample.icsr & ICSR_VECTACTIVE_MASK
+        active, torn = active_exceptions(sample)
+        self.torn += torn
+        self.executing[vect] += 1
+        self.active.update(active)
+        self.depths[len(active)] += 1
+        for exception in active - {vect}:
+            self.preempted[exception] += 1
+        if sample.icsr & ICSR_ISRPENDING:
+            vectpending = (sample.icsr >> ICSR_VECTPENDING_SHIFT) & ICSR_VECTPENDING_MASK
+            self.pending[vectpending] += 1
+
+        # A newly executing exception with the previous one still active
+        # has preempted it
+        previous = self._previous_vect
+        if (vect != previous and previous != THREAD and previous in active
+                and vect not in self._previous_active):
+            self.preemptions[(vect, previous)] += 1
+
+        for exception in active:
+            self._run_lengths[exception] = self._run_lengths.get(exception, 0) + 1
+        for exception in self._previous_active - active:
+            self._end_run(exception)
+        self._previous_vect = vect
+        self._previous_active = active
+
+    def _end_run(self, exception):
+        length = self._run_lengths.pop(exception)
+        self.runs[exception][run_bucket(length)] += 1
+
+    def finish(self):
+        """Close any runs still open at the end of the capture"""
+        for exception in list(self._run_lengths):
+            self._end_run(exception)
+        self._previous_active = set()
+
+    @property
+    def elapsed(self):
+        if self.first_time is None:
+            return 0.0
+        return self.last_time - self.first_time
+
+    @property
+    def interval(self):
+        """Mean time between samples, in seconds"""
+        return self.elapsed / (self.samples - 1) if self.samples > 1 else 0.0
+
+    def handler_share(self):
+        """Return the percentage of samples taken in handler mode"""
+        if not self.samples:
+            return 0.0
+        return 100.0 * (self.samples - self.executing[THREAD]) / self.samples
+
+    def stats(self):
+        """Return a list of per-exception stats dicts, busiest first
+
+        Each has 'exception', 'name', 'executing' and 'active' (percentages
+        of samples), 'preempted' (percentage of active samples spent
+        preempted), 'runs' (the number of separate activations seen),
+        'mean_run' (mean run length in samples) and 'histogram' ({run length
+        bucket: runs}).
+        """
+        result = []
+        for exception, active in self.active.items():
+            runs = self.runs.get(exception, {})
+            run_count = sum(runs.values())
+            result.append({
+                'exception': exception,
+                'name': self.name(exception),
+                'executing': 100.0 * self.executing[exception] / self.samples,
+                'active': 100.0 * active / self.samples,
+                'preempted': 100.0 * self.preempted[exception] / active,
+                'runs': run_count,
+                'mean_run': active / run_count if run_count else 0.0,
+                'histogram': dict(sorted(runs.items())),
+            })
+        result.sort(key=lambda stats: (-stats['executing'], -stats['active']))
+        return result
+
+    def nesting(self):
+        """Return {depth: percentage of samples} for the nesting depth"""
+        return {depth: 100.0 * count / self.samples for depth, count in sorted(self.depths.items())}
@@ -0,0 +1,234 @@
+"""airfrog.memory - Target memory access over airfrog's binary API
+
+`Memory` drives the target's MEM-AP (AP 0) through an `airfrog.bin.Client`.
+Transfers are split into AP Bulk Read/Write (0x12/0x13) chunks of up to 256
+words, which never cross a 1KB boundary, as the TAR auto-increment is only
+guaranteed to work within 1KB.  All chunks are pipelined and data is
+received straight into the returned buffer:
+
+    with Client("192.168.0.103") as client:
+        flash = Memory(client).read_memory(0x08000000, 1024 * 1024)
+"""
+
+import array
+
+from .bin import (
+    AP_CSW, AP_TAR, AP_DRW, MAX_WORD_COUNT, CSW_SIZE_MASK, CSW_SIZE_WORD, TAR_WRAP,
+)
+from .codec import SWAP_WORDS, words_to_bytes
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# CSW value used for memory access - debug software access enabled, privileged
+# data access, single auto-increment, 32-bit transfers
+CSW_DEFAULT = 0x23000052
+
+
+class Memory:
+    """Target memory accessed via the MEM-AP
+
+    Arguments:
+    - client: a connected `airfrog.bin.Client`
+    - csw: CSW value to use for accesses - must select 32-bit transfers
+    - chunk_words: maximum words per bulk transfer
+    """
+
+    def __init__(self, client, csw=CSW_DEFAULT, chunk_words=MAX_WORD_COUNT):
+        if csw & CSW_SIZE_MASK != CSW_SIZE_WORD:
+            raise ValueError("CSW must select 32-bit transfers")
+        if not 0 < chunk_words <= MAX_WORD_COUNT:
+            raise ValueError(f"chunk_words must be 1-{MAX_WORD_COUNT}")
+        self.client = client
+        self.csw = csw
+        self.chunk_words = chunk_words
+
+    def read_word(self, addr):
+        """Read a single 32-bit word"""
+        check_aligned(addr)
+        self.client.ap_write(AP_CSW, self.csw)
+        self.client.ap_write(AP_TAR, addr)
+        return self.client.ap_read(AP_DRW).result()
+
+    def write_word(self, addr, value):
+        """Write a single 32-bit word"""
+        check_aligned(addr)
+        self.client.ap_write(AP_CSW, self.csw)
+        self.client.ap_write(AP_TAR, addr)
+        self.client.ap_write(AP_DRW, value)
+        self.client.sync()
+
+    def read_words(self, addr, count):
+        """Read `count` 32-bit words, returning an array('I')"""
+        check_aligned(addr)
+        words = array.array('I', [0]) * count
+        self._read_into(addr, memoryview(words).cast('B'))
+        if SWAP_WORDS:
+            words.byteswap()
+        return words
+
+    def read_spans(self, spans):
+        """Read several (addr, count) spans of words, returning an array('I') for each
+
+        All spans are pipelined and waited for together.
+        """
+        results = []
+        for addr, count in spans:
+            check_aligned(addr)
+            words = array.array('I', [0]) * count
+            self._queue_read_into(addr, memoryview(words).cast('B'))
+            results.append(words)
+        self.client.sync()
+        if SWAP_WORDS:
+            for words in results:
+                words.byteswap()
+        return results
+
+    def write_words(self, addr, words):
+        """Write a sequence of 32-bit words (ints, array('I') or bytes)"""
+        check_aligned(addr)
+        self._write_from(addr, words_to_bytes(words))
+
+    def read_memory(self, addr, nbytes, dtype=None):
+        """Read `nbytes` bytes from `addr`, which need not be aligned
+
+        Returns a bytearray, or a NumPy array of `dtype` (e.g. numpy.uint8,
+        '<u4') viewing the same data if dtype is given.
+        """
+        buf = bytearray()
+        if nbytes:
+            start = addr & ~3
+            end = (addr + nbytes + 3) & ~3
+            buf = bytearray(end - start)
+            self._read_into(start, memoryview(buf))
+            if start != addr or end != addr + nbytes:
+                buf = buf[addr - start:addr - start + nbytes]
+
+        if dtype is not None:
+            if numpy is None:
+                raise RuntimeError("NumPy is required for dtype - pip install numpy")
+            return numpy.frombuffer(buf, dtype=dtype)
+        return buf
+
+    def read_memory_into(self, addr, buf):
+        """Read len(buf) bytes from `addr` straight into the writable buffer `buf`
+
+        `addr` and the length must be word aligned.
+        """
+        check_aligned(addr)
+        view = memoryview(buf).cast('B')
+        if len(view) % 4:
+            raise ValueError("Buffer is not a whole number of words")
+        if view:
+            self._read_into(addr, view)
+
+    def read_memory_spans(self, regions):
+        """Read several (addr, nbytes) regions, which need not be aligned
+
+        Returns a bytearray for each.  All regions are pipelined and waited
+        for together.
+        """
+        bufs = []
+        for addr, nbytes in regions:
+            start = addr & ~3
+            end = (addr + nbytes + 3) & ~3 if nbytes else start
+            buf = bytearray(end - start)
+            if buf:
+                self._queue_read_into(start, memoryview(buf))
+            bufs.append((buf, addr - start, nbytes))
+        self.client.sync()
+        return [buf if offset == 0 and len(buf) == nbytes else buf[offset:offset + nbytes]
+                for buf, offset, nbytes in bufs]
+
+    def write_memory_spans(self, regions, wait=True):
+        """Write several (addr, data) regions, which must be word aligned
+
+        All regions are pipelined, in order.  If wait is False they are sent
+        without waiting for the responses, and any error is raised by the
+        client's next sync().
+        """
+        for addr, data in regions:
+            check_aligned(addr)
+            view = memoryview(data).cast('B')
+            if len(view) % 4:
+                raise ValueError(f"Write to 0x{addr:08X} is not a whole number of words")
+            if view:
+                self._queue_write_from(addr, view)
+        if wait:
+            self.client.sync()
+        else:
+            self.client.flush()
+
+    def write_memory(self, addr, data):
+        """Write the bytes-like `data` to `addr`, which need not be aligned
+
+        Partial words at either end are read, merged and written back.
+        """
+        data = memoryview(data).cast('B')
+        if not data:
+            return
+        start = addr & ~3
+        end = (addr + len(data) + 3) & ~3
+        if start == addr and end == addr + len(data):
+            self._write_from(addr, data)
+            return
+
+        # Read the partial words at each end, then merge
+        buf = bytearray(end - start)
+        head = self._queue_read(start, memoryview(buf)[:4])
+        tail = None
+        if end - 4 > start:
+            tail = self._queue_read(end - 4, memoryview(buf)[-4:])
+        head.result()
+        if tail is not None:
+            tail.result()
+        buf[addr - start:addr - start + len(data)] = data
+        self._write_from(start, memoryview(buf))
+
+    #
+    # Internals
+    #
+
+    def _chunks(self, addr, nbytes):
+        """Yield (addr, offset, words) chunks which don't cross a TAR_WRAP boundary"""
+        offset = 0
+        while offset < nbytes:
+            words = min(self.chunk_words,
+                        (nbytes - offset) // 4,
+                        (TAR_WRAP - (addr % TAR_WRAP)) // 4)
+            yield addr, offset, words
+            addr += words * 4
+            offset += words * 4
+
+    def _queue_read(self, addr, view):
+        self.client.ap_write(AP_CSW, self.csw)
+        self.client.ap_write(AP_TAR, addr)
+        return self.client.ap_bulk_read(AP_DRW, len(view) // 4, into=view)
+
+    def _read_into(self, addr, view):
+        self._queue_read_into(addr, view)
+        self.client.sync()
+
+    def _queue_read_into(self, addr, view):
+        self.client.ap_write(AP_CSW, self.csw)
+        for chunk_addr, offset, words in self._chunks(addr, len(view)):
+            self.client.ap_write(AP_TAR, chunk_addr)
+            self.client.ap_bulk_read(AP_DRW, words, into=view[offset:offset + words * 4])
+
+    def _write_from(self, addr, view):
+        self._queue_write_from(addr, view)
+        self.client.sync()
+
+    def _queue_write_from(self, addr, view):
+        self.client.ap_write(AP_CSW, self.csw)
+        for chunk_addr, offset, words in self._chunks(addr, len(view)):
+            self.client.ap_write(AP_TAR, chunk_addr)
+            self.client.ap_bulk_write(AP_DRW, view[offset:offset + words * 4])
+
+
+def check_aligned(addr):
+    """Check an address is word aligned"""
+    if addr & 3:
+        raise ValueError(f"Address 0x{addr:08X} is not word aligned")
@@ -0,0 +1,153 @@
+"""airfrog.plan - Merge register reads into as few bulk reads as possible
+
+Reading a set of scattered registers one at a time costs a round trip each.
+Registers are usually clustered, so a `ReadPlan` collects the addresses to
+read, merges those within `gap_words` of each other into bulk reads, and
+scatters the values back out afterwards:
+
+    plan = ReadPlan(exclude=STM32F4_SIDE_EFFECTS)
+    plan.add(RCC_CR_ADDR, 4)
+    plan.add(NVIC_IABR0_ADDR, 16)
+    values = plan.read(read_bulk)       # read_bulk(addr, count) -> words
+    rcc_cfgr = values[RCC_CR_ADDR + 8]
+
+Use a bulk/read REST call for `read_bulk`, or `ReadPlan.read_memory()` to
+pipeline every span over the binary API.
+
+Filling a gap means reading registers nobody asked for, so registers whose
+reads have side effects (e.g. clearing a flag or popping a FIFO) must be
+excluded.  Excluded addresses are never read to fill a gap, and if asked for
+explicitly they are read on their own.  Gaps are also never filled across
+the 1KB boundaries at which the MEM-AP's TAR may stop auto-incrementing.
+"""
+
+import bisect
+
+from .bin import MAX_WORD_COUNT, TAR_WRAP
+
+# By default, read up to this many unwanted words to avoid another request
+DEFAULT_GAP_WORDS = 16
+
+# STM32F4 registers whose reads have side effects, as (start, end) address
+# ranges, end exclusive.  These are the data registers of the USARTs, SPIs
+# and I2Cs - reading them pops a received byte and clears status flags.
+STM32F4_SIDE_EFFECTS = (
+    (0x40004404, 0x40004408),   # USART2_DR
+    (0x40004804, 0x40004808),   # USART3_DR
+    (0x40004C04, 0x40004C08),   # UART4_DR
+    (0x40005004, 0x40005008),   # UART5_DR
+    (0x40011004, 0x40011008),   # USART1_DR
+    (0x40011404, 0x40011408),   # USART6_DR
+    (0x4000380C, 0x40003810),   # SPI2_DR
+    (0x40003C0C, 0x40003C10),   # SPI3_DR
+    (0x4001300C, 0x40013010),   # SPI1_DR
+    (0x4001340C, 0x40013410),   # SPI4_DR
+    (0x4001500C, 0x40015010),   # SPI5_DR
+    (0x40005410, 0x40005414),   # I2C1_DR
+    (0x40005810, 0x40005814),   # I2C2_DR
+    (0x40005C10, 0x40005C14),   # I2C3_DR
+)
+
+
+class ReadPlan:
+    """A set of word addresses to read, merged into bulk reads
+
+    Arguments:
+    - gap_words: the most unwanted words to read in order to merge two spans
+    - exclude: (start, end) address ranges, end exclusive, whose reads have
+      side effects
+    - max_words: maximum words per bulk read
+    """
+
+    def __init__(self, gap_words=DEFAULT_GAP_WORDS, exclude=(), max_words=MAX_WORD_COUNT):
+        if gap_words < 0:
+            raise ValueError("gap_words must not be negative")
+        if not 0 < max_words <= MAX_WORD_COUNT:
+            raise ValueError(f"max_words must be 1-{MAX_WORD_COUNT}")
+        self.gap_words = gap_words
+        self.exclude = sorted(exclude)
+        self.max_words = max_words
+        self._addrs = set()
+        self._spans = None
+
+    def __len__(self):
+        return len(self._addrs)
+
+    def add(self, addr, count=1):
+        """Add `count` consecutive words starting at `addr`"""
+        if addr & 3:
+            raise ValueError(f"Address 0x{addr:08X} is not word aligned")
+        self._addrs.update(range(addr, addr + count * 4, 4))
+        self._spans = None
+
+    def add_all(self, addrs):
+        """Add every address in an iterable"""
+        for addr in addrs:
+            self.add(addr)
+
+    def excludes(self, addr, count=1):
+        """Return whether any of `count` words from `addr` has read side effects"""
+        return self._excluded(addr, addr + count * 4)
+
+    def spans(self):
+        """Return the bulk reads needed, as a list of (addr, count)"""
+        if self._spans is None:
+            self._spans = self._merge()
+        return self._spans
+
+    def read(self, read_bulk):
+        """Read every span with `read_bulk(addr, count)`, returning {addr: value}
+
+        The returned dict only contains the addresses that were added.
+        """
+        values = {}
+        for addr, count in self.spans():
+            self._scatter(values, addr, read_bulk(addr, count))
+        return values
+
+    def read_memory(self, memory):
+        """Read every span over the binary API, returning {addr: value}
+
+        `memory` is an `airfrog.memory.Memory`.  All spans are pipelined and
+        waited for together.
+        """
+        spans = self.spans()
+        values = {}
+        for (addr, _), words in zip(spans, memory.read_spans(spans)):
+            self._scatter(values, addr, words)
+        return values
+
+    #
+    # Internals
+    #
+
+    def _excluded(self, start, end):
+        """Return whether any address in [start, end) has read side effects"""
+        i = bisect.bisect_right(self.exclude, (start, float('inf')))
+        if i and self.exclude[i - 1][1] > start:
+            return True
+        return i < len(self.exclude) and self.exclude[i][0] < end
+
+    def _merge(self):
+        spans = []
+        start = end = None
+        for addr in sorted(self._addrs):
+            if start is not None and (
+                    addr - end <= self.gap_words * 4
+                    and (addr + 4 - start) // 4 <= self.max_words
+                    and start // TAR_WRAP == addr // TAR_WRAP
+                    and not self._excluded(end, addr + 4)
+                    and not self._excluded(start, end)):
+                end = addr + 4
+                continue
+            if start is not None:
+                spans.append((start, (end - start) // 4))
+            start, end = addr, addr + 4
+        if start is not None:
+            spans.append((start, (end - start) // 4))
+        return spans
+
+    def _scatter(self, values, addr, words):
+        for i, word in enumerate(words):
+            if addr + i * 4 in self._addrs:
+                values[addr + i * 4] = word
@@ -0,0 +1,141 @@
+"""airfrog.profile - Non-halting statistical PC-sampling profiler
+
+The DWT's PC Sample Register (DWT_PCSR, 0xE000101C) returns the address of
+a recently executed instruction whenever it is read, without halting the
+core, so reading it repeatedly samples where the firmware spends its time.
+
+airfrog's AP Bulk Read always enables address increment, so can't re-read
+one register.  Instead `PcSampler` points TAR at PCSR's 16-byte bank once
+and pipelines single AP reads of banked data register BD3, which reads
+TAR[31:4] + 0xC without touching TAR - each sample costs 2 bytes of request
+and 5 of response, and a batch costs one round trip:
+
+    with Client("192.168.0.103") as client:
+        sampler = PcSampler(client)
+        sampler.enable()
+        profile = Profile(SymbolIndex.load("firmware.elf"))
+        for _ in range(100):
+            profile.add(sampler.sample())
+        for name, count, percent in profile.flat()[:20]:
+            print(f"{percent:6.2f}% {name}")
+
+PCSR gives no call stack, so `Profile.folded()` produces one-frame stacks
+(function, or function and address with `addresses=True`) for flame graph
+tools such as flamegraph.pl or speedscope.
+"""
+
+import collections
+
+from .bin import AP_CSW, AP_TAR, AP_BD3, MAX_WORD_COUNT
+from .memory import Memory, CSW_DEFAULT
+
+DWT_PCSR = 0xE000101C
+DEMCR = 0xE000EDFC
+DEMCR_TRCENA = 1 << 24
+
+# PCSR reads as this while the core is halted
+PCSR_HALTED = 0xFFFFFFFF
+
+# Samples per pipelined batch
+DEFAULT_BATCH = MAX_WORD_COUNT
+
+# Folded stack frame names for samples which aren't in a function
+HALTED_FRAME = '[halted]'
+
+
+class PcSampler:
+    """Reads DWT_PCSR in pipelined batches
+
+    Arguments:
+    - client: a connected `airfrog.bin.Client`
+    - batch: samples to read per batch
+    """
+
+    def __init__(self, client, batch=DEFAULT_BATCH):
+        if batch <= 0:
+            raise ValueError("batch must be positive")
+        self.client = client
+        self.batch = batch
+        self.samples = 0
+
+    def enable(self):
+        """Set DEMCR.TRCENA, which PCSR needs, leaving the rest of DEMCR alone"""
+        memory = Memory(self.client)
+        demcr = memory.read_word(DEMCR)
+        if not demcr & DEMCR_TRCENA:
+            memory.write_word(DEMCR, demcr | DEMCR_TRCENA)
+
+    def sample(self):
+        """Read a batch of PC samples, returning a list of addresses"""
+        client = self.client
+        client.ap_write(AP_CSW, CSW_DEFAULT)
+        client.ap_write(AP_TAR, DWT_PCSR & ~0xF)
+        requests = [client.ap_read(AP_BD3) for _ in range(self.batch)]
+        client.sync()
+        self.samples += self.batch
+        return [req.value for req in requests]
+
+
+class Profile:
+    """Histogram of PC samples
+
+    Arguments:
+    - symbols: an `airfrog.elf.SymbolIndex`, or None to report raw addresses
+    """
+
+    def __init__(self, symbols=None):
+        self.symbols = symbols
+        self.counts = collections.Counter()
+
+    def add(self, pcs):
+        """Add samples"""
+        self.counts.update(pcs)
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    @property
+    def halted(self):
+        return self.counts[PCSR_HALTED]
+
+    def function(self, pc):
+        """Return the frame name for a sample"""
+        if pc == PCSR_HALTED:
+            return HALTED_FRAME
+        if self.symbols is None:
+            return f"0x{pc:08X}"
+        return self.symbols.name(pc)
+
+    def by_function(self):
+        """Return a Counter of samples per function"""
+        functions = collections.Counter()
+        for pc, count in self.counts.items():
+            functions[self.function(pc)] += count
+        return functions
+
+    def flat(self):
+        """Return [(function, samples, percent)], most sampled first"""
+        total = self.total
+        if not total:
+            return []
+        return [(name, count, 100.0 * count / total)
+                for name, count in self.by_function().most_common()]
+
+    def hot_addresses(self, count=None):
+        """Return [(pc, function, samples)] for the most sampled addresses"""
+        return [(pc, self.function(pc), samples)
+                for pc, samples in self.counts.most_common(count)]
+
+    def folded(self, addresses=False):
+        """Yield folded stack lines ("frame;frame count") for flame graphs"""
+        if addresses:
+            for pc, count in sorted(self.counts.items()):
+                name = self.function(pc)
+                if pc == PCSR_HALTED:
+                    yield f"{name} {count}"
+                else:
+                    yield f"{name};0x{pc:08X} {count}"
+        else:
+            for name, count in sorted(self.by_function().items()):
+                yield f"{name} {count}"
@@ -0,0 +1,247 @@
+"""airfrog.rest - Keep-alive client for airfrog's REST API
+
+See docs/REST-API.md for the API specification.
+
+`Client` keeps a pool of persistent HTTP connections to one airfrog, so
+requests after the first don't pay for a TCP handshake.  airfrog only has a
+few HTTP server tasks, each serving one connection at a time, so the pool is
+bounded - when every connection is busy, further requests wait for one to
+become free rather than opening another:
+
+    with Client("192.168.0.103") as client:
+        idcode = client.read_memory(0xE0042000)
+        words = client.read_memory_bulk(0x08000000, 256)
+        print(client.stats)
+
+`Client.stats` separates the time spent setting up connections from the time
+spent on requests, to show what keep-alive saves.
+
+Requires the requests package - pip install requests.
+"""
+
+import threading
+import time
+
+try:
+    import requests
+    import requests.adapters
+    import urllib3.connection
+    import urllib3.connectionpool
+except ImportError:
+    requests = None
+
+# Port used to serve REST API requests
+PORT = 80
+
+# airfrog runs 4 HTTP server tasks - by default leave some for other clients
+DEFAULT_POOL_SIZE = 2
+
+DEFAULT_TIMEOUT = 5.0
+
+
+class RestApiError(Exception):
+    """An error returned by airfrog's REST API
+
+    Arguments:
+    - status: the HTTP status code
+    - source: where the error came from - 'swd', 'airfrog' or None if the
+      response had no error body
+    - kind: the error kind, e.g. 'wait ack', or None
+    - detail: any additional error detail
+    """
+
+    def __init__(self, status, source=None, kind=None, detail=''):
+        if kind is None:
+            message = f"HTTP {status}"
+        else:
+            message = f"HTTP {status}: {source} {kind}" + (f" ({detail})" if detail else "")
+        super().__init__(message)
+        self.status = status
+        self.source = source
+        self.kind = kind
+        self.detail = detail
+
+
+class ConnectionStats:
+    """Connection setup and request timing for a `Client`
+
+    All times are in seconds.  `request_time` is the time spent on requests,
+    excluding any connection setup they waited for, which is counted in
+    `connect_time` instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Zero all statistics"""
+        with self._lock:
+            self.connections = 0
+            self.connect_time = 0.0
+            self.requests = 0
+            self.request_time = 0.0
+            self.max_request_time = 0.0
+
+    def record_connect(self, elapsed):
+        with self._lock:
+            self.connections += 1
+            self.connect_time += elapsed
+
+    def record_request(self, elapsed):
+        with self._lock:
+            self.requests += 1
+            self.request_time += elapsed
+            self.max_request_time = max(self.max_request_time, elapsed)
+
+    @property
+    def mean_connect_time(self):
+        return self.connect_time / self.connections if self.connections else 0.0
+
+    @property
+    def mean_request_time(self):
+        return self.request_time / self.requests if self.requests else 0.0
+
+    def __str__(self):
+        return (f"{self.requests} requests, mean {self.mean_request_time * 1000:.2f}ms "
+                f"(max {self.max_request_time * 1000:.2f}ms); "
+                f"{self.connections} connections, setup mean "
+                f"{self.mean_connect_time * 1000:.2f}ms, total {self.connect_time * 1000:.1f}ms")
+
+
+class Client:
+    """A pooled, keep-alive connection to airfrog's REST API
+
+    Arguments:
+    - host: airfrog's IP address or hostname, optionally with a port, or a
+      base URL such as http://192.168.4.1
+    - pool_size: the most connections to open to airfrog at once
+    - timeout: timeout for each request in seconds
+    """
+
+    def __init__(self, host, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT):
+        if requests is None:
+            raise RuntimeError("The requests package is required - pip install requests")
+        if pool_size < 1:
+            raise ValueError("pool_size must be at least 1")
+        if not host.startswith('http'):
+            host = f"http://{host}"
+        self.base_url = f"{host.rstrip('/')}/api"
+        self.timeout = timeout
+        self.stats = ConnectionStats()
+
+        self.session = requests.Session()
+        adapter = TimedAdapter(self.stats, pool_connections=1, pool_maxsize=pool_size,
+                               pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        """Close all pooled connections"""
+        self.session.close()
+
+    def get(self, path):
+        """GET an API path (e.g. "/target/status"), returning the decoded JSON"""
+        return self.request('GET', path)
+
+    def post(self, path, body=None):
+        """POST a JSON body to an API path, returning the decoded JSON"""
+        return self.request('POST', path, {} if body is None else body)
+
+    def request(self, method, path, body=None):
+        """Make a request, raising RestApiError if airfrog returns an error"""
+        connect_time = self.stats.connect_time
+        start = time.perf_counter()
+        response = self.session.request(method, self.base_url + path, json=body,
+                                        timeout=self.timeout)
+        elapsed = time.perf_counter() - start
+        # Not exact if other threads connect at the same time, but close enough
+        self.stats.record_request(max(0.0, elapsed - (self.stats.connect_time - connect_time)))
+
+        try:
+            result = response.json() if response.content else {}
+        except ValueError:
+            result = {}
+        check_response(response.status_code, result)
+        return result
+
+    #
+    # Target operations
+    #
+
+    def status(self):
+        """Return the target status object"""
+        return self.get("/target/status")["status"]
+
+    def reset_target(self):
+        """Reset and connect to the target, returning its status object"""
+        return self.post("/target/reset").get("status")
+
+    def read_memory(self, addr):
+        """Read a 32-bit word"""
+        return int(self.get(f"/target/memory/read/0x{addr:X}")["data"], 16)
+
+    def write_memory(self, addr, value):
+        """Write a 32-bit word"""
+        self.post(f"/target/memory/write/0x{addr:X}", {"data": f"0x{value:08X}"})
+
+    def read_memory_bulk(self, addr, count):
+        """Read `count` consecutive 32-bit words, returning a list"""
+        result = self.post(f"/target/memory/bulk/read/0x{addr:X}", {"count": count})
+        return [int(value, 16) for value in result["data"]]
+
+    def write_memory_bulk(self, addr, words):
+        """Write a sequence of consecutive 32-bit words"""
+        self.post(f"/target/memory/bulk/write/0x{addr:X}",
+                  {"data": [f"0x{word:08X}" for word in words]})
+
+
+def check_response(status, result):
+    """Raise RestApiError if a response is an error
+
+    airfrog returns target errors wrapped in "error", usually with status 200,
+    and request errors unwrapped, with an error status.
+    """
+    error = result.get("error", result) if isinstance(result, dict) else {}
+    for source in ('swd', 'airfrog'):
+        if isinstance(error.get(source), dict):
+            info = error[source]
+            raise RestApiError(status, source, info.get("kind"), info.get("detail", ""))
+    if status != 200:
+        raise RestApiError(status)
+
+
+if requests is not None:
+
+    class TimedAdapter(requests.adapters.HTTPAdapter):
+        """An HTTPAdapter which records connection setup time in a ConnectionStats"""
+
+        def __init__(self, stats, **kwargs):
+            self.stats = stats
+            super().__init__(**kwargs)
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            stats = self.stats
+
+            def timed(connection_cls):
+                class TimedConnection(connection_cls):
+                    def connect(self):
+                        start = time.perf_counter()
+                        super().connect()
+                        stats.record_connect(time.perf_counter() - start)
+                return TimedConnection
+
+            class HTTPPool(urllib3.connectionpool.HTTPConnectionPool):
+                ConnectionCls = timed(urllib3.connection.HTTPConnection)
+
+            class HTTPSPool(urllib3.connectionpool.HTTPSConnectionPool):
+                ConnectionCls = timed(urllib3.connection.HTTPSConnection)
+
+            self.poolmanager.pool_classes_by_scheme = {'http': HTTPPool, 'https': HTTPSPool}
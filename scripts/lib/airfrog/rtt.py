@@ -0,0 +1,487 @@
+"""airfrog.rtt - SEGGER RTT over the binary API
+
+airfrog's REST API serves RTT from a single up channel, 256 bytes per call
+as JSON.  `Rtt` instead walks the target's SEGGER RTT control block itself,
+using binary API bulk reads, and serves every up channel at once:
+
+    with Client("192.168.0.103") as client:
+        rtt = Rtt(Memory(client), 0x20003A48)
+        while True:
+            for channel, data in rtt.poll().items():
+                sys.stdout.buffer.write(data)
+
+Each poll costs two round trips however many channels have data - one bulk
+read of the channel descriptors, then one pipelined batch of bulk reads
+of every channel's new data.  Each channel's RdOff is then advanced with a
+single word write, sent without waiting for its response, so throughput is
+limited by the SWD speed rather than by encoding.
+
+The control block's address can come from the firmware's `_SEGGER_RTT`
+symbol (`symbol_address()`), or `locate()` can find it by scanning the
+target's RAM for the "SEGGER RTT" ID:
+
+    address = locate(Memory(client))
+
+The scan streams RAM in large bulk reads, so it takes about as long as
+reading the MCU's RAM once.  Hits are cached against a fingerprint of the
+start of flash, so reconnecting to the same firmware reads just the cached
+control block header.  A stale hit is harmless - it fails validation and
+the RAM is scanned again.
+
+`Rtt.write()` sends to a down channel.  Only the host writes a down
+buffer, so `Rtt` keeps a copy of it, and each batch of data is written as
+whole words with bulk writes, without reading back partial words, followed
+by a single WrOff update - all pipelined and sent without waiting.  RdOff
+is only re-read when the free space last seen isn't enough, so the target
+paces the host without costing a round trip per write:
+
+    rtt.write(0, b"reset stats\n")
+
+The control block is:
+- "SEGGER RTT" padded with NULs to 16 bytes
+- MaxNumUpBuffers and MaxNumDownBuffers, 4 bytes each
+- that many up, then down, buffer descriptors of 24 bytes - name pointer,
+  buffer pointer, size, WrOff, RdOff and flags
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import struct
+import time
+
+from .bin import AP_CSW, AP_TAR, AP_DRW, DP_IDCODE, ResponseError
+from .elf import ElfFile
+from .tune import recover
+
+RTT_ID = b'SEGGER RTT\0\0\0\0\0\0'
+HEADER_SIZE = 24
+DESC_SIZE = 24
+
+# Offsets within a buffer descriptor
+DESC_WROFF = 12
+DESC_RDOFF = 16
+
+# Sanity limits, to reject garbage that happens to follow the ID
+MAX_BUFFERS = 32
+MAX_BUFFER_SIZE = 1024 * 1024
+
+# Longest buffer name read
+MAX_NAME = 32
+
+# The firmware's control block symbol
+CB_SYMBOL = '_SEGGER_RTT'
+
+DESC = struct.Struct('<6I')
+
+DBGMCU_IDCODE_ADDR = 0xE0042000
+
+# Main SRAM (base, size) by STM32 DBGMCU_IDCODE DEV_ID, as airfrog-core's
+# Mcu::ram_base() and Mcu::ram_size_bytes() - CCM RAM isn't included
+STM32_RAM = {
+    0x423: (0x20000000, 96 * 1024),     # F401B/C
+    0x433: (0x20000000, 96 * 1024),     # F401D/E
+    0x431: (0x20000000, 128 * 1024),    # F411
+    0x419: (0x20000000, 192 * 1024),    # F427/437
+    0x463: (0x20000000, 256 * 1024),    # F413/423
+    0x413: (0x20000000, 128 * 1024),    # F405/415/407/417
+    0x421: (0x20000000, 128 * 1024),    # F446
+    0x410: (0x20000000, 20 * 1024),     # F103
+}
+
+# RAM (base, size) by DP IDCODE, for MCUs without a DBGMCU
+DP_RAM = {
+    0x0BC12477: (0x20000000, 264 * 1024),   # RP2040
+    0x4C013477: (0x20000000, 512 * 1024),   # RP2350
+}
+
+# Flash base, by the same keys
+STM32_FLASH_BASE = 0x08000000
+DP_FLASH_BASE = {
+    0x0BC12477: 0x10000000,
+    0x4C013477: 0x10000000,
+}
+
+# Bytes read per scan chunk - each is a pipelined run of bulk reads
+SCAN_CHUNK_BYTES = 32 * 1024
+
+# Bytes from the start of flash hashed to identify the firmware
+FINGERPRINT_BYTES = 8192
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'airfrog', 'rtt.json')
+
+# Seconds between RdOff polls while waiting for room in a down buffer
+DEFAULT_WRITE_INTERVAL = 0.001
+
+
+class RttError(Exception):
+    """The control block is missing or corrupt"""
+
+
+class Channel:
+    """An RTT up or down buffer
+
+    Arguments:
+    - index: channel number within its direction
+    - up: True for target to host, False for host to target
+    - desc: the descriptor's address
+    - name, buffer, size, flags: as in the descriptor
+    """
+
+    def __init__(self, index, up, desc, name, buffer, size, flags):
+        self.index = index
+        self.up = up
+        self.desc = desc
+        self.name = name
+        self.buffer = buffer
+        self.size = size
+        self.flags = flags
+        self.bytes = 0
+
+    def __repr__(self):
+        direction = 'up' if self.up else 'down'
+        return (f"<Channel {direction} {self.index} '{self.name}' {self.size} bytes "
+                f"at 0x{self.buffer:08X}>")
+
+
+def symbol_address(elf_path):
+    """Return the address of the firmware's RTT control block from its ELF, or None"""
+    symbol = ElfFile(elf_path).symbol(CB_SYMBOL)
+    return symbol.value if symbol is not None else None
+
+
+#
+# Locating the control block
+#
+
+def target_memory_map(memory):
+    """Return ((ram base, ram size), flash base) for the target MCU, or None if unknown"""
+    idcode = memory.client.dp_read(DP_IDCODE).result()
+    if idcode in DP_RAM:
+        return DP_RAM[idcode], DP_FLASH_BASE[idcode]
+    ram = STM32_RAM.get(memory.read_word(DBGMCU_IDCODE_ADDR) & 0xFFF)
+    if ram is None:
+        return None
+    return ram, STM32_FLASH_BASE
+
+
+def flash_fingerprint(memory, flash_base, nbytes=FINGERPRINT_BYTES):
+    """Return a hash of the start of flash, identifying the firmware"""
+    return hashlib.sha256(memory.read_memory(flash_base, nbytes)).hexdigest()[:32]
+
+
+def scan(memory, base, size, chunk_bytes=SCAN_CHUNK_BYTES):
+    """Yield the address of each RTT ID in `size` bytes from `base`, in order
+
+    Chunks overlap by one byte less than the ID, so IDs straddling a chunk
+    boundary are found, and found once.
+    """
+    overlap = len(RTT_ID) - 1
+    tail = b''
+    offset = 0
+    while offset < size:
+        nbytes = min(chunk_bytes, size - offset)
+        data = tail + memory.read_memory(base + offset, nbytes)
+        data_addr = base + offset - len(tail)
+        pos = data.find(RTT_ID)
+        while pos != -1:
+            yield data_addr + pos
+            pos = data.find(RTT_ID, pos + 1)
+        tail = data[-overlap:]
+        offset += nbytes
+
+
+def locate(memory, ram=None, cache=DEFAULT_CACHE, rescan=False, progress=None):
+    """Find the RTT control block, returning its address
+
+    Arguments:
+    - memory: an `airfrog.memory.Memory`
+    - ram: (base, size) to scan, by default the MCU's main SRAM
+    - cache: file of control block addresses by flash fingerprint, or None
+    - rescan: ignore any cached address
+    - progress: called with a message before a scan
+
+    The first ID whose control block validates is used.  Raises RttError if
+    there is none, or if the MCU is unknown and `ram` wasn't given.
+    """
+    memory_map = target_memory_map(memory)
+    if ram is None:
+        if memory_map is None:
+            raise RttError("Unknown MCU - give the RAM range to scan")
+        ram = memory_map[0]
+
+    fingerprint = None
+    if cache is not None and memory_map is not None:
+        fingerprint = flash_fingerprint(memory, memory_map[1])
+        address = None if rescan else lookup_cached(fingerprint, cache)
+        if address is not None and _valid(memory, address):
+            return address
+
+    base, size = ram
+    if progress is not None:
+        progress(f"Scanning {size // 1024}KB of RAM at 0x{base:08X} for the RTT control block")
+    for address in scan(memory, base, size):
+        if _valid(memory, address):
+            if fingerprint is not None:
+                save_cached(fingerprint, address, cache)
+            return address
+    raise RttError(f"No RTT control block in RAM 0x{base:08X}-0x{base + size - 1:08X}")
+
+
+def _valid(memory, address):
+    try:
+        Rtt(memory, address)
+    except RttError:
+        return False
+    except ResponseError:
+        # A stray ID whose pointers lead nowhere - clear the fault
+        recover(memory.client)
+        return False
+    return True
+
+
+def load_cache(path=DEFAULT_CACHE):
+    """Return the control block cache, {flash fingerprint: {...}}"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cached(fingerprint, address, path=DEFAULT_CACHE):
+    """Store a control block address in the cache"""
+    cache = load_cache(path)
+    cache[fingerprint] = {
+        'address': f"0x{address:08X}",
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp, path)
+
+
+def lookup_cached(fingerprint, path=DEFAULT_CACHE):
+    """Return the cached control block address for a flash fingerprint, or None"""
+    entry = load_cache(path).get(fingerprint)
+    if entry is None:
+        return None
+    try:
+        return int(entry['address'], 0)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class Rtt:
+    """Host side of a target's SEGGER RTT control block
+
+    Arguments:
+    - memory: an `airfrog.memory.Memory`
+    - address: the control block's address
+    """
+
+    def __init__(self, memory, address):
+        self.memory = memory
+        self.client = memory.client
+        self.address = address
+        self.up = []
+        self.down = []
+        self.polls = 0
+        self._down_state = {}
+        self.read_control_block()
+
+    def read_control_block(self):
+        """(Re)read the control block, its descriptors and buffer names"""
+        header = self.memory.read_memory(self.address, HEADER_SIZE)
+        if header[:16] != RTT_ID:
+            raise RttError(f"No RTT control block at 0x{self.address:08X}")
+        num_up, num_down = struct.unpack_from('<ii', header, 16)
+        if not (0 <= num_up <= MAX_BUFFERS and 0 <= num_down <= MAX_BUFFERS):
+            raise RttError(f"Implausible RTT buffer counts {num_up} up, {num_down} down")
+
+        descs = self.memory.read_memory(self.address + HEADER_SIZE, (num_up + num_down) * DESC_SIZE)
+        fields = list(DESC.iter_unpack(descs))
+        for name_ptr, buffer, size, wroff, rdoff, flags in fields:
+            if size > MAX_BUFFER_SIZE or (size and (wroff >= size or rdoff >= size)):
+                raise RttError(f"Corrupt RTT buffer descriptor at 0x{self.address:08X}")
+
+        # Fetch every name in one pipelined batch
+        names = iter(self.memory.read_memory_spans(
+            [(name_ptr, MAX_NAME) for name_ptr, *_ in fields if name_ptr]))
+
+        channels = []
+        for i, (name_ptr, buffer, size, _, _, flags) in enumerate(fields):
+            name = ''
+            if name_ptr:
+                name = next(names).split(b'\0', 1)[0].decode('utf-8', 'replace')
+            up = i < num_up
+            index = i if up else i - num_up
+            channels.append(Channel(index, up, self.address + HEADER_SIZE + i * DESC_SIZE,
+                                    name, buffer, size, flags))
+        self.up = channels[:num_up]
+        self.down = channels[num_up:]
+        self._down_state = {}
+
+    def poll(self):
+        """Read all new data from every up channel, returning {channel index: bytes}
+
+        Channels without new data are left out.
+        """
+        self.polls += 1
+        if not self.up:
+            return {}
+        # Down descriptors follow the up ones, so any being written to are
+        # read in the same transfer, refreshing their RdOff
+        count = len(self.up) + (len(self.down) if self._down_state else 0)
+        descs = list(DESC.iter_unpack(self.memory.read_memory(self.up[0].desc, count * DESC_SIZE)))
+        for index, state in self._down_state.items():
+            rdoff = descs[len(self.up) + index][4]
+            if rdoff < state.channel.size:
+                state.rdoff = rdoff
+
+        pending = []
+        regions = []
+        for channel, (_, _, _, wroff, rdoff, _) in zip(self.up, descs):
+            if wroff == rdoff or not channel.size:
+                continue
+            if wroff >= channel.size or rdoff >= channel.size:
+                raise RttError(f"Corrupt RTT descriptor for up channel {channel.index}")
+            # Up to two spans, if the data wraps around the end of the buffer
+            parts = [(rdoff, wroff)] if wroff > rdoff else [(rdoff, channel.size), (0, wroff)]
+            parts = [(start, end) for start, end in parts if end > start]
+            regions.extend((channel.buffer + start, end - start) for start, end in parts)
+            pending.append((channel, parts, wroff))
+        if not pending:
+            return {}
+
+        reads = iter(self.memory.read_memory_spans(regions))
+        result = {}
+        for channel, parts, wroff in pending:
+            data = bytearray()
+            for _ in parts:
+                data += next(reads)
+            channel.bytes += len(data)
+            result[channel.index] = bytes(data)
+            self._queue_write(channel.desc + DESC_RDOFF, wroff)
+        # Send the RdOff updates without waiting - any error surfaces at the
+        # next sync
+        self.client.flush()
+        return result
+
+    def write(self, index, data, timeout=None, interval=DEFAULT_WRITE_INTERVAL):
+        """Write `data` to a down channel, waiting for the target to make room
+
+        Returns the number of bytes written, which is less than len(data)
+        only if `timeout` seconds passed first.
+        """
+        data = memoryview(data).cast('B')
+        written = self.write_nowait(index, data)
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while written < len(data):
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            time.sleep(interval)
+            written += self.write_nowait(index, data[written:])
+        return written
+
+    def write_nowait(self, index, data):
+        """Write as much of `data` to a down channel as fits, returning the bytes written
+
+        The data and the WrOff update are one pipelined batch, sent without
+        waiting - any error surfaces at the next sync.
+        """
+        data = memoryview(data).cast('B')
+        if not data:
+            return 0
+        state = self._down(index)
+        channel = state.channel
+        if state.free() < len(data):
+            rdoff, = struct.unpack('<I', self.memory.read_memory(channel.desc + DESC_RDOFF, 4))
+            if rdoff >= channel.size:
+                raise RttError(f"Corrupt RTT descriptor for down channel {index}")
+            state.rdoff = rdoff
+        count = min(len(data), state.free())
+        if not count:
+            return 0
+
+        start = state.wroff
+        end = start + count
+        parts = [(start, end)] if end <= channel.size else [(start, channel.size), (0, end - channel.size)]
+        regions = []
+        consumed = 0
+        for part_start, part_end in parts:
+            chunk = data[consumed:consumed + part_end - part_start]
+            consumed += len(chunk)
+            if state.shadow is None:
+                # Unaligned buffer - fall back to read-merge-write
+                self.memory.write_memory(channel.buffer + part_start, chunk)
+                continue
+            state.shadow[part_start:part_end] = chunk
+            word_start = part_start & ~3
+            word_end = (part_end + 3) & ~3
+            regions.append((channel.buffer + word_start, bytes(state.shadow[word_start:word_end])))
+
+        state.wroff = end % channel.size
+        regions.append((channel.desc + DESC_WROFF, struct.pack('<I', state.wroff)))
+        self.memory.write_memory_spans(regions, wait=False)
+        channel.bytes += count
+        return count
+
+    def free(self, index):
+        """Return the free space in a down channel, re-reading its RdOff"""
+        state = self._down(index)
+        rdoff, = struct.unpack('<I', self.memory.read_memory(state.channel.desc + DESC_RDOFF, 4))
+        state.rdoff = rdoff
+        return state.free()
+
+    def sync(self):
+        """Wait for any outstanding RdOff updates and down channel writes"""
+        self.client.sync()
+
+    def _down(self, index):
+        """Return the host's state for a down channel, reading it on first use"""
+        state = self._down_state.get(index)
+        if state is not None:
+            return state
+        channel = self.down[index]
+        if channel.size < 2:
+            raise RttError(f"Down channel {index} has no usable buffer")
+        aligned = not (channel.buffer % 4 or channel.size % 4)
+        regions = [(channel.desc, DESC_SIZE)]
+        if aligned:
+            regions.append((channel.buffer, channel.size))
+        reads = self.memory.read_memory_spans(regions)
+        _, _, _, wroff, rdoff, _ = DESC.unpack(reads[0])
+        if wroff >= channel.size or rdoff >= channel.size:
+            raise RttError(f"Corrupt RTT descriptor for down channel {index}")
+        state = _DownState(channel, wroff, rdoff, reads[1] if aligned else None)
+        self._down_state[index] = state
+        return state
+
+    def _queue_write(self, addr, value):
+        self.client.ap_write(AP_CSW, self.memory.csw)
+        self.client.ap_write(AP_TAR, addr)
+        self.client.ap_write(AP_DRW, value)
+
+
+class _DownState:
+    """The host's view of a down channel
+
+    The host owns WrOff and the buffer's contents, so both are tracked
+    locally.  rdoff is the target's RdOff as last read - the target only
+    advances it, so free() never overstates the room.
+    """
+
+    def __init__(self, channel, wroff, rdoff, shadow):
+        self.channel = channel
+        self.wroff = wroff
+        self.rdoff = rdoff
+        self.shadow = shadow
+
+    def free(self):
+        # One byte is always left free, so a full buffer isn't mistaken
+        # for an empty one
+        return self.channel.size - 1 - (self.wroff - self.rdoff) % self.channel.size
@@ -0,0 +1,83 @@
+"""airfrog.schedule - Fixed-rate sampling on time.perf_counter()
+
+`Scheduler` yields a `Tick` at the start of each sample period.  Ticks are
+due at start + n * period, rather than a period after the previous sample,
+so time spent sampling and sleep overshoot don't accumulate as drift:
+
+    for tick in Scheduler(0.1):
+        sample = read_counters()
+        if tick.overrun:
+            print(f"Sample {tick.index} {tick.late * 1000:.1f}ms late")
+
+When a sample takes longer than a period the following ticks are already
+overdue.  By default those ticks are skipped, so sampling resumes on the
+original grid - otherwise they are yielded immediately, flagged as overruns.
+"""
+
+import collections
+import time
+
+# A sample period.  `index` counts periods from the start, including skipped
+# ones, `due` is when it should have started and `time` when it did.
+# `period` is the time since the previous tick, `late` is time - due, and
+# `skipped` is the number of periods skipped since the previous tick.
+Tick = collections.namedtuple('Tick', 'index due time period late skipped overrun')
+
+
+class Scheduler:
+    """Yields a Tick every `period` seconds
+
+    Arguments:
+    - period: sample period in seconds
+    - skip_overruns: skip periods which were missed entirely, rather than
+      yielding them late
+    - count: stop after this many ticks, or None to run forever
+    - clock: function returning the time in seconds
+    - sleep: function to sleep for a number of seconds
+    """
+
+    def __init__(self, period, skip_overruns=True, count=None,
+                 clock=time.perf_counter, sleep=time.sleep):
+        if period <= 0:
+            raise ValueError("period must be positive")
+        self.period = period
+        self.skip_overruns = skip_overruns
+        self.count = count
+        self.clock = clock
+        self.sleep = sleep
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+
+    def __iter__(self):
+        start = self.clock()
+        index = 0
+        previous = None
+        while self.count is None or self.ticks < self.count:
+            due = start + index * self.period
+            now = self.clock()
+            if now < due:
+                self.sleep(due - now)
+                now = self.clock()
+
+            # Overdue by at least a whole period
+            overrun = now - due >= self.period
+            skipped = 0
+            if overrun:
+                self.overruns += 1
+                if self.skip_overruns:
+                    skipped = int((now - due) // self.period)
+                    self.skipped += skipped
+                    index += skipped
+                    due += skipped * self.period
+
+            period = None if previous is None else now - previous
+            yield Tick(index, due, now, period, now - due, skipped, overrun)
+            self.ticks += 1
+            previous = now
+            index += 1
+
+    @property
+    def overrun_rate(self):
+        """Fraction of ticks which overran"""
+        return self.overruns / self.ticks if self.ticks else 0.0
@@ -0,0 +1,856 @@
+"""airfrog.sim - Simulated SWD target, for offline testing and benchmarking
+
+`SimTarget` models what airfrog sees of an STM32F411 over SWD - the DP, a
+MEM-AP and a Cortex-M4 memory map:
+
+- flash (with the STM32F4 flash controller's unlock, program and erase
+  behaviour), system memory holding the unique ID and flash size, and SRAM
+- SCB, DHCSR/DEMCR, SysTick, NVIC active bits and DBGMCU
+- the DWT, with CYCCNT and the 8-bit event counters ticking at SYSCLK while
+  the core runs, and DWT_PCSR returning samples from a synthetic workload
+- RCC, PWR and GPIO registers with plausible values for a 100MHz part
+- optionally, a SEGGER RTT control block in SRAM, with firmware-side writes
+  and reads, a log producer and an echo firmware (`add_rtt()`)
+
+Time is passed in explicitly (seconds, on the `time.perf_counter()` clock),
+so callers modelling link latency can evaluate the target at the moment an
+operation would really have reached it.
+
+Memory faults raise `SimFault`.  Everything is protected by a lock, so one
+target can be shared by several emulated interfaces.
+"""
+
+import random
+import threading
+import time
+
+# STM32F411 identification
+DP_IDCODE = 0x2BA01477
+AP_IDR = 0x24770011
+AP_BASE = 0xE00FF003
+DBGMCU_IDCODE_VALUE = 0x10006431
+CPUID_VALUE = 0x410FC241
+
+# CTRL/STAT STICKYERR, set by a faulting AP access until ABORT clears it
+DP_STICKYERR = 0x20
+
+# CSW as left by airfrog after connecting
+CSW_DEFAULT = 0x23000052
+
+# Memory map
+FLASH_BASE = 0x08000000
+FLASH_SIZE = 512 * 1024
+SRAM_BASE = 0x20000000
+SRAM_SIZE = 128 * 1024
+SYSMEM_UID_ADDR = 0x1FFF7A10
+SYSMEM_FLASH_SIZE_ADDR = 0x1FFF7A22
+
+# SEGGER RTT control block layout
+RTT_ID = b'SEGGER RTT\0\0\0\0\0\0'
+RTT_HEADER_SIZE = 24
+RTT_DESC_SIZE = 24
+RTT_WROFF = 12
+RTT_RDOFF = 16
+
+# Default RTT control block location - deliberately not 1KB aligned - and
+# buffers, as (name, size)
+RTT_CB_ADDR = SRAM_BASE + 0x3A48
+RTT_UP_BUFFERS = (('Terminal', 1024), ('Telemetry', 512))
+RTT_DOWN_BUFFERS = (('Terminal', 64),)
+
+# STM32F4 flash sector sizes
+SECTOR_SIZES = [16 * 1024] * 4 + [64 * 1024] + [128 * 1024] * 7
+
+# Core clock
+SYSCLK = 100_000_000
+
+# Default fraction of cycles on which each DWT event counter increments, for
+# the synthetic workload
+WORKLOAD = {
+    'cpi': 0.30,
+    'exc': 0.04,
+    'sleep': 0.20,
+    'lsu': 0.15,
+    'fold': 0.02,
+}
+
+# Peripheral registers
+DWT_CTRL = 0xE0001000
+DWT_CYCCNT = 0xE0001004
+DWT_CPICNT = 0xE0001008
+DWT_EXCCNT = 0xE000100C
+DWT_SLEEPCNT = 0xE0001010
+DWT_LSUCNT = 0xE0001014
+DWT_FOLDCNT = 0xE0001018
+DWT_PCSR = 0xE000101C
+
+SYST_CSR = 0xE000E010
+SYST_RVR = 0xE000E014
+SYST_CVR = 0xE000E018
+SYST_CALIB = 0xE000E01C
+NVIC_IABR0 = 0xE000E300
+NUM_NVIC_IABR = 16
+
+SCB_CPUID = 0xE000ED00
+SCB_ICSR = 0xE000ED04
+SCB_VTOR = 0xE000ED08
+SCB_AIRCR = 0xE000ED0C
+DHCSR = 0xE000EDF0
+DEMCR = 0xE000EDFC
+
+DBGMCU_IDCODE = 0xE0042000
+DBGMCU_CR = 0xE0042004
+
+FLASH_R_BASE = 0x40023C00
+FLASH_ACR = FLASH_R_BASE + 0x00
+FLASH_KEYR = FLASH_R_BASE + 0x04
+FLASH_OPTKEYR = FLASH_R_BASE + 0x08
+FLASH_SR = FLASH_R_BASE + 0x0C
+FLASH_CR = FLASH_R_BASE + 0x10
+FLASH_OPTCR = FLASH_R_BASE + 0x14
+
+FLASH_KEY1 = 0x45670123
+FLASH_KEY2 = 0xCDEF89AB
+
+FLASH_SR_EOP = 1 << 0
+FLASH_SR_OPERR = 1 << 1
+FLASH_SR_WRPERR = 1 << 4
+FLASH_SR_PGAERR = 1 << 5
+FLASH_SR_PGPERR = 1 << 6
+FLASH_SR_PGSERR = 1 << 7
+FLASH_SR_BSY = 1 << 16
+FLASH_SR_ERRORS = FLASH_SR_OPERR | FLASH_SR_WRPERR | FLASH_SR_PGAERR | FLASH_SR_PGPERR \
+    | FLASH_SR_PGSERR
+
+FLASH_CR_PG = 1 << 0
+FLASH_CR_SER = 1 << 1
+FLASH_CR_MER = 1 << 2
+FLASH_CR_SNB_SHIFT = 3
+FLASH_CR_SNB_MASK = 0xF << FLASH_CR_SNB_SHIFT
+FLASH_CR_STRT = 1 << 16
+FLASH_CR_LOCK = 1 << 31
+
+# Time the flash is busy for, per erased byte and per programmed word
+FLASH_ERASE_TIME_PER_BYTE = 1e-6
+FLASH_PROGRAM_TIME = 16e-6
+
+# RCC/PWR/GPIO reset-ish values for a 100MHz STM32F411 running from an 8MHz
+# HSE via the PLL
+PERIPHERAL_DEFAULTS = {
+    0x40023800: 0x03035683,     # RCC_CR - PLL and HSE on and ready
+    0x40023804: 0x28416408,     # RCC_PLLCFGR - HSE, M=8, N=400, P=4, Q=8
+    0x40023808: 0x0000100A,     # RCC_CFGR - PLL, APB1 /2
+    0x4002380C: 0x00000000,     # RCC_CIR
+    0x40023830: 0x00000007,     # RCC_AHB1ENR - GPIOA-C
+    0x40023840: 0x10000000,     # RCC_APB1ENR - PWREN
+    0x40023844: 0x00000000,     # RCC_APB2ENR
+    0x40007000: 0x0000C000,     # PWR_CR - VOS scale 1
+    0x40007004: 0x00004000,     # PWR_CSR - VOSRDY
+    0x40020000: 0xA8000000,     # GPIOA_MODER
+    0x40020008: 0x0C000000,     # GPIOA_OSPEEDR
+    0x4002000C: 0x64000000,     # GPIOA_PUPDR
+    0x40020400: 0x00000280,     # GPIOB_MODER
+    0x40020408: 0x000000C0,     # GPIOB_OSPEEDR
+    0x4002040C: 0x00000100,     # GPIOB_PUPDR
+}
+
+# Ranges of plain read/write peripheral registers: RCC, PWR, GPIOA-H, plus
+# the unmodelled parts of the PPB
+REGISTER_RANGES = [
+    (0x40023800, 0x400),
+    (0x40007000, 0x400),
+    (0x40020000, 0x2000),
+    (0xE0000000, 0x100000),
+]
+
+
+class SimFault(Exception):
+    """A simulated bus fault - the SWD equivalent is a FAULT ACK"""
+
+
+class Counter:
+    """A DWT style counter which ticks at `rate` per core cycle when enabled"""
+
+    __slots__ = ('mask', 'rate', 'enabled', '_value', '_base')
+
+    def __init__(self, width, rate):
+        self.mask = (1 << width) - 1
+        self.rate = rate
+        self.enabled = False
+        self._value = 0
+        self._base = 0
+
+    def read(self, cycles):
+        if not self.enabled:
+            return self._value & self.mask
+        return (self._value + int((cycles - self._base) * self.rate)) & self.mask
+
+    def write(self, value, cycles):
+        self._value = value & self.mask
+        self._base = cycles
+
+    def enable(self, enabled, cycles):
+        if enabled != self.enabled:
+            self._value = self.read(cycles)
+            self._base = cycles
+            self.enabled = enabled
+
+
+class SimTarget:
+    """Simulated STM32F411 as seen via SWD
+
+    Arguments:
+    - sysclk: core clock in Hz
+    - workload: per-cycle rates of the DWT event counters, as WORKLOAD
+    - seed: seed for the synthetic workload (PC samples and interrupts)
+    """
+
+    def __init__(self, sysclk=SYSCLK, workload=None, seed=0x4146):
+        self.sysclk = sysclk
+        self.workload = dict(WORKLOAD if workload is None else workload)
+        self.lock = threading.RLock()
+        self.seed = seed
+
+        self.flash = bytearray(b'\xFF' * FLASH_SIZE)
+        self.sram = bytearray(SRAM_SIZE)
+        rng = random.Random(seed)
+        self.uid = [rng.getrandbits(32) for _ in range(3)]
+
+        # Words which increment at a fixed rate while the core runs, e.g. a
+        # firmware's own throughput counter
+        self.ticking = {}
+
+        # SEGGER RTT state, once add_rtt() has been called
+        self._rtt = None
+        self.rtt_dropped = 0
+
+        # Synthetic workload - weighted hot spots in flash
+        self._hotspots = [(FLASH_BASE + 0x200 + rng.randrange(0, 0x8000) * 2,
+                           rng.randrange(4, 64) * 2) for _ in range(24)]
+        self._hot_weights = [rng.random() ** 3 for _ in self._hotspots]
+        self._irqs = [15] + [16 + irq for irq in rng.sample(range(0, 86), 5)]
+        self._rng = rng
+
+        self.reset_state()
+
+    #
+    # State
+    #
+
+    def reset_state(self, now=None):
+        """Power-on reset - everything except memory contents"""
+        with self.lock:
+            now = time.perf_counter() if now is None else now
+            self._t0 = now
+            self._cycles_base = 0
+            self._running = True
+
+            self.dp_ctrl_stat = 0
+            self.dp_select = 0
+            self.dp_rdbuff = 0
+            self.dp_sticky = 0
+            self.csw = 0x03000040
+            self.tar = 0
+
+            self.dhcsr = 0
+            self.demcr = 0
+            self.vtor = 0
+            self.dwt_ctrl = 0x40000000
+            self.cyccnt = Counter(32, 1.0)
+            self.events = {
+                DWT_CPICNT: Counter(8, self.workload['cpi']),
+                DWT_EXCCNT: Counter(8, self.workload['exc']),
+                DWT_SLEEPCNT: Counter(8, self.workload['sleep']),
+                DWT_LSUCNT: Counter(8, self.workload['lsu']),
+                DWT_FOLDCNT: Counter(8, self.workload['fold']),
+            }
+            self.syst_csr = 0
+            self.syst_rvr = 0
+            self.syst_base = 0
+
+            self.flash_keys = 0
+            self.flash_cr = FLASH_CR_LOCK
+            self.flash_sr = 0
+            self.flash_busy_until = 0
+            self.flash_acr = 0x00000703
+
+            self.registers = dict(PERIPHERAL_DEFAULTS)
+            for addr, rate in self.ticking.items():
+                self.ticking[addr] = (rate, 0)
+            if self._rtt is not None:
+                self._rtt['produced'] = 0
+
+    def system_reset(self, now):
+        """SYSRESETREQ - reset the core and peripherals, but not debug"""
+        with self.lock:
+            demcr, dhcsr = self.demcr, self.dhcsr
+            dp = (self.dp_ctrl_stat, self.dp_select, self.csw, self.tar)
+            self.reset_state(now)
+            self.dp_ctrl_stat, self.dp_select, self.csw, self.tar = dp
+            self.demcr = demcr
+            self.dhcsr = dhcsr & 0x1
+            if demcr & 1 and dhcsr & 1:
+                # VC_CORERESET - halt on reset
+                self._halt(now)
+
+    def add_ticking_word(self, addr, rate):
+        """Make the RAM word at `addr` count up at `rate` per second"""
+        with self.lock:
+            self.ticking[addr] = (rate, 0)
+
+    def load_flash(self, data, offset=0):
+        """Load an image into flash"""
+        with self.lock:
+            self.flash[offset:offset + len(data)] = data
+
+    def cycles(self, now):
+        """Return the number of core cycles executed by `now`"""
+        if not self._running:
+            return self._cycles_base
+        return self._cycles_base + int((now - self._t0) * self.sysclk)
+
+    def halted(self):
+        return not self._running
+
+    #
+    # DP/AP access, as airfrog's binary API performs it
+    #
+
+    def dp_read(self, reg, now):
+        with self.lock:
+            if reg == 0x00:
+                return DP_IDCODE
+            if reg == 0x04:
+                # Power up requests are acknowledged immediately
+                ack = (self.dp_ctrl_stat & 0x50000000) << 1
+                return self.dp_ctrl_stat | ack | self.dp_sticky
+            if reg == 0x08:
+                return self.dp_select
+            if reg == 0x0C:
+                return self.dp_rdbuff
+            raise SimFault(f"Invalid DP register 0x{reg:02X}")
+
+    def dp_write(self, reg, value, now):
+        with self.lock:
+            if reg == 0x00:
+                # ABORT - clear sticky errors
+                if value & 0x1E:
+                    self.dp_sticky = 0
+            elif reg == 0x04:
+                self.dp_ctrl_stat = value & 0x50000F00
+            elif reg == 0x08:
+                self.dp_select = value
+            else:
+                raise SimFault(f"Invalid DP register 0x{reg:02X}")
+
+    def ap_read(self, reg, now):
+        with self.lock:
+            self._check_powered()
+            self._check_sticky()
+            value = self._ap_read(reg, now)
+            self.dp_rdbuff = value
+            return value
+
+    def ap_write(self, reg, value, now):
+        with self.lock:
+            self._check_powered()
+            self._check_sticky()
+            self._ap_write(reg, value, now)
+
+    def _check_powered(self):
+        if not self.powered():
+            raise SimFault("Debug domain not powered up")
+
+    def _check_sticky(self):
+        # As on real hardware, AP accesses FAULT until ABORT clears the error
+        if self.dp_sticky & DP_STICKYERR:
+            raise SimFault("STICKYERR set - write ABORT to clear")
+
+    def drw_read_block(self, count, now):
+        """Read DRW `count` times, as a bulk read does, returning bytes
+
+        Plain memory within one 1KB block is copied directly, everything else
+        is read a word at a time.
+        """
+        with self.lock:
+            self._check_powered()
+            self._check_sticky()
+            if self._rtt is not None and self._rtt['running']:
+                self._rtt_run(now)
+            addr = self.tar
+            nbytes = count * 4
+            if self.csw & 0x37 == 0x12 and (addr & 0x3FF) + nbytes <= 0x400 and nbytes:
+                for base, mem in ((FLASH_BASE, self.flash), (SRAM_BASE, self.sram)):
+                    offset = addr - base
+                    if 0 <= offset and offset + nbytes <= len(mem) and not addr & 3 and (
+                            mem is self.flash or not self._ticking_in(addr, nbytes)):
+                        data = bytes(mem[offset:offset + nbytes])
+                        self.dp_rdbuff = int.from_bytes(data[-4:], 'little')
+                        self.tar = (addr & ~0x3FF) | ((addr + nbytes) & 0x3FF)
+                        return data
+            return b''.join(self.ap_read(0x0C, now).to_bytes(4, 'little')
+                            for _ in range(count))
+
+    def _ticking_in(self, addr, nbytes):
+        return any(addr <= tick < addr + nbytes for tick in self.ticking)
+
+    def set_addr_inc(self, enable=True):
+        """Turn single auto-increment on or off, as airfrog does around bulk transfers"""
+        with self.lock:
+            self.csw = (self.csw & ~0x30) | (0x10 if enable else 0)
+
+    def attach(self):
+        """Line reset and power up the debug domain, as airfrog's Reset Target"""
+        with self.lock:
+            self.dp_select = 0
+            self.dp_sticky = 0
+            self.dp_ctrl_stat = 0x50000000
+            self.csw = CSW_DEFAULT
+
+    def powered(self):
+        return self.dp_ctrl_stat & 0x50000000 == 0x50000000
+
+    def _ap_read(self, reg, now):
+        if reg == 0x00:
+            return self.csw
+        if reg == 0x04:
+            return self.tar
+        if reg == 0x0C:
+            value = self._drw_access(None, now)
+            return value
+        if 0x10 <= reg <= 0x1C:
+            return self.read_word((self.tar & ~0xF) | (reg & 0xC), now)
+        if reg == 0xF8:
+            return AP_BASE
+        if reg == 0xFC:
+            return AP_IDR
+        if reg == 0xF4:
+            return 0
+        raise SimFault(f"Invalid AP register 0x{reg:02X}")
+
+    def _ap_write(self, reg, value, now):
+        if reg == 0x00:
+            self.csw = (value & ~0x40) | 0x40
+        elif reg == 0x04:
+            self.tar = value & 0xFFFFFFFF
+        elif reg == 0x0C:
+            self._drw_access(value, now)
+        elif 0x10 <= reg <= 0x1C:
+            self.write_word((self.tar & ~0xF) | (reg & 0xC), value, now)
+        else:
+            raise SimFault(f"Invalid AP register 0x{reg:02X}")
+
+    def _drw_access(self, value, now):
+        size = self.csw & 0x7
+        if size > 2:
+            self.dp_sticky |= DP_STICKYERR
+            raise SimFault("Unsupported transfer size")
+        addr = self.tar
+        try:
+            if size == 2:
+                if value is None:
+                    result = self.read_word(addr, now)
+                else:
+                    self.write_word(addr, value, now)
+                    result = None
+            else:
+                # Byte and halfword accesses use the byte lanes given by TAR
+                word_addr = addr & ~3
+                shift = (addr & 3) * 8
+                mask = (0xFF if size == 0 else 0xFFFF) << shift
+                if value is None:
+                    result = self.read_word(word_addr, now) & mask
+                else:
+                    old = self.read_word(word_addr, now)
+                    self.write_word(word_addr, (old & ~mask) | (value & mask), now)
+                    result = None
+        except SimFault:
+            self.dp_sticky |= DP_STICKYERR
+            raise
+
+        if self.csw & 0x30 == 0x10:
+            # Auto-increment within the 1KB boundary
+            step = 1 << size
+            self.tar = (addr & ~0x3FF) | ((addr + step) & 0x3FF)
+        return result
+
+    #
+    # Memory access
+    #
+
+    def read_word(self, addr, now):
+        """Read an aligned 32-bit word from the memory map"""
+        with self.lock:
+            if addr & 3:
+                raise SimFault(f"Unaligned access 0x{addr:08X}")
+            if FLASH_BASE <= addr < FLASH_BASE + FLASH_SIZE:
+                return int.from_bytes(self.flash[addr - FLASH_BASE:addr - FLASH_BASE + 4], 'little')
+            if 0 <= addr < FLASH_SIZE:
+                # Flash aliased at 0
+                return int.from_bytes(self.flash[addr:addr + 4], 'little')
+            if SRAM_BASE <= addr < SRAM_BASE + SRAM_SIZE:
+                if addr in self.ticking:
+                    return self._ticking_value(addr, now)
+                if self._rtt is not None and self._rtt['running']:
+                    self._rtt_run(now)
+                return int.from_bytes(self.sram[addr - SRAM_BASE:addr - SRAM_BASE + 4], 'little')
+            if SYSMEM_UID_ADDR <= addr < SYSMEM_UID_ADDR + 12:
+                return self.uid[(addr - SYSMEM_UID_ADDR) // 4]
+            if addr == SYSMEM_FLASH_SIZE_ADDR & ~3:
+                return (FLASH_SIZE // 1024) << 16
+            return self._read_register(addr, now)
+
+    def write_word(self, addr, value, now):
+        """Write an aligned 32-bit word to the memory map"""
+        with self.lock:
+            value &= 0xFFFFFFFF
+            if addr & 3:
+                raise SimFault(f"Unaligned access 0x{addr:08X}")
+            if FLASH_BASE <= addr < FLASH_BASE + FLASH_SIZE:
+                self._program_flash(addr - FLASH_BASE, value, now)
+            elif SRAM_BASE <= addr < SRAM_BASE + SRAM_SIZE:
+                if addr in self.ticking:
+                    rate = self.ticking[addr][0]
+                    self.ticking[addr] = (rate, value - int(self.cycles(now) / self.sysclk * rate))
+                self.sram[addr - SRAM_BASE:addr - SRAM_BASE + 4] = value.to_bytes(4, 'little')
+            else:
+                self._write_register(addr, value, now)
+
+    def _ticking_value(self, addr, now):
+        rate, offset = self.ticking[addr]
+        return (offset + int(self.cycles(now) / self.sysclk * rate)) & 0xFFFFFFFF
+
+    #
+    # SEGGER RTT, as the firmware's RTT library sees it
+    #
+
+    def add_rtt(self, addr=RTT_CB_ADDR, up=RTT_UP_BUFFERS, down=RTT_DOWN_BUFFERS, rate=0,
+                echo=False):
+        """Lay out an RTT control block, names and buffers in SRAM
+
+        `up` and `down` are sequences of (name, size).  If `rate` is set, up
+        channel 0 receives log lines at that many bytes per second of core
+        time, dropping lines which don't fit as SEGGER's default mode does.
+        If `echo` is set, data from down channel 0 is copied to up channel 0
+        as space there allows, as a blocking echo firmware would.
+        """
+        with self.lock:
+            ptr = addr + RTT_HEADER_SIZE + (len(up) + len(down)) * RTT_DESC_SIZE
+            descs = {'up': [], 'down': []}
+            layout = []
+            for direction, buffers in (('up', up), ('down', down)):
+                for name, size in buffers:
+                    name_ptr = ptr
+                    self._sram_store(ptr, name.encode() + b'\0')
+                    ptr = (ptr + len(name) + 4) & ~3
+                    layout.append((direction, name_ptr, size))
+            desc = addr + RTT_HEADER_SIZE
+            for direction, name_ptr, size in layout:
+                self._sram_store(desc, b''.join(word.to_bytes(4, 'little')
+                                                for word in (name_ptr, ptr, size, 0, 0, 0)))
+                descs[direction].append(desc)
+                desc += RTT_DESC_SIZE
+                ptr = (ptr + size + 3) & ~3
+            if ptr > SRAM_BASE + SRAM_SIZE:
+                raise ValueError("RTT buffers don't fit in SRAM")
+            # The ID goes in last, so a host never sees a half-built block
+            self._sram_store(addr, RTT_ID + len(up).to_bytes(4, 'little')
+                             + len(down).to_bytes(4, 'little'))
+            self._rtt = {'addr': addr, 'up': descs['up'], 'down': descs['down'], 'rate': rate,
+                         'echo': echo, 'running': bool(rate or echo), 'produced': 0, 'lines': 0}
+
+    def rtt_write(self, channel, data):
+        """Write to an up channel as firmware would, returning False if it didn't fit"""
+        with self.lock:
+            desc = self._rtt['up'][channel]
+            buf, size, wroff, rdoff = (self._sram_word(desc + offset) for offset in (4, 8, 12, 16))
+            free = rdoff - wroff - 1 if rdoff > wroff else size - wroff + rdoff - 1
+            if len(data) > free:
+                self.rtt_dropped += 1
+                return False
+            first = min(len(data), size - wroff)
+            self._sram_store(buf + wroff, data[:first])
+            self._sram_store(buf, data[first:])
+            self._sram_store(desc + RTT_WROFF, ((wroff + len(data)) % size).to_bytes(4, 'little'))
+            return True
+
+    def rtt_free(self, channel):
+        """Return the free space in an up channel"""
+        with self.lock:
+            desc = self._rtt['up'][channel]
+            size, wroff, rdoff = (self._sram_word(desc + offset) for offset in (8, 12, 16))
+            return size - 1 - (wroff - rdoff) % size
+
+    def rtt_read(self, channel, max_bytes=None):
+        """Read from a down channel as firmware would"""
+        with self.lock:
+            desc = self._rtt['down'][channel]
+            buf, size, wroff, rdoff = (self._sram_word(desc + offset) for offset in (4, 8, 12, 16))
+            data = bytearray()
+            while rdoff != wroff and (max_bytes is None or len(data) < max_bytes):
+                end = wroff if wroff > rdoff else size
+                if max_bytes is not None:
+                    end = min(end, rdoff + max_bytes - len(data))
+                offset = buf - SRAM_BASE
+                data += self.sram[offset + rdoff:offset + end]
+                rdoff = end % size
+            self._sram_store(desc + RTT_RDOFF, rdoff.to_bytes(4, 'little'))
+            return bytes(data)
+
+    def _rtt_run(self, now):
+        rtt = self._rtt
+        if rtt['echo'] and rtt['down'] and rtt['up']:
+            room = self.rtt_free(0)
+            if room:
+                data = self.rtt_read(0, room)
+                if data:
+                    self.rtt_write(0, data)
+        if rtt['rate']:
+            self._rtt_produce(now)
+
+    def _rtt_produce(self, now):
+        rtt = self._rtt
+        due = int(self.cycles(now) / self.sysclk * rtt['rate'])
+        # Don't generate more than could possibly fit after a long gap
+        rtt['produced'] = max(rtt['produced'], due - 4096)
+        while rtt['produced'] < due:
+            line = f"[{rtt['lines']:>8}] tick {self.cycles(now):>12} cycles\n".encode()
+            self.rtt_write(0, line)
+            rtt['produced'] += len(line)
+            rtt['lines'] += 1
+
+    def _sram_store(self, addr, data):
+        offset = addr - SRAM_BASE
+        self.sram[offset:offset + len(data)] = data
+
+    def _sram_word(self, addr):
+        offset = addr - SRAM_BASE
+        return int.from_bytes(self.sram[offset:offset + 4], 'little')
+
+    #
+    # Registers
+    #
+
+    def _read_register(self, addr, now):
+        cycles = self.cycles(now)
+        if addr == DWT_CTRL:
+            return self.dwt_ctrl
+        if addr == DWT_CYCCNT:
+            return self.cyccnt.read(cycles)
+        if addr in self.events:
+            return self.events[addr].read(cycles)
+        if addr == DWT_PCSR:
+            return self._pc_sample(cycles)
+        if addr == SYST_CSR:
+            return self.syst_csr
+        if addr == SYST_RVR:
+            return self.syst_rvr
+        if addr == SYST_CVR:
+            return self._systick_value(cycles)
+        if addr == SYST_CALIB:
+            return 0x40000000 | (self.sysclk // 8 // 100 - 1)
+        if NVIC_IABR0 <= addr < NVIC_IABR0 + NUM_NVIC_IABR * 4:
+            return self._iabr((addr - NVIC_IABR0) // 4, cycles)
+        if addr == SCB_CPUID:
+            return CPUID_VALUE
+        if addr == SCB_ICSR:
+            return self._icsr(cycles)
+        if addr == SCB_VTOR:
+            return self.vtor
+        if addr == SCB_AIRCR:
+            return 0xFA050000
+        if addr == DHCSR:
+            status = 1 << 16
+            if not self._running:
+                status |= 1 << 17
+            return status | (self.dhcsr & 0xF)
+        if addr == DEMCR:
+            return self.demcr
+        if addr == DBGMCU_IDCODE:
+            return DBGMCU_IDCODE_VALUE
+        if addr == FLASH_ACR:
+            return self.flash_acr
+        if addr in (FLASH_KEYR, FLASH_OPTKEYR):
+            return 0
+        if addr == FLASH_SR:
+            busy = FLASH_SR_BSY if now < self.flash_busy_until else 0
+            return self.flash_sr | busy
+        if addr == FLASH_CR:
+            return self.flash_cr
+        if addr == FLASH_OPTCR:
+            return 0x0FFFAAED
+        if self._plain_register(addr):
+            return self.registers.get(addr, 0)
+        raise SimFault(f"No memory at 0x{addr:08X}")
+
+    def _write_register(self, addr, value, now):
+        cycles = self.cycles(now)
+        if addr == DWT_CTRL:
+            self.dwt_ctrl = (self.dwt_ctrl & 0xFFFF0000 & ~0x003F0001) | (value & 0x003F0001)
+            self._update_counters(cycles)
+        elif addr == DWT_CYCCNT:
+            self.cyccnt.write(value, cycles)
+        elif addr in self.events:
+            self.events[addr].write(value, cycles)
+        elif addr == SYST_CSR:
+            if value & 1 and not self.syst_csr & 1:
+                self.syst_base = cycles
+            self.syst_csr = value & 0x7
+        elif addr == SYST_RVR:
+            self.syst_rvr = value & 0xFFFFFF
+        elif addr == SYST_CVR:
+            self.syst_base = cycles
+        elif addr == SCB_VTOR:
+            self.vtor = value & 0xFFFFFF80
+        elif addr == SCB_AIRCR:
+            if value >> 16 == 0x05FA and value & 0x4:
+                self.system_reset(now)
+        elif addr == DHCSR:
+            if value >> 16 != 0xA05F:
+                return
+            self.dhcsr = value & 0xF
+            if value & 0x3 == 0x3:
+                self._halt(now)
+            elif not value & 0x2:
+                self._resume(now)
+        elif addr == DEMCR:
+            self.demcr = value & 0x010F07F1
+            self._update_counters(cycles)
+        elif addr == DBGMCU_CR:
+            self.registers[addr] = value
+        elif addr == FLASH_ACR:
+            self.flash_acr = value & 0x1F0F
+        elif addr == FLASH_KEYR:
+            self._flash_key(value)
+        elif addr == FLASH_OPTKEYR:
+            pass
+        elif addr == FLASH_SR:
+            # Error flags and EOP are cleared by writing 1
+            self.flash_sr &= ~(value & (FLASH_SR_ERRORS | FLASH_SR_EOP))
+        elif addr == FLASH_CR:
+            self._flash_control(value, now)
+        elif self._plain_register(addr):
+            self.registers[addr] = value
+        else:
+            raise SimFault(f"No memory at 0x{addr:08X}")
+
+    def _plain_register(self, addr):
+        return any(base <= addr < base + size for base, size in REGISTER_RANGES)
+
+    def _update_counters(self, cycles):
+        trcena = bool(self.demcr & (1 << 24))
+        self.cyccnt.enable(trcena and bool(self.dwt_ctrl & 1), cycles)
+        for bit, addr in ((17, DWT_CPICNT), (18, DWT_EXCCNT), (19, DWT_SLEEPCNT),
+                          (20, DWT_LSUCNT), (21, DWT_FOLDCNT)):
+            self.events[addr].enable(trcena and bool(self.dwt_ctrl & (1 << bit)), cycles)
+
+    def _halt(self, now):
+        if self._running:
+            self._cycles_base = self.cycles(now)
+            self._running = False
+
+    def _resume(self, now):
+        if not self._running:
+            self._t0 = now
+            self._running = True
+
+    def _systick_value(self, cycles):
+        if not self.syst_csr & 1 or self.syst_rvr == 0:
+            return 0
+        # CLKSOURCE 0 is the external reference, SYSCLK/8 on STM32F4
+        elapsed = cycles - self.syst_base
+        if not self.syst_csr & 0x4:
+            elapsed //= 8
+        return self.syst_rvr - (elapsed % (self.syst_rvr + 1))
+
+    #
+    # Synthetic workload
+    #
+
+    def _window(self, cycles):
+        """Deterministic random state for the ~10us window containing `cycles`"""
+        return random.Random((cycles // (self.sysclk // 100_000)) ^ self.seed)
+
+    def _active_vector(self, cycles):
+        rng = self._window(cycles)
+        if rng.random() < self.workload['exc'] * 5:
+            return rng.choice(self._irqs)
+        return 0
+
+    def _icsr(self, cycles):
+        vect = self._active_vector(cycles)
+        icsr = vect
+        if vect and self._window(cycles + 1).random() < 0.1:
+            # Occasionally another interrupt is pending
+            icsr |= (self._irqs[-1] << 12) | (1 << 22)
+        if not vect:
+            icsr |= 1 << 11
+        return icsr
+
+    def _iabr(self, index, cycles):
+        vect = self._active_vector(cycles)
+        if vect < 16 or (vect - 16) // 32 != index:
+            return 0
+        return 1 << ((vect - 16) % 32)
+
+    def _pc_sample(self, cycles):
+        if not self._running:
+            return 0xFFFFFFFF
+        rng = random.Random(cycles ^ self.seed)
+        base, size = rng.choices(self._hotspots, weights=self._hot_weights)[0]
+        return base + rng.randrange(0, size, 2)
+
+    #
+    # STM32F4 flash controller
+    #
+
+    def _flash_key(self, value):
+        if not self.flash_cr & FLASH_CR_LOCK:
+            return
+        if self.flash_keys == 0 and value == FLASH_KEY1:
+            self.flash_keys = 1
+        elif self.flash_keys == 1 and value == FLASH_KEY2:
+            self.flash_cr &= ~FLASH_CR_LOCK
+            self.flash_keys = 0
+        else:
+            # A bad key sequence locks the flash until reset - model it as
+            # just staying locked
+            self.flash_keys = 0
+
+    def _flash_control(self, value, now):
+        if self.flash_cr & FLASH_CR_LOCK:
+            return
+        if now < self.flash_busy_until:
+            self.flash_sr |= FLASH_SR_PGSERR
+            return
+        self.flash_cr = value & (FLASH_CR_LOCK | FLASH_CR_SNB_MASK | 0x0300 | 0x7)
+        if not value & FLASH_CR_STRT:
+            return
+
+        if value & FLASH_CR_MER:
+            self.flash[:] = b'\xFF' * FLASH_SIZE
+            erased = FLASH_SIZE
+        elif value & FLASH_CR_SER:
+            sector = (value & FLASH_CR_SNB_MASK) >> FLASH_CR_SNB_SHIFT
+            if sector >= len(SECTOR_SIZES) or sum(SECTOR_SIZES[:sector]) >= FLASH_SIZE:
+                self.flash_sr |= FLASH_SR_WRPERR
+                return
+            start = sum(SECTOR_SIZES[:sector])
+            erased = SECTOR_SIZES[sector]
+            self.flash[start:start + erased] = b'\xFF' * erased
+        else:
+            self.flash_sr |= FLASH_SR_PGSERR
+            return
+        self.flash_busy_until = now + erased * FLASH_ERASE_TIME_PER_BYTE
+        self.flash_sr |= FLASH_SR_EOP
+
+    def _program_flash(self, offset, value, now):
+        if self.flash_cr & FLASH_CR_LOCK or not self.flash_cr & FLASH_CR_PG:
+            self.flash_sr |= FLASH_SR_PGSERR
+            return
+        # Programming can only clear bits.  A write while busy stalls the bus
+        # until the previous one completes.
+        old = int.from_bytes(self.flash[offset:offset + 4], 'little')
+        self.flash[offset:offset + 4] = (old & value).to_bytes(4, 'little')
+        self.flash_busy_until = max(now, self.flash_busy_until) + FLASH_PROGRAM_TIME
+        self.flash_sr |= FLASH_SR_EOP
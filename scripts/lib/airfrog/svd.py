@@ -0,0 +1,363 @@
+"""airfrog.svd - Register decoding from CMSIS-SVD device descriptions
+
+CMSIS-SVD files describe every register of an MCU - its address, fields and
+their enumerated values.  `SvdIndex` compiles one into a compact index of
+registers sorted by address, each with its field masks and enum tables, so
+whole snapshots of register values can be decoded for any MCU with an SVD
+file:
+
+    index = SvdIndex.load("STM32F411.svd")
+    plan = index.plan(['RCC', 'GPIOA'])
+    values = plan.read(read_bulk)
+    for decoded in index.decode(values):
+        print(format_register(decoded))
+
+SVD files are large (several MB for an STM32F4) and slow to parse, so
+`SvdIndex.load()` pickles the compiled index in ~/.cache/airfrog/svd, keyed
+by a hash of the file, and later loads take milliseconds.
+
+Registers whose reads have side effects (SVD `readAction`) are excluded from
+gap filling by `SvdIndex.plan()`, and write-only registers aren't read.
+Vendors don't always mark side effects - ST's SVDs don't mark the USART, SPI
+and I2C data registers - so also pass known ones as `exclude`:
+
+    plan = index.plan(['USART2'], exclude=STM32F4_SIDE_EFFECTS + index.side_effects())
+"""
+
+import bisect
+import collections
+import hashlib
+import os
+import pickle
+import re
+import xml.etree.ElementTree as ElementTree
+
+from .plan import ReadPlan
+
+# Compiled index format version
+INDEX_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'airfrog', 'svd')
+
+DEFAULT_SIZE = 32
+
+# A register, with its fields sorted by bit offset.  side_effects is set if
+# reading it changes state, readable if it can be read at all.
+Register = collections.namedtuple(
+    'Register', 'addr size peripheral name description fields side_effects readable')
+
+# A register field.  enums maps field values to names, and may be shared
+# between fields.
+Field = collections.namedtuple('Field', 'name lsb width description enums')
+
+# A register's value, and each field's (Field, value, enum name or None)
+DecodedRegister = collections.namedtuple('DecodedRegister', 'register value fields')
+
+
+class SvdError(Exception):
+    """The SVD file couldn't be understood"""
+
+
+class SvdIndex:
+    """Compiled register index for one device
+
+    Arguments:
+    - device: the device name
+    - registers: iterable of Registers
+    - interrupts: {IRQ number: name}
+    """
+
+    def __init__(self, device, registers, interrupts=None):
+        self.device = device
+        self.registers = sorted(registers, key=lambda register: register.addr)
+        self.addrs = [register.addr for register in self.registers]
+        self.interrupts = dict(interrupts or {})
+        self._by_name = {f"{r.peripheral}.{r.name}": r for r in self.registers}
+
+    def __len__(self):
+        return len(self.registers)
+
+    @classmethod
+    def compile(cls, path):
+        """Parse an SVD file into an index"""
+        try:
+            root = ElementTree.parse(path).getroot()
+        except ElementTree.ParseError as e:
+            raise SvdError(f"{path}: {e}") from e
+        return _Compiler(root).index()
+
+    @classmethod
+    def load(cls, path, cache_dir=DEFAULT_CACHE_DIR):
+        """Return the index for an SVD file, using the cached compiled copy if there is one"""
+        cache_path = None
+        if cache_dir is not None:
+            with open(path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            cache_path = os.path.join(cache_dir, f"{digest}.pickle")
+            try:
+                with open(cache_path, 'rb') as f:
+                    version, index = pickle.load(f)
+                if version == INDEX_VERSION:
+                    return index
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError,
+                    TypeError):
+                pass
+
+        index = cls.compile(path)
+        if cache_path is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp = f"{cache_path}.tmp"
+                with open(tmp, 'wb') as f:
+                    pickle.dump((INDEX_VERSION, index), f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, cache_path)
+            except OSError:
+                pass
+        return index
+
+    @property
+    def peripherals(self):
+        """Names of all peripherals, in address order"""
+        return list(dict.fromkeys(register.peripheral for register in self.registers))
+
+    def register(self, name):
+        """Return a Register by "PERIPHERAL.REGISTER" name, or None"""
+        return self._by_name.get(name)
+
+    def find(self, addr):
+        """Return the Register at an address, or None"""
+        index = bisect.bisect_left(self.addrs, addr)
+        if index < len(self.addrs) and self.addrs[index] == addr:
+            return self.registers[index]
+        return None
+
+    def peripheral_registers(self, peripheral):
+        """Return the Registers of a peripheral"""
+        return [register for register in self.registers if register.peripheral == peripheral]
+
+    def side_effects(self):
+        """Return (start, end) ranges of registers with read side effects, for ReadPlan"""
+        return tuple((register.addr, register.addr + max(4, register.size // 8))
+                     for register in self.registers if register.side_effects)
+
+    def plan(self, peripherals, **kwargs):
+        """Return a ReadPlan reading every readable 32-bit register of some peripherals
+
+        Registers with read side effects, or within the plan's `exclude`
+        ranges (by default those of side_effects()), are left out, as are
+        those of other sizes, which need narrower accesses.  kwargs are passed
+        to ReadPlan.
+        """
+        kwargs.setdefault('exclude', self.side_effects())
+        plan = ReadPlan(**kwargs)
+        for peripheral in peripherals:
+            registers = self.peripheral_registers(peripheral)
+            if not registers:
+                raise KeyError(f"{self.device} has no peripheral {peripheral}")
+            for register in registers:
+                if register.readable and not register.side_effects and register.size == 32 \
+                        and not register.addr & 3 and not plan.excludes(register.addr):
+                    plan.add(register.addr)
+        return plan
+
+    def decode(self, values):
+        """Decode a snapshot {addr: value}, returning DecodedRegisters in address order
+
+        Addresses which aren't registers are ignored.
+        """
+        decoded = []
+        for addr in sorted(values):
+            register = self.find(addr)
+            if register is not None:
+                decoded.append(self.decode_register(register, values[addr]))
+        return decoded
+
+    def decode_register(self, register, value):
+        """Decode one register's value"""
+        fields = []
+        for field in register.fields:
+            field_value = (value >> field.lsb) & ((1 << field.width) - 1)
+            fields.append((field, field_value, field.enums.get(field_value) if field.enums else None))
+        return DecodedRegister(register, value, fields)
+
+
+def format_register(decoded, zero_fields=True):
+    """Return a multi-line description of a DecodedRegister"""
+    register = decoded.register
+    lines = [f"{register.peripheral}.{register.name} (0x{register.addr:08X}) = "
+             f"0x{decoded.value:0{register.size // 4}X}"]
+    for field, value, enum in decoded.fields:
+        if not value and not zero_fields:
+            continue
+        bits = f"{field.lsb + field.width - 1}:{field.lsb}" if field.width > 1 else f"{field.lsb}"
+        text = f"  {field.name:<12} [{bits:>5}] = {value:#x}"
+        if enum is not None:
+            text += f" ({enum})"
+        lines.append(text)
+    return '\n'.join(lines)
+
+
+#
+# SVD parsing
+#
+
+def parse_int(text):
+    """Parse an SVD scaled non-negative integer"""
+    text = text.strip().lower()
+    multiplier = 1
+    if text and text[-1] in 'kmg' and not text.startswith('0x'):
+        multiplier = {'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}[text[-1]]
+        text = text[:-1]
+    if text.startswith('#'):
+        return int(text[1:], 2) * multiplier
+    if text.startswith('0b'):
+        return int(text[2:], 2) * multiplier
+    return int(text, 0) * multiplier
+
+
+def dim_names(element, name):
+    """Return [(name, index)] for a possibly dim'd SVD element"""
+    dim = element.findtext('dim')
+    if dim is None:
+        return [(name, 0)]
+    count = parse_int(dim)
+    dim_index = element.findtext('dimIndex')
+    if dim_index is None:
+        indices = [str(i) for i in range(count)]
+    elif '-' in dim_index and ',' not in dim_index:
+        first, last = dim_index.split('-')
+        if first.strip().isdigit():
+            indices = [str(i) for i in range(int(first), int(last) + 1)]
+        else:
+            indices = [chr(c) for c in range(ord(first.strip()), ord(last.strip()) + 1)]
+    else:
+        indices = [index.strip() for index in dim_index.split(',')]
+    return [(name.replace('[%s]', index).replace('%s', index), i)
+            for i, index in enumerate(indices[:count])]
+
+
+class _Compiler:
+    """Walks an SVD element tree, producing an SvdIndex"""
+
+    def __init__(self, root):
+        self.root = root
+        self.enums = {}
+
+    def index(self):
+        root = self.root
+        device = root.findtext('name', 'unknown')
+        defaults = self._properties(root, {'size': DEFAULT_SIZE, 'access': 'read-write'})
+        peripherals = root.find('peripherals')
+        if peripherals is None:
+            raise SvdError(f"{device} has no peripherals")
+
+        by_name = {p.findtext('name'): p for p in peripherals.findall('peripheral')}
+        registers = []
+        interrupts = {}
+        for peripheral in by_name.values():
+            name = peripheral.findtext('name')
+            base = parse_int(peripheral.findtext('baseAddress', '0'))
+            props = self._properties(peripheral, defaults)
+            source = peripheral
+            derived = peripheral.get('derivedFrom')
+            if derived is not None and peripheral.find('registers') is None:
+                source = by_name.get(derived)
+                if source is None:
+                    raise SvdError(f"Peripheral {name} derives from unknown {derived}")
+                props = self._properties(peripheral, self._properties(source, defaults))
+            for interrupt in peripheral.findall('interrupt'):
+                interrupts[parse_int(interrupt.findtext('value'))] = interrupt.findtext('name')
+            block = source.find('registers')
+            if block is not None:
+                registers.extend(self._registers(block, name, base, '', props))
+        return SvdIndex(device, registers, interrupts)
+
+    def _properties(self, element, inherited):
+        props = dict(inherited)
+        size = element.findtext('size')
+        if size is not None:
+            props['size'] = parse_int(size)
+        access = element.findtext('access')
+        if access is not None:
+            props['access'] = access.strip()
+        return props
+
+    def _registers(self, block, peripheral, base, prefix, props):
+        by_name = {r.findtext('name'): r for r in block.findall('register')}
+        for element in block:
+            if element.tag == 'register':
+                yield from self._register(element, by_name, peripheral, base, prefix, props)
+            elif element.tag == 'cluster':
+                offset = parse_int(element.findtext('addressOffset', '0'))
+                increment = parse_int(element.findtext('dimIncrement', '0'))
+                cluster_props = self._properties(element, props)
+                for name, i in dim_names(element, element.findtext('name')):
+                    yield from self._registers(element, peripheral, base + offset + i * increment,
+                                               f"{prefix}{name}.", cluster_props)
+
+    def _register(self, element, siblings, peripheral, base, prefix, props):
+        source = element
+        derived = element.get('derivedFrom')
+        if derived is not None and element.find('fields') is None and derived in siblings:
+            source = siblings[derived]
+        props = self._properties(element, self._properties(source, props))
+        offset = parse_int(element.findtext('addressOffset', '0'))
+        increment = parse_int(element.findtext('dimIncrement', '0'))
+        side_effects = element.findtext('readAction') is not None
+        fields = []
+        for field in source.iterfind('fields/field'):
+            fields.extend(self._fields(field))
+            side_effects = side_effects or field.findtext('readAction') is not None
+        fields.sort(key=lambda f: f.lsb)
+        description = ' '.join((element.findtext('description') or '').split())
+        readable = props['access'] != 'write-only'
+        for name, i in dim_names(element, element.findtext('name')):
+            yield Register(base + offset + i * increment, props['size'], peripheral,
+                           prefix + name, description, tuple(fields), side_effects, readable)
+
+    def _fields(self, element):
+        lsb, width = self._bits(element)
+        enums = None
+        for values in element.findall('enumeratedValues'):
+            if values.findtext('usage', 'read-write').strip() == 'write':
+                continue
+            enums = self._enums(values, width)
+            break
+        description = ' '.join((element.findtext('description') or '').split())
+        increment = parse_int(element.findtext('dimIncrement', '0'))
+        return [Field(name, lsb + i * increment, width, description, enums)
+                for name, i in dim_names(element, element.findtext('name'))]
+
+    def _bits(self, element):
+        offset = element.findtext('bitOffset')
+        if offset is not None:
+            return parse_int(offset), parse_int(element.findtext('bitWidth', '1'))
+        lsb = element.findtext('lsb')
+        if lsb is not None:
+            return parse_int(lsb), parse_int(element.findtext('msb')) - parse_int(lsb) + 1
+        bit_range = element.findtext('bitRange')
+        match = re.match(r'\[(\d+):(\d+)\]', bit_range or '')
+        if match is None:
+            raise SvdError(f"Field {element.findtext('name')} has no bit position")
+        msb, lsb = int(match.group(1)), int(match.group(2))
+        return lsb, msb - lsb + 1
+
+    def _enums(self, element, width):
+        enums = {}
+        default = None
+        for value in element.findall('enumeratedValue'):
+            name = value.findtext('name')
+            if value.findtext('isDefault', 'false').strip() == 'true':
+                default = name
+                continue
+            text = (value.findtext('value') or '').strip().lower()
+            # Binary values with don't-care bits (#1x0) aren't enumerable
+            if not text or (text.startswith(('#', '0b')) and 'x' in text):
+                continue
+            enums[parse_int(text)] = name
+        if default is not None and width <= 8:
+            for i in range(1 << width):
+                enums.setdefault(i, default)
+        # Share identical tables, which are common (e.g. per-pin GPIO modes)
+        key = tuple(sorted(enums.items()))
+        return self.enums.setdefault(key, enums)
@@ -0,0 +1,223 @@
+"""airfrog.transport - Interchangeable target memory access over REST or binary API
+
+Tools which only need target memory access can use a transport, so the user
+can pick the API:
+
+    with open_transport("bin://192.168.0.103") as transport:
+        transport.reset_target()
+        values = transport.read_plan(plan)
+
+`RestTransport` uses the REST API (port 80) through a keep-alive
+`airfrog.rest.Client`.  `BinTransport` uses the binary API (port 4146),
+pipelining all of a read plan's bulk reads so a sample costs a single round
+trip.  Both provide:
+- read_memory(addr) / write_memory(addr, value)
+- read_memory_bulk(addr, count)
+- read_memory_into(addr, buf) - fill a writable buffer from word aligned
+  memory, e.g. a slice of an mmap
+- read_plan(plan) - read an `airfrog.plan.ReadPlan`, returning {addr: value}
+- reset_target() - returning a status dict with 'connected', 'mcu' and
+  'idcode' keys
+- stats - a printable summary of the transport's activity
+
+`BinTransport` can also start with the SWD speed and chunk size cached for
+the target by `airfrog.tune`.
+"""
+
+import struct
+import time
+import urllib.parse
+
+from .bin import Client as BinClient, PORT as BIN_PORT, DP_IDCODE, MAX_WORD_COUNT
+from .memory import Memory
+from .rest import Client as RestClient, DEFAULT_POOL_SIZE
+from .tune import apply_cached
+
+# URL schemes, and the transport each selects
+SCHEMES = ('http', 'bin')
+
+# The REST API's usual ports
+REST_PORT = 80
+REST_TLS_PORT = 443
+
+
+class RestTransport:
+    """Target memory access over the REST API
+
+    Arguments:
+    - host: airfrog's address, optionally with a port
+    - pool_size: the most HTTP connections to open at once
+    """
+
+    name = 'REST'
+
+    def __init__(self, host, pool_size=DEFAULT_POOL_SIZE):
+        self.client = RestClient(host, pool_size=pool_size)
+        self.url = self.client.base_url
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.client.close()
+
+    @property
+    def stats(self):
+        return str(self.client.stats)
+
+    def reset_target(self):
+        return self.client.reset_target() or {}
+
+    def read_memory(self, addr):
+        return self.client.read_memory(addr)
+
+    def write_memory(self, addr, value):
+        self.client.write_memory(addr, value)
+
+    def read_memory_bulk(self, addr, count):
+        if count == 1:
+            return [self.client.read_memory(addr)]
+        return self.client.read_memory_bulk(addr, count)
+
+    def read_memory_into(self, addr, buf):
+        view = memoryview(buf).cast('B')
+        for offset in range(0, len(view), MAX_WORD_COUNT * 4):
+            count = min(MAX_WORD_COUNT, (len(view) - offset) // 4)
+            words = self.read_memory_bulk(addr + offset, count)
+            struct.pack_into(f'<{count}I', view, offset, *words)
+
+    def read_plan(self, plan):
+        return plan.read(self.read_memory_bulk)
+
+
+class BinTransport:
+    """Target memory access over the binary API
+
+    Arguments:
+    - host: airfrog's address
+    - port: binary API port
+    - tuned: apply the target's cached `airfrog.tune` result on reset_target()
+    """
+
+    name = 'binary'
+
+    def __init__(self, host, port=BIN_PORT, tuned=False):
+        self.client = BinClient(host, port=port)
+        self.client.connect()
+        self.memory = Memory(self.client)
+        self.url = f"bin://{host}:{port}"
+        self.tuned = tuned
+        self.tuning = None
+        self.samples = 0
+        self.sample_time = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.client.disconnect()
+
+    @property
+    def stats(self):
+        mean = self.sample_time / self.samples if self.samples else 0.0
+        stats = (f"{self.samples} pipelined reads, mean {mean * 1000:.2f}ms; "
+                 f"{self.client.elided} redundant register writes skipped")
+        if self.tuning is not None:
+            stats += f"; tuned to {self.tuning}"
+        return stats
+
+    def reset_target(self):
+        self.client.reset_target()
+        idcode = self.client.dp_read(DP_IDCODE).result()
+        if self.tuned and self.tuning is None:
+            # The target has to be up to identify it
+            self.tuning = apply_cached(self.client)
+            if self.tuning is not None:
+                self.memory = Memory(self.client, chunk_words=self.tuning.chunk_words)
+        # The binary API doesn't identify the MCU - see the REST API for that
+        return {'connected': True, 'mcu': None, 'idcode': f"0x{idcode:08X}"}
+
+    def read_memory(self, addr):
+        return self.memory.read_word(addr)
+
+    def write_memory(self, addr, value):
+        self.memory.write_word(addr, value)
+
+    def read_memory_bulk(self, addr, count):
+        return list(self.memory.read_words(addr, count))
+
+    def read_memory_into(self, addr, buf):
+        self.memory.read_memory_into(addr, buf)
+
+    def read_plan(self, plan):
+        start = time.perf_counter()
+        values = plan.read_memory(self.memory)
+        self.samples += 1
+        self.sample_time += time.perf_counter() - start
+        return values
+
+
+def parse_url(url, binary=False):
+    """Split a URL or bare host into (scheme, host, port)
+
+    bin://host[:port] is the binary API and http://host[:port] the REST API.
+    A bare host is the binary API if `binary` is set, otherwise REST.  The
+    port defaults to the API's usual one.  Raises ValueError for other
+    schemes.
+    """
+    if '://' not in url:
+        url = f"{'bin' if binary else 'http'}://{url}"
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in SCHEMES + ('https',) or not parsed.hostname:
+        raise ValueError(f"Unsupported URL '{url}' - use a host, or one of "
+                         f"{', '.join(f'{scheme}://host' for scheme in SCHEMES)}")
+    port = parsed.port
+    if port is None:
+        port = {'bin': BIN_PORT, 'http': REST_PORT, 'https': REST_TLS_PORT}[parsed.scheme]
+    return parsed.scheme, parsed.hostname, port
+
+
+def bin_address(url, port=BIN_PORT):
+    """Return (host, port) for the binary API at a bin:// URL or bare host
+
+    For tools which only speak the binary API.  `port` is used when the URL
+    doesn't give one.  Raises ValueError for REST or unsupported URLs.
+    """
+    parsed = urllib.parse.urlsplit(url if '://' in url else f"bin://{url}")
+    if parsed.scheme != 'bin' or not parsed.hostname:
+        raise ValueError(f"'{url}' isn't a binary API address - use a host, or bin://host[:port]")
+    return parsed.hostname, parsed.port or port
+
+
+def api_urls(url, binary=False, rest_port=None, bin_port=None):
+    """Return (REST URL, binary API URL) for the airfrog a URL or bare host names
+
+    The URL's own port is kept for its API, and the other API is on its
+    usual port unless `rest_port` or `bin_port` is given.
+    """
+    scheme, host, port = parse_url(url, binary)
+    if rest_port is None:
+        rest_port = REST_PORT if scheme == 'bin' else port
+    if bin_port is None:
+        bin_port = port if scheme == 'bin' else BIN_PORT
+    rest_scheme = 'http' if scheme == 'bin' else scheme
+    return f"{rest_scheme}://{host}:{rest_port}", f"bin://{host}:{bin_port}"
+
+
+def open_transport(url, binary=False, pool_size=DEFAULT_POOL_SIZE, tuned=False):
+    """Open a transport for a URL or bare host, as parse_url() takes
+
+    `tuned` applies any cached tuning to a binary API transport.
+    """
+    scheme, host, port = parse_url(url, binary)
+    if scheme == 'bin':
+        return BinTransport(host, port=port, tuned=tuned)
+    if '://' not in url:
+        url = f"{scheme}://{url}"
+    return RestTransport(url, pool_size=pool_size)
@@ -0,0 +1,234 @@
+"""airfrog.tune - Find the fastest reliable SWD speed and bulk chunk size
+
+The best SWD speed and bulk transfer chunk size depend on the target, its
+wiring and the WiFi link.  `autotune()` sweeps both over the binary API,
+repeatedly bulk reading a region whose contents don't change (by default
+the start of flash), and picks the fastest configuration which produced no
+error responses (SWD ACK/parity errors) and no mismatched data:
+
+    with Client("192.168.0.103") as client:
+        result = autotune(client)
+        print(result)
+
+Results are cached per target, identified by its DP IDCODE, DBGMCU_IDCODE
+and (on STM32s) unique ID, so later sessions can start tuned:
+
+    result = apply_cached(client)    # None if this target isn't tuned yet
+    memory = Memory(client, chunk_words=result.chunk_words)
+"""
+
+import collections
+import datetime
+import json
+import os
+import time
+
+from .bin import (
+    BinApiError, ResponseError, SPEED_NAMES, SPEED_SLOW, DP_ABORT, DP_IDCODE,
+    MAX_WORD_COUNT,
+)
+from .memory import Memory
+
+# Region read while tuning - the start of flash on STM32s
+DEFAULT_REGION = (0x08000000, 4096)
+
+DEFAULT_CHUNK_WORDS = (32, 64, 128, MAX_WORD_COUNT)
+
+# Reads of the region at each configuration
+DEFAULT_REPEATS = 3
+
+DBGMCU_IDCODE_ADDR = 0xE0042000
+
+# STM32 unique ID addresses, by DBGMCU_IDCODE DEV_ID
+STM32_UID_ADDRS = {
+    **dict.fromkeys((0x410, 0x412, 0x414, 0x418, 0x420, 0x428, 0x430), 0x1FFFF7E8),    # F1
+    **dict.fromkeys((0x411, 0x413, 0x419, 0x421, 0x423, 0x431, 0x433, 0x434, 0x441,
+                     0x458, 0x463), 0x1FFF7A10),                                         # F2/F4
+}
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'airfrog', 'tune.json')
+
+# ABORT value clearing all sticky errors
+ABORT_CLEAR_ALL = 0x1E
+
+# One configuration's outcome - errors counts error responses, mismatches
+# reads which returned the wrong data, and reconnects reads which lost the
+# connection (ending the trial)
+Trial = collections.namedtuple('Trial',
+                               'speed chunk_words bytes_per_s errors mismatches reconnects')
+
+
+class TuneResult(collections.namedtuple('TuneResult', 'target speed chunk_words bytes_per_s')):
+    """The chosen configuration for a target"""
+
+    def __str__(self):
+        return (f"{SPEED_NAMES[self.speed]} speed, {self.chunk_words} word chunks "
+                f"({self.bytes_per_s / 1024:.1f} KB/s) for target {self.target}")
+
+
+class TuneError(Exception):
+    """No reliable configuration was found"""
+
+
+def target_id(client):
+    """Return a string identifying the target, for the tuning cache"""
+    idcode = client.dp_read(DP_IDCODE).result()
+    memory = Memory(client)
+    dbgmcu = memory.read_word(DBGMCU_IDCODE_ADDR)
+    parts = [f"{idcode:08X}", f"{dbgmcu:08X}"]
+    uid_addr = STM32_UID_ADDRS.get(dbgmcu & 0xFFF)
+    if uid_addr is not None:
+        parts.append(''.join(f"{word:08X}" for word in memory.read_words(uid_addr, 3)))
+    return '-'.join(parts)
+
+
+def recover(client):
+    """Clear sticky SWD errors after an error response, reconnecting if needed"""
+    client.invalidate()
+    try:
+        client.dp_write(DP_ABORT, ABORT_CLEAR_ALL)
+        client.sync()
+    except ResponseError:
+        client.reset_target()
+        client.sync()
+
+
+def reconnect(client):
+    """Reconnect after losing the connection, at the slowest, safest speed"""
+    client.close()
+    client.connect()
+    client.set_speed(SPEED_SLOW)
+    recover(client)
+
+
+def autotune(client, region=DEFAULT_REGION, speeds=None, chunk_words=DEFAULT_CHUNK_WORDS,
+             repeats=DEFAULT_REPEATS, cache=DEFAULT_CACHE, progress=None):
+    """Sweep speeds and chunk sizes, returning the fastest reliable TuneResult
+
+    Arguments:
+    - client: a connected `airfrog.bin.Client`
+    - region: (addr, nbytes) of memory to read - its contents mustn't change
+    - speeds: SPEED_* values to try, by default all of them
+    - chunk_words: bulk transfer chunk sizes to try
+    - repeats: reads of the region for each configuration
+    - cache: file to store the result in, or None
+    - progress: called with each Trial as it completes
+
+    The speed is left set to the chosen one.  Raises TuneError if no
+    configuration was reliable.
+    """
+    if speeds is None:
+        speeds = sorted(SPEED_NAMES)
+    addr, nbytes = region
+    target = target_id(client)
+
+    # Reference data, read twice at the slowest, most reliable speed
+    client.set_speed(SPEED_SLOW)
+    client.sync()
+    reference = Memory(client).read_memory(addr, nbytes)
+    if Memory(client).read_memory(addr, nbytes) != reference:
+        raise TuneError(f"Region 0x{addr:08X}+{nbytes} changes between reads - choose a static region")
+
+    trials = []
+    for speed in speeds:
+        for words in chunk_words:
+            # Set for each trial, as a lost connection falls back to SPEED_SLOW
+            client.set_speed(speed)
+            client.sync()
+            trial = _trial(client, speed, words, addr, nbytes, reference, repeats)
+            trials.append(trial)
+            if progress is not None:
+                progress(trial)
+
+    reliable = [t for t in trials if not t.errors and not t.mismatches and not t.reconnects]
+    if not reliable:
+        raise TuneError("No speed and chunk size read the region reliably")
+    best = max(reliable, key=lambda t: t.bytes_per_s)
+    client.set_speed(best.speed)
+    client.sync()
+
+    result = TuneResult(target, best.speed, best.chunk_words, best.bytes_per_s)
+    if cache is not None:
+        save_cached(result, cache)
+    return result
+
+
+def _trial(client, speed, words, addr, nbytes, reference, repeats):
+    memory = Memory(client, chunk_words=words)
+    errors = mismatches = reconnects = good = 0
+    elapsed = 0.0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        try:
+            data = memory.read_memory(addr, nbytes)
+        except ResponseError:
+            errors += 1
+            recover(client)
+            continue
+        except (OSError, BinApiError):
+            # Lost the connection (ConnectionClosed, a timeout) or the
+            # response stream - too unreliable to carry on at this speed
+            reconnects += 1
+            reconnect(client)
+            break
+        elapsed += time.perf_counter() - start
+        good += 1
+        if data != reference:
+            mismatches += 1
+
+    bytes_per_s = good * nbytes / elapsed if elapsed else 0.0
+    return Trial(speed, words, bytes_per_s, errors, mismatches, reconnects)
+
+
+#
+# Cache
+#
+
+def load_cache(path=DEFAULT_CACHE):
+    """Return the tuning cache, {target: {...}}"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cached(result, path=DEFAULT_CACHE):
+    """Store a TuneResult in the tuning cache"""
+    cache = load_cache(path)
+    cache[result.target] = {
+        'speed': SPEED_NAMES[result.speed],
+        'chunk_words': result.chunk_words,
+        'bytes_per_s': result.bytes_per_s,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp, path)
+
+
+def lookup_cached(target, path=DEFAULT_CACHE):
+    """Return the cached TuneResult for a target id, or None"""
+    entry = load_cache(path).get(target)
+    if entry is None:
+        return None
+    speeds = {name: speed for speed, name in SPEED_NAMES.items()}
+    try:
+        return TuneResult(target, speeds[entry['speed']], entry['chunk_words'],
+                          entry.get('bytes_per_s', 0.0))
+    except KeyError:
+        return None
+
+
+def apply_cached(client, path=DEFAULT_CACHE):
+    """Set the cached speed for the connected target, returning its TuneResult or None"""
+    try:
+        result = lookup_cached(target_id(client), path)
+    except BinApiError:
+        return None
+    if result is not None:
+        client.set_speed(result.speed)
+        client.sync()
+    return result
@@ -0,0 +1,51 @@
+"""Shared setup for the emulator-backed airfrog library tests
+
+Each test gets a fresh simulated STM32F411 (`airfrog.sim.SimTarget`) served
+by an in-process `airfrog.emulator.Emulator` on a free local port, with no
+latency model unless the test case asks for one.  From the repository root:
+
+    python3 -m unittest discover -s scripts/test/lib
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+from airfrog.bin import Client
+from airfrog.emulator import Emulator, LinkModel
+from airfrog.sim import SimTarget
+
+
+class EmulatorTestCase(unittest.TestCase):
+    """A test case with `target`, `emulator` and a connected binary API `client`
+
+    Override make_target() or make_link() to change what is emulated.
+    """
+
+    def make_target(self):
+        return SimTarget()
+
+    def make_link(self):
+        return LinkModel.local()
+
+    def setUp(self):
+        self.target = self.make_target()
+        self.emulator = Emulator(self.target, port=0, link=self.make_link())
+        self.emulator.start()
+        self.addCleanup(self.emulator.stop)
+        self.client = self.connect()
+
+    def connect(self, **kwargs):
+        """Open another binary API client to the emulator, closed on cleanup"""
+        client = Client('127.0.0.1', port=self.emulator.port, **kwargs)
+        client.connect()
+        self.addCleanup(client.close)
+        return client
+
+    def commands(self, cmd=None):
+        """Return the commands served so far, in total or of one type"""
+        if cmd is None:
+            return sum(self.emulator.command_counts.values())
+        return self.emulator.command_counts[cmd]
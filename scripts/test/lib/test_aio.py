@@ -0,0 +1,102 @@
+"""airfrog.aio - pipelined asyncio commands, backpressure and timeouts"""
+
+import asyncio
+import time
+import unittest
+
+from emulated import EmulatorTestCase
+
+from airfrog.aio import AsyncClient, run_many
+from airfrog.bin import BinApiError, CMD_DP_READ, DP_IDCODE
+from airfrog.emulator import LinkModel
+from airfrog.sim import DP_IDCODE as SIM_IDCODE
+
+
+class AioTestCase(EmulatorTestCase):
+    RTT = 0.05
+
+    def make_link(self):
+        return LinkModel.local(rtt=self.RTT)
+
+    def run_client(self, func, **kwargs):
+        """Run `func(client)` with a connected AsyncClient"""
+        async def main():
+            async with AsyncClient('127.0.0.1', port=self.emulator.port, **kwargs) as client:
+                return await func(client)
+        return asyncio.run(main())
+
+
+class PipelineTest(AioTestCase):
+    def test_gather_overlaps_round_trips(self):
+        async def reads(client):
+            start = time.perf_counter()
+            results = await asyncio.gather(*(client.dp_read(DP_IDCODE) for _ in range(20)))
+            return results, time.perf_counter() - start
+
+        results, elapsed = self.run_client(reads)
+        self.assertEqual(results, [SIM_IDCODE] * 20)
+        self.assertEqual(self.commands(CMD_DP_READ), 20)
+        # Lock-step reads would take 20 round trips
+        self.assertLess(elapsed, 5 * self.RTT)
+
+    def test_window_limits_commands_in_flight(self):
+        async def reads(client):
+            inflight = []
+            done = asyncio.Event()
+
+            async def watch():
+                while not done.is_set():
+                    inflight.append(len(client._pending))
+                    await asyncio.sleep(0)
+
+            watcher = asyncio.create_task(watch())
+            start = time.perf_counter()
+            results = await asyncio.gather(*(client.dp_read(DP_IDCODE) for _ in range(8)))
+            elapsed = time.perf_counter() - start
+            done.set()
+            await watcher
+            return results, elapsed, max(inflight)
+
+        results, elapsed, most = self.run_client(reads, max_inflight=2)
+        self.assertEqual(results, [SIM_IDCODE] * 8)
+        self.assertEqual(most, 2)
+        # At most two round trips overlap
+        self.assertGreater(elapsed, 3.5 * self.RTT)
+
+
+class TimeoutTest(AioTestCase):
+    def make_link(self):
+        # Long enough that no response arrives before the client gives up
+        return LinkModel.local(overhead=1.0)
+
+    def test_timeout_aborts(self):
+        async def reads(client):
+            results = await asyncio.gather(*(client.dp_read(DP_IDCODE) for _ in range(3)),
+                                           return_exceptions=True)
+            try:
+                await client.ping()
+            except Exception as e:
+                return results, e
+
+        results, after = self.run_client(reads, timeout=0.2)
+        for result in results:
+            self.assertIsInstance(result, asyncio.TimeoutError)
+            self.assertIn("DP Read timed out after 0.2s", str(result))
+        # Later commands report the abort, not "Not connected"
+        self.assertIs(after, results[0])
+
+
+class RunManyTest(AioTestCase):
+    def test_dead_host_is_isolated(self):
+        async def idcode(client):
+            return await client.dp_read(DP_IDCODE)
+
+        # The emulator only listens on 127.0.0.1
+        hosts = ['127.0.0.1', '127.0.0.2']
+        results = asyncio.run(run_many(hosts, idcode, port=self.emulator.port, timeout=1.0))
+        self.assertEqual(results['127.0.0.1'], SIM_IDCODE)
+        self.assertIsInstance(results['127.0.0.2'], (OSError, BinApiError))
+
+
+if __name__ == '__main__':
+    unittest.main()
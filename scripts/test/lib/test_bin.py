@@ -0,0 +1,179 @@
+"""airfrog.bin - pipelining, write coalescing and register shadowing"""
+
+import time
+import unittest
+
+from emulated import EmulatorTestCase
+
+from airfrog.bin import (
+    ResponseError, CMD_AP_WRITE, CMD_AP_BULK_READ, CMD_DP_READ, CMD_MULTI_REG_WRITE,
+    RSP_ERR_SWD, DP_ABORT, DP_IDCODE, AP_CSW, AP_TAR, AP_DRW, LEVEL_LOW, TAR_WRAP,
+)
+from airfrog.emulator import LinkModel
+from airfrog.sim import DP_IDCODE as SIM_IDCODE, CSW_DEFAULT, SRAM_BASE
+
+# Neither mapped memory nor a register on the simulated target
+UNMAPPED = 0x60000000
+
+ABORT_CLEAR_ALL = 0x1E
+
+
+class PipelineTest(EmulatorTestCase):
+    def test_requests_stay_in_flight(self):
+        reqs = [self.client.dp_read(DP_IDCODE) for _ in range(50)]
+        self.client.flush()
+        self.assertEqual(self.client.outstanding(), 50)
+        self.assertEqual(len(self.client.sync()), 50)
+        self.assertEqual([req.result() for req in reqs], [SIM_IDCODE] * 50)
+        self.assertEqual(self.commands(CMD_DP_READ), 50)
+
+    def test_responses_matched_in_order(self):
+        for i in range(8):
+            self.target.sram[i * 4:i * 4 + 4] = (0x1000 + i).to_bytes(4, 'little')
+        self.client.ap_write(AP_CSW, CSW_DEFAULT)
+        reqs = []
+        for i in range(8):
+            self.client.ap_write(AP_TAR, SRAM_BASE + i * 4)
+            reqs.append(self.client.ap_read(AP_DRW))
+        self.assertEqual([req.result() for req in reqs], [0x1000 + i for i in range(8)])
+
+
+class PipelineLatencyTest(EmulatorTestCase):
+    RTT = 0.05
+
+    def make_link(self):
+        return LinkModel.local(rtt=self.RTT)
+
+    def test_reads_overlap_round_trips(self):
+        start = time.perf_counter()
+        for _ in range(20):
+            self.client.dp_read(DP_IDCODE)
+        self.client.sync()
+        # Lock-step reads would take 20 round trips
+        self.assertLess(time.perf_counter() - start, 5 * self.RTT)
+
+
+class CoalesceTest(EmulatorTestCase):
+    def test_writes_sent_as_multi_reg_write(self):
+        self.client.ap_write(AP_CSW, CSW_DEFAULT)
+        self.client.ap_write(AP_TAR, SRAM_BASE)
+        writes = [self.client.ap_write(AP_DRW, value) for value in (0x11, 0x22, 0x33)]
+        self.assertEqual(self.commands(), 0)
+        self.client.sync()
+        self.assertEqual(self.commands(CMD_MULTI_REG_WRITE), 1)
+        self.assertEqual(self.commands(CMD_AP_WRITE), 0)
+        self.assertTrue(all(req.ok() for req in writes))
+        self.assertEqual(bytes(self.target.sram[:12]),
+                         b''.join(value.to_bytes(4, 'little') for value in (0x11, 0x22, 0x33)))
+
+    def test_read_is_a_barrier(self):
+        self.client.ap_write(AP_CSW, CSW_DEFAULT)
+        self.client.ap_write(AP_TAR, SRAM_BASE)
+        self.client.ap_write(AP_DRW, 0xCAFEF00D)
+        self.client.ap_write(AP_TAR, SRAM_BASE)
+        read = self.client.ap_read(AP_DRW)
+        self.assertEqual(read.result(), 0xCAFEF00D)
+        self.assertEqual(self.commands(CMD_MULTI_REG_WRITE), 1)
+
+    def test_lone_write_sent_alone(self):
+        req = self.client.ap_write(AP_CSW, CSW_DEFAULT)
+        req.result()
+        self.assertIsNone(req.group)
+        self.assertEqual(self.commands(CMD_AP_WRITE), 1)
+        self.assertEqual(self.commands(CMD_MULTI_REG_WRITE), 0)
+
+    def test_error_fails_every_coalesced_write(self):
+        writes = [self.client.ap_write(AP_CSW, CSW_DEFAULT),
+                  self.client.ap_write(AP_TAR, UNMAPPED),
+                  self.client.ap_write(AP_DRW, 0)]
+        with self.assertRaises(ResponseError):
+            self.client.sync()
+        self.assertEqual([req.status for req in writes], [RSP_ERR_SWD] * 3)
+        group = writes[0].group
+        self.assertEqual(group.cmd, CMD_MULTI_REG_WRITE)
+        self.assertEqual(group.members, writes)
+        self.assertTrue(all(req.group is group for req in writes))
+
+    def test_coalescing_off(self):
+        client = self.connect(coalesce=False)
+        client.ap_write(AP_CSW, CSW_DEFAULT)
+        client.ap_write(AP_TAR, SRAM_BASE)
+        client.sync()
+        self.assertEqual(self.commands(CMD_AP_WRITE), 2)
+        self.assertEqual(self.commands(CMD_MULTI_REG_WRITE), 0)
+
+
+class ShadowTest(EmulatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.ap_write(AP_CSW, CSW_DEFAULT)
+        self.client.ap_write(AP_TAR, SRAM_BASE)
+        self.client.sync()
+        self.elided = self.client.elided
+
+    def assertElided(self, reg, value, elided=True):
+        self.client.ap_write(reg, value)
+        self.assertEqual(self.client.elided - self.elided, int(elided))
+        self.elided = self.client.elided
+        self.client.sync()
+
+    def test_unchanged_writes_skipped(self):
+        before = self.commands()
+        self.assertElided(AP_CSW, CSW_DEFAULT)
+        self.assertElided(AP_TAR, SRAM_BASE)
+        self.assertEqual(self.commands(), before)
+
+    def test_changed_writes_sent(self):
+        self.assertElided(AP_TAR, SRAM_BASE + 4, elided=False)
+
+    def test_tar_follows_auto_increment(self):
+        self.client.ap_read(AP_DRW)
+        self.assertElided(AP_TAR, SRAM_BASE + 4)
+        self.client.ap_bulk_read(AP_DRW, 4)
+        self.assertElided(AP_TAR, SRAM_BASE + 20)
+
+    def test_tar_forgotten_at_wrap(self):
+        self.assertElided(AP_TAR, SRAM_BASE + TAR_WRAP - 4, elided=False)
+        self.client.ap_read(AP_DRW)
+        self.assertElided(AP_TAR, SRAM_BASE + TAR_WRAP, elided=False)
+
+    def test_tar_kept_without_auto_increment(self):
+        self.assertElided(AP_CSW, CSW_DEFAULT & ~0x30, elided=False)
+        self.client.ap_read(AP_DRW)
+        self.assertElided(AP_TAR, SRAM_BASE)
+
+    def test_bulk_transfer_turns_on_auto_increment(self):
+        self.assertElided(AP_CSW, CSW_DEFAULT & ~0x30, elided=False)
+        self.client.ap_bulk_read(AP_DRW, 2)
+        self.assertElided(AP_CSW, CSW_DEFAULT)
+        self.assertElided(AP_TAR, SRAM_BASE + 8)
+
+    def test_invalidated(self):
+        for name, invalidate in (
+                ('invalidate', self.client.invalidate),
+                ('reset_target', self.client.reset_target),
+                ('clock', lambda: self.client.clock(LEVEL_LOW, LEVEL_LOW, 8))):
+            with self.subTest(name):
+                invalidate()
+                self.client.sync()
+                self.assertElided(AP_CSW, CSW_DEFAULT, elided=False)
+                self.assertElided(AP_TAR, SRAM_BASE, elided=False)
+
+    def test_error_invalidates(self):
+        self.client.ap_write(AP_TAR, UNMAPPED)
+        self.client.ap_read(AP_DRW)
+        self.client.sync(raise_errors=False)
+        self.client.dp_write(DP_ABORT, ABORT_CLEAR_ALL)
+        self.assertElided(AP_CSW, CSW_DEFAULT, elided=False)
+        self.assertElided(AP_TAR, UNMAPPED, elided=False)
+
+    def test_bulk_read_lands_in_buffer(self):
+        self.target.sram[:16] = bytes(range(16))
+        buf = bytearray(16)
+        self.assertIs(self.client.ap_bulk_read(AP_DRW, 4, into=buf).result(), buf)
+        self.assertEqual(buf, bytes(range(16)))
+        self.assertEqual(self.commands(CMD_AP_BULK_READ), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""airfrog.capture - writing captures, and reading them back"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+from airfrog.capture import CaptureWriter, NPY_ALIGNMENT, PERF_FIELDS, load_capture
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Enough fields that the descr alone is longer than a 256 byte header
+WIDE_FIELDS = tuple((f'counter_with_a_long_name_{i}', 'u4') for i in range(12))
+
+
+def samples(fields, count):
+    return [{name: i * 10 + n for n, (name, _) in enumerate(fields)} for i in range(count)]
+
+
+@unittest.skipIf(numpy is None, "requires NumPy")
+class NpyTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'capture.npy')
+
+    def write(self, fields, rows, close=True, batch_size=4):
+        capture = CaptureWriter(self.path, fields, batch_size=batch_size)
+        for sample in samples(fields, rows):
+            capture.append(sample)
+        if close:
+            capture.close()
+        else:
+            capture.flush()
+            self.addCleanup(capture.close)
+        return capture
+
+    def check(self, data, fields, rows):
+        self.assertEqual(data.dtype.names, tuple(name for name, _ in fields))
+        self.assertEqual([tuple(int(value) for value in row) for row in data],
+                         [tuple(sample.values()) for sample in samples(fields, rows)])
+
+    def test_round_trip(self):
+        self.write(PERF_FIELDS, 10)
+        data = numpy.load(self.path)
+        self.assertEqual(data.shape, (10,))
+        self.check(data, PERF_FIELDS, 10)
+
+    def test_long_header(self):
+        self.write(WIDE_FIELDS, 10)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(numpy.lib.format.read_magic(f), (1, 0))
+            shape, _, _ = numpy.lib.format.read_array_header_1_0(f)
+            self.assertEqual(f.tell() % NPY_ALIGNMENT, 0)
+        self.assertEqual(shape, (10,))
+        self.check(numpy.load(self.path), WIDE_FIELDS, 10)
+
+    def test_header_size_is_fixed(self):
+        capture = CaptureWriter(self.path, WIDE_FIELDS)
+        capture.close()
+        empty = os.path.getsize(self.path)
+        # The data starts in the same place whatever the final row count
+        capture.rows = (1 << 64) - 1
+        with open(self.path, 'r+b') as capture._file:
+            capture._write_npy_header()
+            self.assertEqual(capture._file.tell(), empty)
+
+    def test_unclosed(self):
+        self.write(WIDE_FIELDS, 6, close=False)
+        self.check(load_capture(self.path), WIDE_FIELDS, 6)
+
+    def test_too_many_fields(self):
+        fields = [(f'field_{i}', 'u4') for i in range(5000)]
+        with self.assertRaises(ValueError):
+            CaptureWriter(self.path, fields)
+
+
+@unittest.skipIf(numpy is None, "requires NumPy")
+class CsvTest(unittest.TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'capture.csv')
+            with CaptureWriter(path, WIDE_FIELDS, batch_size=3) as capture:
+                for sample in samples(WIDE_FIELDS, 7):
+                    capture.append(sample)
+            data = load_capture(path)
+        self.assertEqual(data.dtype.names, tuple(name for name, _ in WIDE_FIELDS))
+        self.assertEqual(len(data), 7)
+        self.assertEqual(int(data[6][1]), 61)
+
+
+class WriterTest(unittest.TestCase):
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            CaptureWriter('capture.txt', PERF_FIELDS)
+
+    def test_unsupported_type(self):
+        with self.assertRaises(ValueError):
+            CaptureWriter('capture.csv', [('x', 'u2')])
+
+
+if __name__ == '__main__':
+    unittest.main()
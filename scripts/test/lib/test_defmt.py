@@ -0,0 +1,220 @@
+"""airfrog.defmt - rzCOBS, argument decoding and streaming"""
+
+import os
+import random
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+from airfrog.defmt import (
+    Decoder, DefmtError, Table, ENCODING_RAW, decode, format_frame, rzcobs_decode,
+)
+
+
+def rzcobs_encode(data):
+    """Reference rzCOBS encoder, following the rzcobs crate, without the terminating zero"""
+    out = bytearray()
+    run = 0
+    zeros = 0
+    for byte in data:
+        if run < 7:
+            if byte:
+                out.append(byte)
+            else:
+                zeros |= 1 << run
+            run += 1
+            if run == 7 and zeros:
+                out.append(zeros)
+                run = zeros = 0
+        elif not byte:
+            out.append((run - 7) | 0x80)
+            run = zeros = 0
+        else:
+            out.append(byte)
+            run += 1
+            if run == 134:
+                out.append(0xFF)
+                run = zeros = 0
+    if 1 <= run <= 6:
+        out.append((zeros | (0xFF << run)) & 0x7F)
+    elif run:
+        out.append((run - 7) | 0x80)
+    return bytes(out)
+
+
+def u8(value):
+    return struct.pack('<B', value)
+
+
+def u16(value):
+    return struct.pack('<H', value)
+
+
+def u32(value):
+    return struct.pack('<I', value)
+
+
+INFO = 1
+PRINTLN = 2
+TIMESTAMP = 3
+POINT = 4
+OPTION = 5
+NAME = 6
+
+ENTRIES = {
+    INFO: ('defmt_info', '{}'),
+    PRINTLN: ('defmt_println', '{=?}'),
+    POINT: ('defmt_derived', 'Point {{ x: {=u8}, y: {=i16} }}'),
+    OPTION: ('defmt_derived', 'None|Some({=u8})'),
+    NAME: ('defmt_str', 'sensor'),
+}
+
+# Log frames carry the timestamp once the firmware defines one
+TIMESTAMPED = {**ENTRIES, TIMESTAMP: ('defmt_timestamp', '{=u32:us}')}
+
+
+class RzcobsTest(unittest.TestCase):
+    def test_round_trip(self):
+        rng = random.Random(0x4146)
+        samples = [b'', b'\0', b'\x01', b'\0' * 20, bytes(range(1, 256)) * 2]
+        for _ in range(300):
+            zeros = rng.random()
+            samples.append(bytes(0 if rng.random() < zeros else rng.randrange(1, 256)
+                                 for _ in range(rng.randrange(0, 600))))
+        for data in samples:
+            with self.subTest(data=data[:16], length=len(data)):
+                encoded = rzcobs_encode(data)
+                self.assertNotIn(0, encoded)
+                decoded = rzcobs_decode(encoded)
+                # Incomplete groups and runs decode as trailing zeros
+                self.assertEqual(bytes(decoded[:len(data)]), data)
+                self.assertFalse(any(decoded[len(data):]))
+
+    def test_truncated(self):
+        with self.assertRaises(DefmtError):
+            rzcobs_decode(bytes([0x85]))
+        with self.assertRaises(DefmtError):
+            rzcobs_decode(bytes([0x01]))
+
+
+class DecodeTest(unittest.TestCase):
+    def message(self, string, args, entries=None):
+        """Decode one println frame with the given format string and argument bytes"""
+        table = Table({**ENTRIES, 100: ('defmt_println', string), **(entries or {})})
+        return Decoder(table).decode_frame(u16(100) + args).message
+
+    def test_primitives(self):
+        self.assertEqual(
+            self.message('{=u8} {=i8} {=u16} {=i32} {=u64} {=bool} {=bool} {=char}',
+                         u8(200) + struct.pack('<b', -3) + u16(65535) + struct.pack('<i', -70000)
+                         + struct.pack('<Q', 1 << 40) + u8(1) + u8(0) + u32(ord('é'))),
+            f"200 -3 65535 -70000 {1 << 40} true false é")
+        self.assertEqual(self.message('{=f32}', struct.pack('<f', 1.5)), '1.5')
+        self.assertEqual(self.message('{=i128}', (-5).to_bytes(16, 'little', signed=True)), '-5')
+
+    def test_hints(self):
+        self.assertEqual(self.message('{=u8:x} {=u8:#x} {=u16:#06x} {=u8:b} {=u32:ms}',
+                                      u8(0xAB) + u8(0xAB) + u16(0xAB) + u8(5) + u32(1234)),
+                         'ab 0xab 0x00ab 101 1.234')
+
+    def test_explicit_indices(self):
+        self.assertEqual(self.message('{1=u8} {0=u16} {1=u8:x}', u16(300) + u8(255)),
+                         '255 300 ff')
+
+    def test_escaped_braces(self):
+        self.assertEqual(self.message('{{{=u8}}}', u8(7)), '{7}')
+
+    def test_str(self):
+        text = 'héllo'.encode()
+        self.assertEqual(self.message('<{=str}>', u32(len(text)) + text), '<héllo>')
+        self.assertEqual(self.message('{=istr}', u16(NAME)), 'sensor')
+        self.assertEqual(self.message('{=[u8]}', u32(3) + b'\x01\x02\x03'), '[1, 2, 3]')
+        self.assertEqual(self.message('{=[u8;2]:x}', b'\xAB\xCD'), '[ab, cd]')
+        self.assertEqual(self.message('{=__internal_Display}|', b'ok\xff'), 'ok|')
+
+    def test_bitfields(self):
+        # Bits 4..12 of one u16 argument, sent as the two bytes spanning them
+        self.assertEqual(self.message('{0=0..4} {0=4..8} {0=8..=11}', u16(0x0A5C)),
+                         '0b1100 0b101 0b1010')
+        # Only the bytes spanning the fields are sent
+        self.assertEqual(self.message('{0=8..12:x}', u8(0xF3)), '3')
+
+    def test_derived_struct(self):
+        self.assertEqual(self.message('{=?}', u16(POINT) + u8(3) + struct.pack('<h', -4)),
+                         'Point { x: 3, y: -4 }')
+
+    def test_derived_enum(self):
+        self.assertEqual(self.message('{} {}', u16(OPTION) + u8(1) + u8(9) + u16(OPTION) + u8(0)),
+                         'Some(9) None')
+        with self.assertRaises(DefmtError):
+            self.message('{}', u16(OPTION) + u8(2))
+
+    def test_slices(self):
+        # The length, then the element format's index once, then each element
+        self.assertEqual(self.message('{=[?]}', u32(2) + u16(POINT) + u8(1) + struct.pack('<h', 2)
+                                      + u8(3) + struct.pack('<h', -4)),
+                         '[Point { x: 1, y: 2 }, Point { x: 3, y: -4 }]')
+        # Enum elements still have a discriminant each
+        self.assertEqual(self.message('{=[?]}', u32(3) + u16(OPTION) + u8(1) + u8(5) + u8(0)
+                                      + u8(1) + u8(6)),
+                         '[Some(5), None, Some(6)]')
+        self.assertEqual(self.message('{=[?]}.', u32(0) + u16(POINT)), '[].')
+
+    def test_unknown_index(self):
+        with self.assertRaises(DefmtError):
+            self.message('{=?}', u16(999))
+
+    def test_trailing_data(self):
+        with self.assertRaises(DefmtError):
+            self.message('{=u8}', u8(1) + u8(2))
+
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.table = Table(TIMESTAMPED)
+
+    def frames(self):
+        """Encoded info frames, each with a timestamp and a Point"""
+        frames = []
+        for i in range(20):
+            frame = u16(INFO) + u32(1_000_000 + i * 250) + u16(POINT) + u8(i) + struct.pack('<h', -i)
+            frames.append(rzcobs_encode(frame) + b'\0')
+        return frames
+
+    def test_timestamp(self):
+        frame, = Decoder(self.table).feed(self.frames()[1])
+        self.assertEqual((frame.index, frame.level, frame.timestamp),
+                         (INFO, 'INFO', '1.000250'))
+        self.assertEqual(format_frame(frame), '1.000250 INFO  Point { x: 1, y: -1 }')
+
+    def test_split_chunks(self):
+        stream = b''.join(self.frames())
+        whole = list(Decoder(self.table).feed(stream))
+        self.assertEqual(len(whole), 20)
+        for size in (1, 2, 3, 7, 64):
+            with self.subTest(size=size):
+                chunks = [stream[pos:pos + size] for pos in range(0, len(stream), size)]
+                self.assertEqual(list(decode(self.table, chunks)), whole)
+
+    def test_resynchronises(self):
+        decoder = Decoder(self.table)
+        frames = self.frames()
+        # Attached mid-frame, then a frame corrupted by dropped data
+        stream = frames[0][5:] + frames[1] + frames[2][:4] + frames[3] + frames[4]
+        decoded = list(decoder.feed(stream))
+        self.assertEqual([frame.message for frame in decoded],
+                         ['Point { x: 1, y: -1 }', 'Point { x: 4, y: -4 }'])
+        self.assertEqual((decoder.frames, decoder.errors), (2, 2))
+
+    def test_raw_encoding(self):
+        table = Table(TIMESTAMPED, encoding=ENCODING_RAW)
+        stream = b''.join(u16(PRINTLN) + u32(i) + u16(OPTION) + u8(1) + u8(i) for i in range(5))
+        decoded = list(decode(table, [stream[:3], stream[3:11], stream[11:]]))
+        self.assertEqual([frame.message for frame in decoded], [f'Some({i})' for i in range(5)])
+        self.assertEqual([frame.level for frame in decoded], [None] * 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
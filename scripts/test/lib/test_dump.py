@@ -0,0 +1,85 @@
+"""airfrog.dump - dumping into a mapped file, and resuming after an interrupt"""
+
+import os
+import random
+import tempfile
+import unittest
+
+from emulated import EmulatorTestCase
+
+from airfrog.dump import dump, load_progress, progress_path
+from airfrog.sim import FLASH_BASE
+from airfrog.transport import BinTransport
+
+NBYTES = 64 * 1024
+CHUNK_BYTES = 4096
+
+
+class Interrupting:
+    """Wraps a transport, recording reads and interrupting the one after `reads`"""
+
+    def __init__(self, transport, reads=None):
+        self.transport = transport
+        self.reads = reads
+        self.addrs = []
+
+    def read_memory_into(self, addr, buf):
+        if self.reads is not None and len(self.addrs) >= self.reads:
+            raise KeyboardInterrupt
+        self.addrs.append(addr)
+        self.transport.read_memory_into(addr, buf)
+
+
+class DumpTest(EmulatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.image = random.Random(0x4146).randbytes(NBYTES)
+        self.target.load_flash(self.image)
+        self.transport = BinTransport('127.0.0.1', port=self.emulator.port)
+        self.addCleanup(self.transport.close)
+        self.transport.reset_target()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'flash.bin')
+
+    def dump(self, transport, **kwargs):
+        return dump(transport, FLASH_BASE, NBYTES, self.path, chunk_bytes=CHUNK_BYTES, **kwargs)
+
+    def read_output(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_dump(self):
+        result = self.dump(self.transport, verify=True)
+        self.assertEqual((result.nbytes, result.resumed_from, result.read), (NBYTES, 0, NBYTES))
+        self.assertEqual(result.retries, 0)
+        self.assertEqual(self.read_output(), self.image)
+        self.assertFalse(os.path.exists(progress_path(self.path)))
+
+    def test_resume_after_interrupt(self):
+        with self.assertRaises(KeyboardInterrupt):
+            self.dump(Interrupting(self.transport, reads=5))
+        done = 5 * CHUNK_BYTES
+        self.assertEqual(load_progress(self.path, FLASH_BASE, NBYTES), done)
+        self.assertEqual(self.read_output()[:done], self.image[:done])
+
+        resumed = Interrupting(self.transport)
+        result = self.dump(resumed)
+        self.assertEqual((result.resumed_from, result.read), (done, NBYTES - done))
+        self.assertEqual(resumed.addrs[0], FLASH_BASE + done)
+        self.assertEqual(self.read_output(), self.image)
+        self.assertFalse(os.path.exists(progress_path(self.path)))
+
+    def test_other_region_starts_again(self):
+        with self.assertRaises(KeyboardInterrupt):
+            self.dump(Interrupting(self.transport, reads=3))
+        self.assertEqual(load_progress(self.path, FLASH_BASE, NBYTES // 2), 0)
+        self.assertEqual(load_progress(self.path, FLASH_BASE + 4, NBYTES), 0)
+
+        result = self.dump(self.transport, resume=False)
+        self.assertEqual((result.resumed_from, result.read), (0, NBYTES))
+        self.assertEqual(self.read_output(), self.image)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""airfrog.dwt - unwrapping DWT counters"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+from airfrog.dwt import COUNTER_WIDTHS, Unwrapper, required_sample_rate
+
+SYSCLK = 100_000_000
+CYCCNT_PERIOD = 1 << 32
+
+
+def sample(cycles=0, **counts):
+    return {name: counts.get(name, 0) for name in COUNTER_WIDTHS} | {'cycles': cycles}
+
+
+class UnwrapperTest(unittest.TestCase):
+    def test_first_sample_sets_start(self):
+        unwrapper = Unwrapper()
+        self.assertIsNone(unwrapper.update(sample(1000, lsu=5)))
+        self.assertEqual(unwrapper.totals, {name: 0 for name in COUNTER_WIDTHS})
+        self.assertEqual(unwrapper.samples, 0)
+
+    def test_modular_delta(self):
+        unwrapper = Unwrapper(widths={'cycles': 32, 'lsu': 8})
+        unwrapper.update(sample(CYCCNT_PERIOD - 10, lsu=250))
+        deltas = unwrapper.update(sample(90, lsu=4))
+        # Both counters wrapped once
+        self.assertEqual(deltas.counts, {'cycles': 100, 'lsu': 10})
+        self.assertEqual(deltas.ambiguous, ())
+        deltas = unwrapper.update(sample(190, lsu=4))
+        self.assertEqual(deltas.counts, {'cycles': 100, 'lsu': 0})
+        self.assertEqual(unwrapper.totals, {'cycles': 200, 'lsu': 10})
+        self.assertEqual(unwrapper.samples, 2)
+
+    def test_cyccnt_wraps_from_elapsed_time(self):
+        unwrapper = Unwrapper(sysclk=SYSCLK)
+        unwrapper.update(sample(1000), time=10.0)
+        # Two whole wraps, plus 500 cycles, take about 85.9s at 100MHz
+        cycles = 2 * CYCCNT_PERIOD + 500
+        deltas = unwrapper.update(sample(1500), time=10.0 + cycles / SYSCLK + 0.01)
+        self.assertEqual(deltas.counts['cycles'], cycles)
+        self.assertAlmostEqual(unwrapper.elapsed, cycles / SYSCLK + 0.01)
+
+    def test_cyccnt_timing_noise(self):
+        unwrapper = Unwrapper(sysclk=SYSCLK)
+        unwrapper.update(sample(CYCCNT_PERIOD - 100), time=0.0)
+        # Sample times a little early never subtract wraps
+        deltas = unwrapper.update(sample(100), time=0.0)
+        self.assertEqual(deltas.counts['cycles'], 200)
+
+    def test_cyccnt_without_sysclk(self):
+        unwrapper = Unwrapper()
+        unwrapper.update(sample(1000), time=0.0)
+        deltas = unwrapper.update(sample(1500), time=100.0)
+        self.assertEqual(deltas.counts['cycles'], 500)
+
+    def test_ambiguous_from_cycles(self):
+        unwrapper = Unwrapper()
+        unwrapper.update(sample(0))
+        self.assertEqual(unwrapper.update(sample(255)).ambiguous, ())
+        deltas = unwrapper.update(sample(255 + 256))
+        self.assertEqual(set(deltas.ambiguous), set(COUNTER_WIDTHS) - {'cycles'})
+        self.assertEqual(unwrapper.ambiguous_samples, 1)
+
+    def test_ambiguous_from_elapsed_time(self):
+        widths = {'lsu': 8, 'sleep': 8}
+        unwrapper = Unwrapper(sysclk=SYSCLK, widths=widths)
+        unwrapper.update(sample(), time=0.0)
+        self.assertEqual(unwrapper.update(sample(), time=200 / SYSCLK).ambiguous, ())
+        self.assertEqual(set(unwrapper.update(sample(), time=1.0).ambiguous), set(widths))
+
+    def test_ambiguous_without_cycles_or_time(self):
+        unwrapper = Unwrapper(widths={'lsu': 8, 'total': 64})
+        unwrapper.update({'lsu': 0, 'total': 0})
+        # Only a 64-bit counter can't have wrapped unseen
+        self.assertEqual(unwrapper.update({'lsu': 1, 'total': 1}).ambiguous, ('lsu',))
+
+    def test_required_sample_rate(self):
+        self.assertEqual(required_sample_rate(SYSCLK), SYSCLK / 256)
+        self.assertEqual(required_sample_rate(SYSCLK, width=32), SYSCLK / CYCCNT_PERIOD)
+
+
+if __name__ == '__main__':
+    unittest.main()
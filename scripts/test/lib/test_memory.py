@@ -0,0 +1,87 @@
+"""airfrog.memory - chunking at TAR_WRAP, and unaligned reads and writes"""
+
+import random
+import unittest
+
+from emulated import EmulatorTestCase
+
+from airfrog.bin import TAR_WRAP, MAX_WORD_COUNT
+from airfrog.memory import Memory
+from airfrog.sim import FLASH_BASE, SRAM_BASE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class MemoryTest(EmulatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.memory = Memory(self.client)
+        self.image = random.Random(0x4146).randbytes(16 * 1024)
+        self.target.load_flash(self.image)
+
+    def test_chunks_stop_at_tar_wrap(self):
+        for chunk_words in (MAX_WORD_COUNT, 100):
+            memory = Memory(self.client, chunk_words=chunk_words)
+            for addr, nbytes in ((SRAM_BASE, 4096), (SRAM_BASE + 1020, 8), (SRAM_BASE + 512, 2048),
+                                 (SRAM_BASE + 4, 4), (SRAM_BASE + 1024 - 400, 400)):
+                with self.subTest(chunk_words=chunk_words, addr=hex(addr), nbytes=nbytes):
+                    expected_addr, expected_offset = addr, 0
+                    for chunk_addr, offset, words in memory._chunks(addr, nbytes):
+                        self.assertEqual((chunk_addr, offset), (expected_addr, expected_offset))
+                        self.assertTrue(0 < words <= chunk_words)
+                        self.assertLessEqual(chunk_addr % TAR_WRAP + words * 4, TAR_WRAP)
+                        expected_addr += words * 4
+                        expected_offset += words * 4
+                    self.assertEqual(expected_offset, nbytes)
+
+    def test_read_across_wraps(self):
+        data = self.memory.read_memory(FLASH_BASE + 1000, 5000)
+        self.assertEqual(data, self.image[1000:6000])
+
+    def test_unaligned_reads(self):
+        for offset, nbytes in ((1, 1), (3, 2), (2, 7), (0, 5), (1023, 3), (1021, 1030)):
+            with self.subTest(offset=offset, nbytes=nbytes):
+                data = self.memory.read_memory(FLASH_BASE + offset, nbytes)
+                self.assertIsInstance(data, bytearray)
+                self.assertEqual(data, self.image[offset:offset + nbytes])
+
+    def test_empty_read(self):
+        before = self.commands()
+        for addr in (FLASH_BASE, FLASH_BASE + 3):
+            self.assertEqual(self.memory.read_memory(addr, 0), bytearray())
+        self.assertEqual(self.commands(), before)
+
+    @unittest.skipIf(numpy is None, "NumPy not installed")
+    def test_dtype_read(self):
+        words = self.memory.read_memory(FLASH_BASE + 4, 16, dtype='<u4')
+        self.assertEqual(words.tolist(), numpy.frombuffer(self.image[4:20], '<u4').tolist())
+        self.assertEqual(len(self.memory.read_memory(FLASH_BASE + 1, 0, dtype=numpy.uint8)), 0)
+
+    def test_unaligned_writes_keep_neighbours(self):
+        original = bytes(range(256)) * 8
+        for offset, nbytes in ((1, 1), (3, 2), (2, 7), (0, 5), (1021, 9), (5, 1500)):
+            with self.subTest(offset=offset, nbytes=nbytes):
+                self.memory.write_memory(SRAM_BASE, original)
+                data = bytes((i * 7 + 1) & 0xFF for i in range(nbytes))
+                self.memory.write_memory(SRAM_BASE + offset, data)
+                expected = original[:offset] + data + original[offset + nbytes:]
+                self.assertEqual(bytes(self.target.sram[:len(original)]), expected)
+                self.assertEqual(self.memory.read_memory(SRAM_BASE, len(original)), expected)
+
+    def test_empty_write(self):
+        before = self.commands()
+        self.memory.write_memory(SRAM_BASE + 1, b'')
+        self.assertEqual(self.commands(), before)
+
+    def test_spans(self):
+        regions = [(FLASH_BASE + 3, 5), (FLASH_BASE + 1022, 4), (FLASH_BASE + 8, 0)]
+        self.assertEqual(self.memory.read_memory_spans(regions),
+                         [self.image[addr - FLASH_BASE:addr - FLASH_BASE + nbytes]
+                          for addr, nbytes in regions])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""airfrog.plan - merging register reads into bulk reads"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+from airfrog.bin import MAX_WORD_COUNT, TAR_WRAP
+from airfrog.plan import ReadPlan
+
+BASE = 0x40000000
+
+
+def plan_of(*addrs, **kwargs):
+    plan = ReadPlan(**kwargs)
+    plan.add_all(addrs)
+    return plan
+
+
+class MergeTest(unittest.TestCase):
+    def test_merges_within_gap(self):
+        plan = plan_of(BASE, BASE + 8, BASE + 0x100, gap_words=1)
+        self.assertEqual(plan.spans(), [(BASE, 3), (BASE + 0x100, 1)])
+
+    def test_gap_limit(self):
+        # 2 unwanted words between them
+        self.assertEqual(plan_of(BASE, BASE + 12, gap_words=2).spans(), [(BASE, 4)])
+        self.assertEqual(plan_of(BASE, BASE + 12, gap_words=1).spans(), [(BASE, 1), (BASE + 12, 1)])
+        self.assertEqual(plan_of(BASE, BASE + 4, gap_words=0).spans(), [(BASE, 2)])
+
+    def test_add_counts(self):
+        plan = ReadPlan(gap_words=0)
+        plan.add(BASE, 4)
+        plan.add(BASE + 8, 4)
+        self.assertEqual(len(plan), 6)
+        self.assertEqual(plan.spans(), [(BASE, 6)])
+
+    def test_unaligned(self):
+        with self.assertRaises(ValueError):
+            ReadPlan().add(BASE + 2)
+
+    def test_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            ReadPlan(gap_words=-1)
+        with self.assertRaises(ValueError):
+            ReadPlan(max_words=MAX_WORD_COUNT + 1)
+
+    def test_max_words(self):
+        plan = ReadPlan(max_words=4)
+        plan.add(BASE, 10)
+        self.assertEqual(plan.spans(), [(BASE, 4), (BASE + 16, 4), (BASE + 32, 2)])
+
+    def test_max_words_counts_gap(self):
+        self.assertEqual(plan_of(BASE, BASE + 16, max_words=4).spans(),
+                         [(BASE, 1), (BASE + 16, 1)])
+        self.assertEqual(plan_of(BASE, BASE + 12, max_words=4).spans(), [(BASE, 4)])
+
+    def test_tar_wrap(self):
+        # Adjacent, but either side of a 1KB boundary
+        plan = ReadPlan()
+        plan.add(BASE + TAR_WRAP - 8, 4)
+        self.assertEqual(plan.spans(), [(BASE + TAR_WRAP - 8, 2), (BASE + TAR_WRAP, 2)])
+
+    def test_read_scatters_wanted_words(self):
+        plan = plan_of(BASE, BASE + 8)
+        reads = []
+
+        def read_bulk(addr, count):
+            reads.append((addr, count))
+            return [addr + i * 4 for i in range(count)]
+
+        self.assertEqual(plan.read(read_bulk), {BASE: BASE, BASE + 8: BASE + 8})
+        self.assertEqual(reads, [(BASE, 3)])
+
+
+class ExcludeTest(unittest.TestCase):
+    EXCLUDE = ((BASE + 8, BASE + 12),)
+
+    def test_gap_not_filled(self):
+        plan = plan_of(BASE, BASE + 4, BASE + 12, BASE + 16, exclude=self.EXCLUDE)
+        self.assertEqual(plan.spans(), [(BASE, 2), (BASE + 12, 2)])
+
+    def test_read_alone(self):
+        plan = plan_of(BASE, BASE + 4, BASE + 8, BASE + 12, exclude=self.EXCLUDE)
+        self.assertEqual(plan.spans(), [(BASE, 2), (BASE + 8, 1), (BASE + 12, 1)])
+
+    def test_ranges(self):
+        # Unsorted, and covering several words
+        exclude = ((BASE + 0x100, BASE + 0x110), (BASE + 8, BASE + 12))
+        plan = plan_of(BASE, BASE + 0xFC, BASE + 0x110, gap_words=100, exclude=exclude)
+        self.assertEqual(plan.spans(), [(BASE, 1), (BASE + 0xFC, 1), (BASE + 0x110, 1)])
+
+    def test_unaffected_outside_ranges(self):
+        plan = plan_of(BASE + 0x20, BASE + 0x28, exclude=self.EXCLUDE)
+        self.assertEqual(plan.spans(), [(BASE + 0x20, 3)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+"""airfrog.rtt - finding and reading the simulated firmware's RTT control block"""
+
+import os
+import re
+import struct
+import tempfile
+import time
+import unittest
+
+from emulated import EmulatorTestCase
+
+from airfrog.memory import Memory
+from airfrog.rtt import (
+    Rtt, RTT_ID, flash_fingerprint, locate, lookup_cached, scan, target_memory_map,
+)
+from airfrog.sim import SimTarget, RTT_CB_ADDR, RTT_UP_BUFFERS, SRAM_BASE, SRAM_SIZE
+
+# Neither mapped memory nor a register on the simulated target
+UNMAPPED = 0x60000000
+
+LOG_LINE = re.compile(rb'\[ *(\d+)\] tick +\d+ cycles\n')
+
+
+class RttTest(EmulatorTestCase):
+    def make_target(self):
+        target = SimTarget()
+        target.add_rtt()
+        return target
+
+    def setUp(self):
+        super().setUp()
+        self.memory = Memory(self.client)
+
+    def add_stray_ids(self):
+        """Put IDs without a usable control block ahead of the real one"""
+        # Plausible, but the name and buffer pointers fault
+        self.target.sram[0x100:0x100 + 48] = RTT_ID + struct.pack(
+            '<ii6I', 1, 0, UNMAPPED, UNMAPPED + 0x100, 16, 0, 0, 0)
+        # Implausible buffer counts
+        self.target.sram[0x200:0x200 + 24] = RTT_ID + struct.pack('<ii', 1000, 0)
+
+    def test_scan(self):
+        self.add_stray_ids()
+        self.assertEqual(list(scan(self.memory, SRAM_BASE, SRAM_SIZE)),
+                         [SRAM_BASE + 0x100, SRAM_BASE + 0x200, RTT_CB_ADDR])
+
+    def test_scan_finds_ids_across_chunks(self):
+        # The ID straddles the end of the first chunk
+        chunk_bytes = RTT_CB_ADDR - SRAM_BASE + 8
+        self.assertEqual(list(scan(self.memory, SRAM_BASE, SRAM_SIZE, chunk_bytes)), [RTT_CB_ADDR])
+
+    def test_locate_skips_stray_ids(self):
+        self.add_stray_ids()
+        self.assertEqual(locate(self.memory, cache=None), RTT_CB_ADDR)
+        # The faults were cleared, so the connection is still usable
+        self.assertEqual(len(Rtt(self.memory, RTT_CB_ADDR).up), len(RTT_UP_BUFFERS))
+
+    def test_locate_caches_address(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = os.path.join(tmp, 'rtt.json')
+            self.assertEqual(locate(self.memory, cache=cache), RTT_CB_ADDR)
+            flash_base = target_memory_map(self.memory)[1]
+            fingerprint = flash_fingerprint(self.memory, flash_base)
+            self.assertEqual(lookup_cached(fingerprint, cache), RTT_CB_ADDR)
+            self.assertEqual(locate(self.memory, cache=cache), RTT_CB_ADDR)
+
+    def test_control_block(self):
+        rtt = Rtt(self.memory, RTT_CB_ADDR)
+        self.assertEqual([(channel.name, channel.size) for channel in rtt.up],
+                         list(RTT_UP_BUFFERS))
+        self.assertEqual([channel.name for channel in rtt.down], ['Terminal'])
+
+    def test_poll(self):
+        rtt = Rtt(self.memory, RTT_CB_ADDR)
+        self.assertEqual(rtt.poll(), {})
+        self.target.rtt_write(0, b'hello\n')
+        self.target.rtt_write(1, b'\x01\x02')
+        self.assertEqual(rtt.poll(), {0: b'hello\n', 1: b'\x01\x02'})
+        rtt.sync()
+        self.assertEqual(rtt.poll(), {})
+
+    def test_poll_wrapped_buffer(self):
+        rtt = Rtt(self.memory, RTT_CB_ADDR)
+        size = RTT_UP_BUFFERS[0][1]
+        first = bytes(i & 0xFF for i in range(size - 24))
+        self.assertTrue(self.target.rtt_write(0, first))
+        self.assertEqual(rtt.poll(), {0: first})
+        rtt.sync()
+        second = bytes(range(100))
+        self.assertTrue(self.target.rtt_write(0, second))
+        self.assertEqual(rtt.poll(), {0: second})
+
+    def test_write_down_channel(self):
+        rtt = Rtt(self.memory, RTT_CB_ADDR)
+        self.assertEqual(rtt.write(0, b'ping\n', timeout=1), 5)
+        rtt.sync()
+        self.assertEqual(self.target.rtt_read(0), b'ping\n')
+
+
+class RttFirmwareTest(EmulatorTestCase):
+    """The simulated firmware logging, and echoing down channel 0"""
+
+    RATE = 20000
+
+    def make_target(self):
+        target = SimTarget()
+        target.add_rtt(rate=self.RATE, echo=True)
+        return target
+
+    def setUp(self):
+        super().setUp()
+        memory = Memory(self.client)
+        self.rtt = Rtt(memory, locate(memory, cache=None))
+
+    def collect(self, seconds):
+        data = bytearray()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            data += self.rtt.poll().get(0, b'')
+            time.sleep(0.005)
+        self.rtt.sync()
+        return bytes(data)
+
+    def test_log_lines_in_order(self):
+        data = self.collect(0.3)
+        self.assertEqual(self.target.rtt_dropped, 0)
+        lines = LOG_LINE.findall(data)
+        self.assertGreater(len(lines), 10)
+        self.assertEqual([int(line) for line in lines], list(range(len(lines))))
+
+    def test_echo(self):
+        self.rtt.write(0, b'<echo>', timeout=1)
+        self.assertIn(b'<echo>', self.collect(0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""airfrog.schedule - fixed-rate ticks on an injected clock"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+from airfrog.schedule import Scheduler
+
+PERIOD = 0.1
+
+
+class FakeClock:
+    """A clock which only moves when slept on or advanced
+
+    Each sleep overshoots by `overshoot` seconds, as real sleeps do.
+    """
+
+    def __init__(self, start=1000.0, overshoot=0.0):
+        self.now = start
+        self.overshoot = overshoot
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds + self.overshoot
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class SchedulerTest(unittest.TestCase):
+    def scheduler(self, clock, **kwargs):
+        return Scheduler(PERIOD, clock=clock, sleep=clock.sleep, **kwargs)
+
+    def test_ticks_on_grid(self):
+        clock = FakeClock()
+        ticks = list(self.scheduler(clock, count=4))
+        self.assertEqual([tick.index for tick in ticks], [0, 1, 2, 3])
+        for n, tick in enumerate(ticks):
+            self.assertAlmostEqual(tick.due, 1000.0 + n * PERIOD)
+            self.assertFalse(tick.overrun)
+        self.assertIsNone(ticks[0].period)
+
+    def test_no_drift(self):
+        # Sampling work and sleep overshoot are absorbed by the next sleep
+        clock = FakeClock(overshoot=0.002)
+        ticks = []
+        for tick in self.scheduler(clock, count=50):
+            ticks.append(tick)
+            clock.advance(0.03)
+        for n, tick in enumerate(ticks[1:], 1):
+            self.assertAlmostEqual(tick.time, 1000.0 + n * PERIOD + 0.002)
+            self.assertAlmostEqual(tick.late, 0.002)
+        self.assertAlmostEqual(clock.sleeps[1], PERIOD - 0.03 - 0.002)
+        self.assertEqual(ticks[-1].index, 49)
+
+    def test_late_but_not_overrun(self):
+        clock = FakeClock()
+        scheduler = self.scheduler(clock, count=3)
+        late = []
+        for tick in scheduler:
+            late.append(tick.late)
+            clock.advance(0.15)
+        # Each sample starts 0.05 late, less than a period
+        self.assertEqual([round(value, 6) for value in late], [0.0, 0.05, 0.1])
+        self.assertEqual(scheduler.overruns, 0)
+
+    def test_skip_overruns(self):
+        clock = FakeClock()
+        scheduler = self.scheduler(clock, count=4)
+        ticks = []
+        for tick in scheduler:
+            ticks.append(tick)
+            if tick.index == 1:
+                # Misses ticks 2 and 3, and part of 4
+                clock.advance(0.35)
+        self.assertEqual([tick.index for tick in ticks], [0, 1, 4, 5])
+        overrun = ticks[2]
+        self.assertTrue(overrun.overrun)
+        self.assertEqual(overrun.skipped, 2)
+        # Resumes on the grid, at the latest tick due
+        self.assertAlmostEqual(overrun.due, 1000.0 + 4 * PERIOD)
+        self.assertAlmostEqual(overrun.late, 0.05)
+        self.assertAlmostEqual(ticks[3].due, 1000.0 + 5 * PERIOD)
+        self.assertFalse(ticks[3].overrun)
+        self.assertEqual((scheduler.ticks, scheduler.overruns, scheduler.skipped), (4, 1, 2))
+        self.assertEqual(scheduler.overrun_rate, 0.25)
+
+    def test_overruns_yielded_late(self):
+        clock = FakeClock()
+        scheduler = self.scheduler(clock, count=5, skip_overruns=False)
+        ticks = []
+        for tick in scheduler:
+            ticks.append(tick)
+            if tick.index == 1:
+                clock.advance(0.35)
+        # The missed ticks come immediately, then sampling catches up
+        self.assertEqual([tick.index for tick in ticks], [0, 1, 2, 3, 4])
+        self.assertEqual([tick.overrun for tick in ticks], [False, False, True, True, False])
+        self.assertEqual([tick.skipped for tick in ticks], [0] * 5)
+        self.assertAlmostEqual(ticks[2].late, 0.25)
+        self.assertEqual(ticks[3].period, 0.0)
+        self.assertAlmostEqual(ticks[4].time, 1000.0 + 4 * PERIOD + 0.05)
+        self.assertEqual((scheduler.overruns, scheduler.skipped), (2, 0))
+
+    def test_bad_period(self):
+        with self.assertRaises(ValueError):
+            Scheduler(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
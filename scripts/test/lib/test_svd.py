@@ -0,0 +1,215 @@
+"""airfrog.svd - compiling SVD files, and planning peripheral reads"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+
+from airfrog.plan import STM32F4_SIDE_EFFECTS
+from airfrog.svd import SvdIndex, SvdError, format_register, parse_int
+
+FIXTURE = """<?xml version="1.0" encoding="utf-8"?>
+<device>
+  <name>TESTMCU</name>
+  <size>32</size>
+  <access>read-write</access>
+  <peripherals>
+    <peripheral>
+      <name>USART2</name>
+      <baseAddress>0x40004400</baseAddress>
+      <interrupt><name>USART2</name><value>38</value></interrupt>
+      <registers>
+        <register>
+          <name>SR</name>
+          <description>Status
+            register</description>
+          <addressOffset>0x0</addressOffset>
+          <fields>
+            <field><name>RXNE</name><bitOffset>5</bitOffset><bitWidth>1</bitWidth></field>
+            <field><name>TC</name><lsb>6</lsb><msb>6</msb></field>
+          </fields>
+        </register>
+        <register>
+          <name>DR</name>
+          <addressOffset>0x4</addressOffset>
+          <fields>
+            <field><name>DR</name><bitRange>[8:0]</bitRange></field>
+          </fields>
+        </register>
+        <register>
+          <name>BRR</name>
+          <addressOffset>0x8</addressOffset>
+        </register>
+      </registers>
+    </peripheral>
+    <peripheral derivedFrom="USART2">
+      <name>USART3</name>
+      <baseAddress>0x40004800</baseAddress>
+    </peripheral>
+    <peripheral>
+      <name>GPIOA</name>
+      <baseAddress>0x40020000</baseAddress>
+      <registers>
+        <register>
+          <name>MODER</name>
+          <addressOffset>0x0</addressOffset>
+          <fields>
+            <field>
+              <name>MODER%s</name>
+              <dim>2</dim>
+              <dimIncrement>2</dimIncrement>
+              <bitRange>[1:0]</bitRange>
+              <enumeratedValues>
+                <enumeratedValue><name>Input</name><value>0</value></enumeratedValue>
+                <enumeratedValue><name>Output</name><value>0b01</value></enumeratedValue>
+                <enumeratedValue><name>Other</name><isDefault>true</isDefault></enumeratedValue>
+              </enumeratedValues>
+            </field>
+          </fields>
+        </register>
+        <register derivedFrom="MODER">
+          <name>MODER_SHADOW</name>
+          <addressOffset>0x4</addressOffset>
+        </register>
+        <register>
+          <name>AFR%s</name>
+          <dim>2</dim>
+          <dimIncrement>4</dimIncrement>
+          <dimIndex>L,H</dimIndex>
+          <addressOffset>0x20</addressOffset>
+        </register>
+        <register>
+          <name>BSRR</name>
+          <addressOffset>0x18</addressOffset>
+          <access>write-only</access>
+        </register>
+        <register>
+          <name>HALF</name>
+          <addressOffset>0x1C</addressOffset>
+          <size>16</size>
+        </register>
+        <register>
+          <name>FIFO</name>
+          <addressOffset>0x10</addressOffset>
+          <readAction>modify</readAction>
+        </register>
+        <cluster>
+          <name>CH[%s]</name>
+          <dim>2</dim>
+          <dimIncrement>0x10</dimIncrement>
+          <addressOffset>0x40</addressOffset>
+          <register><name>CTRL</name><addressOffset>0x0</addressOffset></register>
+          <register><name>DATA</name><addressOffset>0x4</addressOffset></register>
+        </cluster>
+      </registers>
+    </peripheral>
+  </peripherals>
+</device>
+"""
+
+
+class SvdTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.path = os.path.join(tmp.name, 'test.svd')
+        with open(self.path, 'w') as f:
+            f.write(FIXTURE)
+        self.index = SvdIndex.compile(self.path)
+
+    def names(self, peripheral):
+        return [register.name for register in self.index.peripheral_registers(peripheral)]
+
+    def test_parse_int(self):
+        self.assertEqual([parse_int(text) for text in ('0x10', '16', '#101', '0b11', '4k')],
+                         [16, 16, 5, 3, 4096])
+
+    def test_registers(self):
+        self.assertEqual(self.index.device, 'TESTMCU')
+        self.assertEqual(self.index.peripherals, ['USART2', 'USART3', 'GPIOA'])
+        self.assertEqual(self.index.interrupts, {38: 'USART2'})
+        sr = self.index.register('USART2.SR')
+        self.assertEqual((sr.addr, sr.size, sr.description), (0x40004400, 32, 'Status register'))
+        self.assertIs(self.index.find(0x40004404), self.index.register('USART2.DR'))
+        self.assertIsNone(self.index.find(0x40004402))
+
+    def test_field_positions(self):
+        fields = {field.name: (field.lsb, field.width)
+                  for field in self.index.register('USART2.SR').fields
+                  + self.index.register('USART2.DR').fields}
+        # bitOffset/bitWidth, lsb/msb and bitRange
+        self.assertEqual(fields, {'RXNE': (5, 1), 'TC': (6, 1), 'DR': (0, 9)})
+
+    def test_derived_peripheral(self):
+        self.assertEqual(self.names('USART3'), ['SR', 'DR', 'BRR'])
+        self.assertEqual(self.index.register('USART3.DR').addr, 0x40004804)
+
+    def test_derived_register(self):
+        moder = self.index.register('GPIOA.MODER')
+        shadow = self.index.register('GPIOA.MODER_SHADOW')
+        self.assertEqual(shadow.addr, 0x40020004)
+        self.assertEqual(shadow.fields, moder.fields)
+
+    def test_dim(self):
+        self.assertEqual([(f.name, f.lsb, f.width) for f in self.index.register('GPIOA.MODER').fields],
+                         [('MODER0', 0, 2), ('MODER1', 2, 2)])
+        self.assertEqual([self.index.register(f'GPIOA.AFR{i}').addr for i in 'LH'],
+                         [0x40020020, 0x40020024])
+
+    def test_clusters(self):
+        self.assertEqual({name: self.index.register(f'GPIOA.{name}').addr
+                          for name in ('CH0.CTRL', 'CH0.DATA', 'CH1.CTRL', 'CH1.DATA')},
+                         {'CH0.CTRL': 0x40020040, 'CH0.DATA': 0x40020044,
+                          'CH1.CTRL': 0x40020050, 'CH1.DATA': 0x40020054})
+
+    def test_enums(self):
+        moder0, moder1 = self.index.register('GPIOA.MODER').fields
+        # isDefault names every value without its own
+        self.assertEqual(moder0.enums, {0: 'Input', 1: 'Output', 2: 'Other', 3: 'Other'})
+        # Identical tables are shared
+        self.assertIs(moder0.enums, moder1.enums)
+
+    def test_decode(self):
+        decoded, = self.index.decode({0x40020000: 0b0111, 0x40020100: 0})
+        self.assertEqual([(field.name, value, enum) for field, value, enum in decoded.fields],
+                         [('MODER0', 3, 'Other'), ('MODER1', 1, 'Output')])
+        self.assertEqual(format_register(decoded).splitlines()[0],
+                         'GPIOA.MODER (0x40020000) = 0x00000007')
+
+    def test_plan_skips_unreadable(self):
+        plan = self.index.plan(['GPIOA'])
+        addrs = {addr for addr, count in plan.spans() for addr in range(addr, addr + count * 4, 4)}
+        # FIFO has a readAction, BSRR is write-only and HALF is 16-bit
+        self.assertNotIn(0x40020010, addrs)
+        self.assertEqual(len(plan), 8)
+        self.assertEqual(self.index.side_effects(), ((0x40020010, 0x40020014),))
+
+    def test_plan_excludes(self):
+        # The SVD doesn't mark DR, so it's only left out when excluded
+        self.assertEqual(len(self.index.plan(['USART2'])), 3)
+        plan = self.index.plan(['USART2', 'USART3'],
+                               exclude=STM32F4_SIDE_EFFECTS + self.index.side_effects())
+        self.assertEqual(len(plan), 4)
+        self.assertFalse(plan.excludes(0x40004400))
+        for span_addr, count in plan.spans():
+            self.assertFalse(plan.excludes(span_addr, count))
+
+    def test_load_caches(self):
+        cache_dir = os.path.join(self.tmp, 'cache')
+        index = SvdIndex.load(self.path, cache_dir=cache_dir)
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        cached = SvdIndex.load(self.path, cache_dir=cache_dir)
+        self.assertEqual(cached.registers, index.registers)
+
+    def test_bad_file(self):
+        with open(self.path, 'w') as f:
+            f.write('<device><name>X</name>')
+        with self.assertRaises(SvdError):
+            SvdIndex.compile(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
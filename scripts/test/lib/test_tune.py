@@ -0,0 +1,78 @@
+"""airfrog.tune - sweeping speeds and chunk sizes against the emulator"""
+
+import os
+import random
+import socket
+import tempfile
+import unittest
+
+from emulated import EmulatorTestCase
+
+from airfrog.bin import Client, SPEED_FAST, SPEED_MEDIUM, SPEED_SLOW, SPEED_TURBO
+from airfrog.tune import DEFAULT_REGION, TuneError, autotune, lookup_cached
+
+
+class DroppingClient(Client):
+    """Loses the connection whenever it bulk reads at `drop_speed`"""
+
+    drop_speed = None
+    speed = None
+
+    def set_speed(self, speed):
+        self.speed = speed
+        return super().set_speed(speed)
+
+    def ap_bulk_read(self, reg, count, into=None):
+        if self.drop_speed is not None and self.speed == self.drop_speed:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        return super().ap_bulk_read(reg, count, into)
+
+
+class AutotuneTest(EmulatorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.target.load_flash(random.Random(0x4146).randbytes(DEFAULT_REGION[1]))
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache = os.path.join(tmp.name, 'tune.json')
+        self.client = DroppingClient('127.0.0.1', port=self.emulator.port)
+        self.client.connect()
+        self.addCleanup(self.client.close)
+        self.client.reset_target()
+        self.client.sync()
+        self.trials = []
+
+    def autotune(self, **kwargs):
+        return autotune(self.client, chunk_words=(64, 256), repeats=2, cache=self.cache,
+                        progress=self.trials.append, **kwargs)
+
+    def test_autotune(self):
+        result = self.autotune()
+        self.assertEqual(len(self.trials), 8)
+        self.assertTrue(all(not t.errors and not t.mismatches and not t.reconnects
+                            for t in self.trials))
+        self.assertEqual(lookup_cached(result.target, self.cache), result)
+
+    def test_lost_connection_marks_trial_unreliable(self):
+        self.client.drop_speed = SPEED_TURBO
+        result = self.autotune()
+        lost = [t for t in self.trials if t.reconnects]
+        self.assertEqual([(t.speed, t.chunk_words) for t in lost],
+                         [(SPEED_TURBO, 64), (SPEED_TURBO, 256)])
+        self.assertNotEqual(result.speed, SPEED_TURBO)
+        # The other speeds were each set and measured after reconnecting
+        self.assertEqual({t.speed for t in self.trials if not t.reconnects},
+                         {SPEED_FAST, SPEED_MEDIUM, SPEED_SLOW})
+        self.assertEqual(self.client.speed, result.speed)
+
+    def test_no_reliable_speed(self):
+        self.client.drop_speed = SPEED_FAST
+        with self.assertRaises(TuneError):
+            self.autotune(speeds=[SPEED_FAST])
+        # Left connected at the safe speed
+        self.assertEqual(self.client.speed, SPEED_SLOW)
+        self.client.ping().result()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+
+# airfrog transport benchmark
+#
+# Measures the latency and throughput of REST and binary API operations at
+# each SWD speed, against a real airfrog or an in-process emulator, and
+# stores the results as JSON.  Two result files can be compared to flag
+# regressions:
+#
+#   airfrog-bench.py 192.168.0.103 -o before.json
+#   airfrog-bench.py 192.168.0.103 -o after.json
+#   airfrog-bench.py --compare before.json after.json
+#
+# Benchmarks read and write target SRAM at 0x20000000, which is overwritten.
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from airfrog.bin import (
+    Client as BinClient, PORT as BIN_PORT, SPEED_NAMES, REG_TYPE_AP, AP_TAR, AP_DRW,
+    MAX_WORD_COUNT, SPEED_TURBO,
+)
+from airfrog.memory import Memory
+from airfrog.rest import Client as RestClient, PORT as REST_PORT
+
+# Results file format version
+RESULTS_VERSION = 1
+
+# Target RAM used by the benchmarks
+SRAM_ADDR = 0x20000000
+
+DEFAULT_ITERATIONS = 50
+WARMUP_ITERATIONS = 3
+
+# Iterations are reduced for large transfers, to at least this many
+MIN_ITERATIONS = 5
+
+# Percentage change in p50 latency or throughput treated as a regression
+DEFAULT_THRESHOLD = 10.0
+
+PERCENTILES = (50, 90, 99)
+
+
+#
+# Benchmarks.  Each takes the clients and returns (words, op), where op
+# performs one operation transferring `words` words.
+#
+
+def rest_read(rest, binary):
+    return 1, lambda: rest.read_memory(SRAM_ADDR)
+
+
+def rest_write(rest, binary):
+    return 1, lambda: rest.write_memory(SRAM_ADDR, 0x12345678)
+
+
+def rest_bulk_read(words):
+    # airfrog's REST API limits bulk reads to 256 words, so larger reads are
+    # a sequence of requests
+    def bench(rest, binary):
+        def op():
+            for offset in range(0, words, MAX_WORD_COUNT):
+                rest.read_memory_bulk(SRAM_ADDR + offset * 4, min(MAX_WORD_COUNT, words - offset))
+        return words, op
+    return bench
+
+
+def rest_bulk_write(words):
+    def bench(rest, binary):
+        data = list(range(words))
+
+        def op():
+            for offset in range(0, words, MAX_WORD_COUNT):
+                rest.write_memory_bulk(SRAM_ADDR + offset * 4,
+                                       data[offset:offset + MAX_WORD_COUNT])
+        return words, op
+    return bench
+
+
+def bin_read(rest, binary):
+    memory = Memory(binary)
+    return 1, lambda: memory.read_word(SRAM_ADDR)
+
+
+def bin_write(rest, binary):
+    memory = Memory(binary)
+    return 1, lambda: memory.write_word(SRAM_ADDR, 0x12345678)
+
+
+def bin_bulk_read(words):
+    def bench(rest, binary):
+        memory = Memory(binary)
+        return words, lambda: memory.read_words(SRAM_ADDR, words)
+    return bench
+
+
+def bin_bulk_write(words):
+    def bench(rest, binary):
+        memory = Memory(binary)
+        data = bytes(words * 4)
+        return words, lambda: memory.write_words(SRAM_ADDR, data)
+    return bench
+
+
+def bin_multi_reg(words):
+    # Scattered word writes - a TAR and DRW write for each word, sent as one
+    # Multi-reg Write
+    def bench(rest, binary):
+        writes = []
+        for i in range(words):
+            writes += [(REG_TYPE_AP, AP_TAR, SRAM_ADDR + i * 64), (REG_TYPE_AP, AP_DRW, i)]
+
+        def op():
+            binary.multi_reg_write(writes)
+            binary.sync()
+        return words, op
+    return bench
+
+
+# name: (API, benchmark)
+BENCHMARKS = {
+    'rest_read': ('rest', rest_read),
+    'rest_write': ('rest', rest_write),
+    'rest_bulk_read_64': ('rest', rest_bulk_read(64)),
+    'rest_bulk_read_256': ('rest', rest_bulk_read(256)),
+    'rest_bulk_read_1024': ('rest', rest_bulk_read(1024)),
+    'rest_bulk_read_4096': ('rest', rest_bulk_read(4096)),
+    'rest_bulk_write_256': ('rest', rest_bulk_write(256)),
+    'bin_read': ('bin', bin_read),
+    'bin_write': ('bin', bin_write),
+    'bin_bulk_read_64': ('bin', bin_bulk_read(64)),
+    'bin_bulk_read_256': ('bin', bin_bulk_read(256)),
+    'bin_bulk_read_4096': ('bin', bin_bulk_read(4096)),
+    'bin_bulk_write_256': ('bin', bin_bulk_write(256)),
+    'bin_multi_reg_8': ('bin', bin_multi_reg(8)),
+    'bin_multi_reg_64': ('bin', bin_multi_reg(64)),
+}
+
+
+def run_benchmark(bench, rest, binary, iterations):
+    """Run a benchmark, returning its statistics"""
+    words, op = bench(rest, binary)
+    if words > MAX_WORD_COUNT:
+        iterations = max(MIN_ITERATIONS, iterations * MAX_WORD_COUNT // words)
+    for _ in range(WARMUP_ITERATIONS):
+        op()
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        op_start = time.perf_counter()
+        op()
+        latencies.append(time.perf_counter() - op_start)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'iterations': iterations,
+        'words': words,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'min_ms': min(latencies) * 1000,
+        'max_ms': max(latencies) * 1000,
+        **{f'p{p}_ms': percentile(latencies, p) * 1000 for p in PERCENTILES},
+        'ops_per_s': iterations / elapsed,
+        'bytes_per_s': iterations * words * 4 / elapsed,
+    }
+
+
+def percentile(values, p):
+    """Return the p'th percentile of values, interpolating between samples"""
+    values = sorted(values)
+    pos = (len(values) - 1) * p / 100
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+def set_speed(rest, binary, speed):
+    """Set the SWD speed used by both APIs"""
+    if rest is not None:
+        rest.post("/config/swd/runtime/speed", {"speed": SPEED_NAMES[speed]})
+    if binary is not None:
+        binary.set_speed(speed)
+        binary.sync()
+
+
+#
+# Metadata
+#
+
+def metadata(args, rest):
+    """Return information about the host, tooling and airfrog for the results"""
+    meta = {
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'host': {
+            'hostname': socket.gethostname(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+        },
+        'tooling': git_revision(),
+        'airfrog': 'emulator' if args.emulate else args.airfrog_host,
+        'firmware': args.firmware,
+        'iterations': args.iterations,
+    }
+    if rest is not None:
+        try:
+            details = rest.get("/target/details")
+            meta['target'] = {**details.get('status', {}), **details.get('data', {})}
+        except Exception as e:
+            meta['target'] = {'error': str(e)}
+    return meta
+
+
+def git_revision():
+    """Return the git revision of these scripts, if available"""
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#
+# Comparison
+#
+
+def compare(before_path, after_path, threshold):
+    """Print a comparison of two results files, returning the number of regressions"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    print(f"Before: {before_path} ({before['meta']['date']}, {before['meta']['airfrog']}, "
+          f"tooling {before['meta']['tooling']})")
+    print(f"After:  {after_path} ({after['meta']['date']}, {after['meta']['airfrog']}, "
+          f"tooling {after['meta']['tooling']})")
+    print(f"{'Benchmark':<22} {'Speed':<7} {'p50 before':>11} {'p50 after':>10} {'Change':>8} "
+          f"{'B/s before':>11} {'B/s after':>11} {'Change':>8}")
+
+    regressions = 0
+    for name, speeds in after['results'].items():
+        for speed, new in speeds.items():
+            old = before['results'].get(name, {}).get(speed)
+            if old is None:
+                continue
+            latency_change = change(old['p50_ms'], new['p50_ms'])
+            throughput_change = change(old['bytes_per_s'], new['bytes_per_s'])
+            flag = ''
+            if latency_change > threshold or throughput_change < -threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            elif latency_change < -threshold or throughput_change > threshold:
+                flag = '  improved'
+            print(f"{name:<22} {speed:<7} {old['p50_ms']:9.2f}ms {new['p50_ms']:8.2f}ms "
+                  f"{latency_change:+7.1f}% {old['bytes_per_s']:11.0f} {new['bytes_per_s']:11.0f} "
+                  f"{throughput_change:+7.1f}%{flag}")
+
+    print(f"\n{regressions} regression(s) beyond {threshold:.0f}%")
+    return regressions
+
+
+def change(old, new):
+    """Return the percentage change from old to new"""
+    return (new - old) / old * 100 if old else 0.0
+
+
+#
+# Main
+#
+
+def start_emulator():
+    """Start in-process binary and REST emulators, returning (rest host, binary port, emulators)"""
+    from airfrog.emulator import Emulator, RestEmulator, LinkModel
+    from airfrog.sim import SimTarget
+
+    target = SimTarget()
+    link = LinkModel()
+    binary = Emulator(target, port=0, link=link)
+    rest = RestEmulator(target, port=0, link=link)
+    binary.start()
+    rest.start()
+    return f"127.0.0.1:{rest.port}", binary.port, (binary, rest)
+
+
+def main():
+    speeds = {name.lower(): speed for speed, name in SPEED_NAMES.items()}
+
+    parser = argparse.ArgumentParser(description='Benchmark airfrog REST and binary API operations')
+    parser.add_argument('airfrog_host', nargs='?', help='IP address or hostname of airfrog')
+    parser.add_argument('--emulate', action='store_true',
+                        help='benchmark an in-process emulator instead of a real airfrog')
+    parser.add_argument('--rest-port', type=int, default=REST_PORT, help='REST API port')
+    parser.add_argument('--bin-port', type=int, default=BIN_PORT, help='binary API port')
+    parser.add_argument('--api', choices=('rest', 'bin', 'both'), default='both',
+                        help='which API to benchmark')
+    parser.add_argument('--speeds', default=','.join(speeds),
+                        help='comma separated SWD speeds to benchmark (default all)')
+    parser.add_argument('--bench', action='append', choices=BENCHMARKS, metavar='NAME',
+                        help='benchmark to run - may be repeated (default all)')
+    parser.add_argument('--iterations', type=int, default=DEFAULT_ITERATIONS,
+                        help='iterations of each single word benchmark - fewer are run for '
+                             'large transfers')
+    parser.add_argument('--firmware', help='airfrog firmware version, recorded in the results')
+    parser.add_argument('-o', '--output', help='write results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+                        help='compare two results files instead of benchmarking')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='percentage change flagged as a regression in --compare')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    if args.airfrog_host is None and not args.emulate:
+        parser.error("airfrog_host is required unless --emulate or --compare is given")
+
+    try:
+        speed_list = [speeds[name.strip().lower()] for name in args.speeds.split(',')]
+    except KeyError as e:
+        parser.error(f"Unknown speed {e} - choose from {', '.join(speeds)}")
+
+    emulators = ()
+    if args.emulate:
+        rest_host, bin_port, emulators = start_emulator()
+        bin_host = '127.0.0.1'
+    else:
+        rest_host, bin_host, bin_port = f"{args.airfrog_host}:{args.rest_port}", args.airfrog_host, args.bin_port
+
+    rest = RestClient(rest_host, pool_size=1) if args.api in ('rest', 'both') else None
+    binary = None
+    if args.api in ('bin', 'both'):
+        binary = BinClient(bin_host, port=bin_port)
+        binary.connect()
+
+    names = args.bench or list(BENCHMARKS)
+    names = [name for name in names
+             if (BENCHMARKS[name][0] == 'rest' and rest) or (BENCHMARKS[name][0] == 'bin' and binary)]
+
+    # Restore the original speed afterwards - the binary API can't read it
+    original_speed = SPEED_TURBO
+    try:
+        if rest is not None:
+            rest.reset_target()
+            original_speed = speeds[rest.get("/config/swd/runtime/speed")["speed"].lower()]
+        meta = metadata(args, rest)
+        results = {name: {} for name in names}
+        for speed in speed_list:
+            set_speed(rest, binary, speed)
+            speed_name = SPEED_NAMES[speed]
+            print(f"SWD speed {speed_name}")
+            print(f"  {'Benchmark':<22} {'p50':>8} {'p90':>8} {'p99':>8} {'ops/s':>8} {'KB/s':>8}")
+            for name in names:
+                stats = run_benchmark(BENCHMARKS[name][1], rest, binary, args.iterations)
+                results[name][speed_name] = stats
+                print(f"  {name:<22} {stats['p50_ms']:6.2f}ms {stats['p90_ms']:6.2f}ms "
+                      f"{stats['p99_ms']:6.2f}ms {stats['ops_per_s']:8.1f} "
+                      f"{stats['bytes_per_s'] / 1024:8.1f}")
+
+        output = {'version': RESULTS_VERSION, 'meta': meta, 'results': results}
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(output, f, indent=2)
+            print(f"Results written to {args.output}")
+    finally:
+        set_speed(rest, binary, original_speed)
+        if rest is not None:
+            rest.close()
+        if binary is not None:
+            binary.disconnect()
+        for emulator in emulators:
+            emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
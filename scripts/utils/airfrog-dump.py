@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+# airfrog memory dump
+#
+# Dumps a region of target memory to a file over the binary or REST API,
+# reading straight into a memory-mapped copy of the output file:
+#
+#   airfrog-dump.py bin://192.168.0.103 0x08000000 1M flash.bin
+#   airfrog-dump.py 192.168.0.103 0x20000000 128K ram.bin --binary
+#
+# An interrupted dump resumes where it stopped when run again with the same
+# address and size - --restart starts again instead.  --verify reads each
+# chunk twice, re-reading until the reads agree.
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from airfrog.dump import dump, load_progress, DumpError, DEFAULT_CHUNK_BYTES, DEFAULT_RETRIES
+from airfrog.transport import open_transport
+
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024 * 1024}
+
+
+def parse_size(value):
+    """Parse a size in bytes, with an optional K or M suffix"""
+    multiplier = SIZE_SUFFIXES.get(value[-1:].upper(), 1)
+    if multiplier != 1:
+        value = value[:-1]
+    try:
+        return int(value, 0) * multiplier
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size '{value}'")
+
+
+def format_rate(nbytes, elapsed):
+    return f"{nbytes / elapsed / 1024:.1f} KB/s" if elapsed else "- KB/s"
+
+
+def report(done, nbytes, elapsed, resumed_from):
+    print(f"\r{done // 1024:8}/{nbytes // 1024}KB  {100 * done / nbytes:5.1f}%  "
+          f"{format_rate(done - resumed_from, elapsed)}", end='', file=sys.stderr, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dump target memory to a file, resumably')
+    parser.add_argument('airfrog_host',
+                        help='IP address or hostname of airfrog, or a URL - http://host for the '
+                             'REST API, bin://host for the binary API')
+    parser.add_argument('address', type=lambda value: int(value, 0), help='start address')
+    parser.add_argument('size', type=parse_size, help='bytes to dump, e.g. 0x1000, 512K or 1M')
+    parser.add_argument('output', help='output file')
+    parser.add_argument('--binary', action='store_true',
+                        help='use the binary API (port 4146) rather than the REST API')
+    parser.add_argument('--tuned', action='store_true',
+                        help="with the binary API, use the target's SWD speed and chunk size "
+                             "cached by airfrog-tune.py")
+    parser.add_argument('--chunk', type=parse_size, default=DEFAULT_CHUNK_BYTES,
+                        help=f'bytes per chunk (default {DEFAULT_CHUNK_BYTES // 1024}K)')
+    parser.add_argument('--verify', action='store_true',
+                        help='read each chunk twice, re-reading until the reads agree')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES,
+                        help='re-reads allowed per chunk when verifying')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore any interrupted dump and start again')
+    args = parser.parse_args()
+
+    if args.address % 4 or args.size % 4 or args.chunk % 4:
+        parser.error("address, size and chunk must be word aligned")
+
+    resumed_from = 0 if args.restart else load_progress(args.output, args.address, args.size)
+    if resumed_from:
+        print(f"Resuming {args.output} at {resumed_from // 1024}KB", file=sys.stderr)
+
+    with open_transport(args.airfrog_host, binary=args.binary, tuned=args.tuned) as transport:
+        transport.reset_target()
+        try:
+            result = dump(transport, args.address, args.size, args.output,
+                          chunk_bytes=args.chunk, verify=args.verify, retries=args.retries,
+                          resume=not args.restart,
+                          progress=lambda done, nbytes, elapsed:
+                              report(done, nbytes, elapsed, resumed_from))
+        except KeyboardInterrupt:
+            # The interrupt may have landed mid-response, so close without
+            # waiting for outstanding reads
+            transport.client.close()
+            print("\nInterrupted - run again to resume", file=sys.stderr)
+            sys.exit(130)
+        except DumpError as e:
+            print(f"\nError: {e} - run again to resume", file=sys.stderr)
+            sys.exit(1)
+        print(file=sys.stderr)
+
+    print(f"Dumped 0x{args.address:08X}-0x{args.address + args.size - 1:08X} to {result.path} "
+          f"via {transport.name}: {result.read} bytes read in {result.elapsed:.2f}s "
+          f"({format_rate(result.read, result.elapsed)})"
+          + (f", {result.retries} verify re-reads" if result.retries else ''))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# airfrog API emulator
+#
+# Serves airfrog's binary API on port 4146, and optionally its REST API,
+# backed by a simulated STM32F411, so that host tooling can be developed and
+# benchmarked without hardware.  Responses are delayed according to a model of
+# airfrog's WiFi link and the SWD speed.
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from airfrog.bin import PORT, SPEED_NAMES, SPEED_KHZ
+from airfrog.emulator import Emulator, RestEmulator, LinkModel, WIFI
+from airfrog.sim import SimTarget, SYSCLK
+
+
+def main():
+    speeds = {name.lower(): speed for speed, name in SPEED_NAMES.items()}
+
+    parser = argparse.ArgumentParser(description='Emulate an airfrog binary API server')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=PORT, help='port to listen on')
+    parser.add_argument('--rest-port', type=int,
+                        help='also serve the REST API on this port (80 on a real airfrog)')
+    parser.add_argument('--rest-latency-ms', type=float, default=0,
+                        help='extra delay added to every REST response in ms')
+    parser.add_argument('--rest-error-rate', type=float, default=0,
+                        help='probability that a REST target operation fails with an SWD error')
+    parser.add_argument('--rest-drop-rate', type=float, default=0,
+                        help='probability that a REST request is dropped without a response')
+    parser.add_argument('--local', action='store_true',
+                        help='no latency or SWD timing model - respond as fast as possible')
+    parser.add_argument('--rtt-ms', type=float, default=WIFI['rtt'] * 1000,
+                        help='network round trip time in ms')
+    parser.add_argument('--jitter-ms', type=float, default=WIFI['jitter'] * 1000,
+                        help='maximum random extra delay per response in ms')
+    parser.add_argument('--bandwidth', type=float, default=WIFI['bandwidth'],
+                        help='link bandwidth in bytes/s (0 for unlimited)')
+    parser.add_argument('--overhead-us', type=float, default=WIFI['overhead'] * 1e6,
+                        help='firmware time per command in us')
+    parser.add_argument('--speed', choices=speeds, default='turbo', help='initial SWD speed')
+    parser.add_argument('--sysclk', type=int, default=SYSCLK, help='target SYSCLK in Hz')
+    parser.add_argument('--flash-image', help='binary image to load at the start of flash')
+    parser.add_argument('--rom-counter', type=float, default=0,
+                        help='make 0x20000008 count up at this rate per second')
+    parser.add_argument('--segger-rtt', type=float, metavar='BYTES_PER_S', nargs='?', const=0,
+                        help='add a SEGGER RTT control block to SRAM, optionally logging to up '
+                             'channel 0 at this rate')
+    parser.add_argument('--rtt-echo', action='store_true',
+                        help='with --segger-rtt, echo RTT down channel 0 to up channel 0')
+    args = parser.parse_args()
+
+    target = SimTarget(sysclk=args.sysclk)
+    if args.flash_image:
+        with open(args.flash_image, 'rb') as f:
+            target.load_flash(f.read())
+    if args.rom_counter:
+        target.add_ticking_word(0x20000008, args.rom_counter)
+    if args.segger_rtt is not None:
+        target.add_rtt(rate=args.segger_rtt, echo=args.rtt_echo)
+
+    if args.local:
+        link = LinkModel.local(speed=speeds[args.speed])
+    else:
+        link = LinkModel(rtt=args.rtt_ms / 1000, jitter=args.jitter_ms / 1000,
+                         bandwidth=args.bandwidth or None, overhead=args.overhead_us / 1e6,
+                         speed=speeds[args.speed])
+
+    # Both APIs share the link model, so they contend for the target as they
+    # would on a real airfrog
+    emulator = Emulator(target, host=args.host, port=args.port, link=link)
+    rest = None
+    if args.rest_port is not None:
+        rest = RestEmulator(target, host=args.host, port=args.rest_port, link=link,
+                            latency=args.rest_latency_ms / 1000,
+                            error_rate=args.rest_error_rate, drop_rate=args.rest_drop_rate)
+        rest.start()
+        print(f"Emulating airfrog REST API on {args.host}:{rest.port}")
+
+    print(f"Emulating airfrog on {args.host}:{args.port} - SWD {SPEED_NAMES[link.speed]} "
+          f"({SPEED_KHZ[link.speed]}kHz), RTT {link.rtt * 1000:.1f}ms, SYSCLK {args.sysclk}Hz")
+    try:
+        emulator.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nServed {emulator.connections} connections, {emulator.commands} commands")
+        if rest is not None:
+            print(f"Served {rest.connections} REST connections, {rest.requests} requests, "
+                  f"refused {rest.refused} connections")
+            rest.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+# airfrog interrupt activity profiler
+#
+# Samples SCB_ICSR and NVIC_IABR0-15 over the binary API, without halting
+# the target, and reports the share of time each exception spends executing
+# and active, how long it stays active, how often it is preempted, and how
+# deeply interrupts nest:
+#
+#   airfrog-irq.py 192.168.0.103 --duration 30
+#   airfrog-irq.py 192.168.0.103 --dwt --svd STM32F411.svd
+#
+# --svd names interrupts from the MCU's CMSIS-SVD file.
+# --dwt also enables and reads the DWT counters, to show the EXCCNT
+# exception overhead alongside.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from airfrog.bin import Client, PORT as BIN_PORT
+from airfrog.dwt import Unwrapper, workload_profile, DWT_CTRL, DWT_CTRL_COUNTERS
+from airfrog.irq import IrqSampler, IrqProfile, DEFAULT_BATCH
+from airfrog.memory import Memory
+from airfrog.profile import DEMCR, DEMCR_TRCENA
+from airfrog.svd import SvdIndex
+from airfrog.transport import bin_address
+
+DEFAULT_DURATION = 10.0
+DEFAULT_TOP = 20
+
+
+def enable_dwt(client):
+    """Enable TRCENA and the DWT counters, leaving other bits alone"""
+    memory = Memory(client)
+    memory.write_word(DEMCR, memory.read_word(DEMCR) | DEMCR_TRCENA)
+    memory.write_word(DWT_CTRL, memory.read_word(DWT_CTRL) | DWT_CTRL_COUNTERS)
+
+
+def format_histogram(histogram):
+    return ' '.join(f"{bucket}:{runs}" for bucket, runs in histogram.items())
+
+
+def print_report(profile, unwrapper, top):
+    print(f"{profile.samples} samples in {profile.elapsed:.1f}s, "
+          f"{profile.interval * 1e6:.0f}us apart")
+    print(f"Handler mode in {profile.handler_share():.2f}% of samples")
+    if profile.torn:
+        print(f"{profile.torn} samples torn by activity changing between the ICSR and IABR reads")
+    if unwrapper is not None and unwrapper.samples:
+        workload = workload_profile(unwrapper.totals)
+        if workload is not None:
+            flag = ''
+            if unwrapper.ambiguous_samples:
+                flag = (f" (EXCCNT may have wrapped unseen in {unwrapper.ambiguous_samples} "
+                        f"of {unwrapper.samples} intervals - treat as a lower bound)")
+            print(f"EXCCNT exception entry/exit overhead {workload['exception']:.2f}% of cycles{flag}")
+    print()
+
+    print(f"{'Exception':<16} {'Exec%':>7} {'Active%':>8} {'Preempt%':>9} {'Runs':>7} "
+          f"{'MeanRun':>8}  Run length histogram (samples:runs)")
+    for stats in profile.stats()[:top]:
+        print(f"{stats['name']:<16} {stats['executing']:7.2f} {stats['active']:8.2f} "
+              f"{stats['preempted']:9.2f} {stats['runs']:7} {stats['mean_run']:8.2f}  "
+              f"{format_histogram(stats['histogram'])}")
+
+    print()
+    print("Nesting depth: " + ', '.join(f"{depth}: {percent:.2f}%"
+                                        for depth, percent in profile.nesting().items()))
+    if profile.preemptions:
+        print("Preemptions:")
+        for (by, of), count in profile.preemptions.most_common(top):
+            print(f"  {profile.name(by)} preempted {profile.name(of)} {count} times")
+    if profile.pending:
+        print("Pending while sampled: " + ', '.join(
+            f"{profile.name(exception)} {count}" for exception, count in profile.pending.most_common(top)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profile interrupt activity from SCB_ICSR and NVIC_IABR')
+    parser.add_argument('airfrog_host',
+                        help='IP address or hostname of airfrog, or a bin://host[:port] URL')
+    parser.add_argument('--port', type=int, default=BIN_PORT,
+                        help='binary API port, unless the URL gives one')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+                        help=f'seconds to sample for (default {DEFAULT_DURATION:.0f})')
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH,
+                        help='samples per pipelined batch')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP, help='exceptions to list')
+    parser.add_argument('--dwt', action='store_true',
+                        help='enable and read the DWT counters to report EXCCNT overhead')
+    parser.add_argument('--svd', metavar='FILE', help="MCU's CMSIS-SVD file, to name interrupts")
+    args = parser.parse_args()
+
+    try:
+        host, port = bin_address(args.airfrog_host, args.port)
+    except ValueError as e:
+        parser.error(str(e))
+
+    profile = IrqProfile(SvdIndex.load(args.svd).interrupts if args.svd else None)
+    unwrapper = Unwrapper() if args.dwt else None
+
+    with Client(host, port=port) as client:
+        client.reset_target()
+        if args.dwt:
+            enable_dwt(client)
+        sampler = IrqSampler(client, batch=args.batch, dwt=args.dwt)
+
+        print(f"Sampling for {args.duration:.0f}s (Ctrl+C to stop early)...")
+        start = time.perf_counter()
+        try:
+            while time.perf_counter() - start < args.duration:
+                batch = sampler.sample()
+                profile.add(batch.samples)
+                if unwrapper is not None:
+                    unwrapper.update(batch.counters, batch.counters['time'])
+        except KeyboardInterrupt:
+            # The interrupt may have landed mid-response, so close without
+            # waiting for outstanding reads
+            client.close()
+        profile.finish()
+
+    print()
+    print_report(profile, unwrapper, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# airfrog PC-sampling profiler
+#
+# Samples the target's program counter via DWT_PCSR over the binary API,
+# without halting it, and reports where the firmware spends its time - as a
+# flat profile per function, and optionally as folded stacks for flame graph
+# tools:
+#
+#   airfrog-profile.py 192.168.0.103 --elf firmware.elf --duration 30
+#   airfrog-profile.py 192.168.0.103 --elf firmware.elf --folded out.folded
+#   flamegraph.pl out.folded > profile.svg
+#
+# Without --elf, samples are reported by address.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from airfrog.bin import Client, PORT as BIN_PORT
+from airfrog.elf import SymbolIndex
+from airfrog.profile import PcSampler, Profile, DEFAULT_BATCH
+from airfrog.transport import bin_address
+
+DEFAULT_DURATION = 10.0
+DEFAULT_TOP = 20
+
+
+def print_report(profile, elapsed, top, addresses):
+    total = profile.total
+    print(f"{total} samples in {elapsed:.1f}s ({total / elapsed:.0f} samples/s), "
+          f"{profile.halted} while halted")
+    print()
+    print(f"{'Samples':>9} {'%':>7}  Function")
+    for name, count, percent in profile.flat()[:top]:
+        print(f"{count:9} {percent:6.2f}%  {name}")
+
+    if addresses:
+        print()
+        print(f"{'Samples':>9}  {'Address':<10}  Function")
+        for pc, name, count in profile.hot_addresses(top):
+            print(f"{count:9}  0x{pc:08X}  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Statistical PC-sampling profiler using DWT_PCSR')
+    parser.add_argument('airfrog_host',
+                        help='IP address or hostname of airfrog, or a bin://host[:port] URL')
+    parser.add_argument('--port', type=int, default=BIN_PORT,
+                        help='binary API port, unless the URL gives one')
+    parser.add_argument('--elf', help='firmware ELF file to symbolise samples against')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+                        help=f'seconds to sample for (default {DEFAULT_DURATION:.0f})')
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH,
+                        help='samples per pipelined batch')
+    parser.add_argument('--top', type=int, default=DEFAULT_TOP,
+                        help='functions to list in the flat profile')
+    parser.add_argument('--addresses', action='store_true',
+                        help='also list the most sampled addresses, and include addresses '
+                             'in folded stacks')
+    parser.add_argument('--folded', metavar='FILE', help='write folded stacks to this file')
+    args = parser.parse_args()
+
+    try:
+        host, port = bin_address(args.airfrog_host, args.port)
+    except ValueError as e:
+        parser.error(str(e))
+
+    symbols = None
+    if args.elf:
+        symbols = SymbolIndex.load(args.elf)
+        print(f"Loaded {len(symbols)} functions from {args.elf}")
+    profile = Profile(symbols)
+
+    with Client(host, port=port) as client:
+        client.reset_target()
+        sampler = PcSampler(client, batch=args.batch)
+        sampler.enable()
+
+        print(f"Sampling for {args.duration:.0f}s (Ctrl+C to stop early)...")
+        start = time.perf_counter()
+        try:
+            while time.perf_counter() - start < args.duration:
+                profile.add(sampler.sample())
+        except KeyboardInterrupt:
+            # The interrupt may have landed mid-response, so close without
+            # waiting for outstanding reads
+            client.close()
+        elapsed = time.perf_counter() - start
+
+    print()
+    print_report(profile, elapsed, args.top, args.addresses)
+
+    if args.folded:
+        with open(args.folded, 'w') as f:
+            for line in profile.folded(args.addresses):
+                f.write(line + '\n')
+        print(f"\nFolded stacks written to {args.folded}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+# airfrog RTT client
+#
+# Reads SEGGER RTT up channels directly from the target's control block over
+# the binary API.  One channel is written to stdout, and every up channel can
+# also be logged to its own file.  With --down, stdin is sent to a down
+# channel:
+#
+#   airfrog-rtt.py 192.168.0.103
+#   airfrog-rtt.py 192.168.0.103 --elf firmware.elf
+#   airfrog-rtt.py 192.168.0.103 --address 0x20003A48 --channel 1 --log rtt-logs
+#   airfrog-rtt.py 192.168.0.103 --down 0 < commands.txt
+#   airfrog-rtt.py 192.168.0.103 --elf firmware.elf --defmt
+#
+# The control block is located from the firmware ELF's _SEGGER_RTT symbol,
+# given with --address, or otherwise found by scanning the target's RAM.
+# Scan hits are cached per firmware, so later runs skip the scan - --rescan
+# forces one, and --ram gives the range to scan for MCUs airfrog doesn't
+# know.
+#
+# --defmt decodes the stdout channel as defmt logs, using the format strings
+# in the firmware ELF.
+
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from airfrog.bin import Client, PORT as BIN_PORT
+from airfrog.defmt import Decoder, DefmtError, Table, format_frame
+from airfrog.memory import Memory
+from airfrog.rtt import Rtt, RttError, locate, symbol_address
+from airfrog.transport import bin_address
+
+DEFAULT_INTERVAL = 0.01
+
+
+def parse_ram(value):
+    """Parse BASE:SIZE, e.g. 0x20000000:0x20000"""
+    base, _, size = value.partition(':')
+    try:
+        return int(base, 0), int(size, 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected BASE:SIZE, got '{value}'")
+
+
+def read_stdin(chunks):
+    """Queue stdin's data as it arrives, then None at EOF"""
+    stdin = sys.stdin.buffer
+    while True:
+        data = stdin.read1(65536)
+        chunks.put(data or None)
+        if not data:
+            return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Read SEGGER RTT up channels over the binary API')
+    parser.add_argument('airfrog_host',
+                        help='IP address or hostname of airfrog, or a bin://host[:port] URL')
+    parser.add_argument('--port', type=int, default=BIN_PORT,
+                        help='binary API port, unless the URL gives one')
+    parser.add_argument('--address', type=lambda value: int(value, 0),
+                        help='RTT control block address')
+    parser.add_argument('--elf', help="firmware ELF file, to find the control block's address")
+    parser.add_argument('--ram', type=parse_ram, metavar='BASE:SIZE',
+                        help="RAM to scan for the control block (default the MCU's SRAM)")
+    parser.add_argument('--rescan', action='store_true',
+                        help='scan for the control block even if its address is cached')
+    parser.add_argument('--channel', type=int, default=0, help='up channel to write to stdout')
+    parser.add_argument('--defmt', action='store_true',
+                        help='decode the stdout channel as defmt logs, using --elf')
+    parser.add_argument('--down', type=int, metavar='N', help='send stdin to down channel N')
+    parser.add_argument('--log', metavar='DIR', help='also write every up channel to DIR/up-N.bin')
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                        help=f'seconds between polls when no data arrived (default {DEFAULT_INTERVAL})')
+    parser.add_argument('--stats', action='store_true',
+                        help='print throughput to stderr every second')
+    args = parser.parse_args()
+
+    try:
+        host, port = bin_address(args.airfrog_host, args.port)
+    except ValueError as e:
+        parser.error(str(e))
+
+    address = args.address
+    if address is None and args.elf:
+        address = symbol_address(args.elf)
+        if address is None:
+            print(f"{args.elf} has no _SEGGER_RTT symbol - scanning RAM instead", file=sys.stderr)
+    decoder = None
+    if args.defmt:
+        if not args.elf:
+            parser.error("--defmt needs the firmware's --elf")
+        try:
+            decoder = Decoder(Table.load(args.elf))
+        except DefmtError as e:
+            parser.error(str(e))
+
+    logs = {}
+    with Client(host, port=port) as client:
+        client.reset_target()
+        memory = Memory(client)
+        try:
+            if address is None:
+                start = time.perf_counter()
+                address = locate(memory, ram=args.ram, rescan=args.rescan,
+                                 progress=lambda message: print(message, file=sys.stderr))
+                print(f"Control block at 0x{address:08X} ({time.perf_counter() - start:.2f}s)",
+                      file=sys.stderr)
+            rtt = Rtt(memory, address)
+        except RttError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        for channel in rtt.up + rtt.down:
+            print(f"Found {channel}", file=sys.stderr)
+        if args.down is not None and not 0 <= args.down < len(rtt.down):
+            print(f"Error: no down channel {args.down}", file=sys.stderr)
+            sys.exit(1)
+        if args.log:
+            os.makedirs(args.log, exist_ok=True)
+            logs = {channel.index: open(os.path.join(args.log, f"up-{channel.index}.bin"), 'wb')
+                    for channel in rtt.up}
+
+        chunks = None
+        pending = bytearray()
+        if args.down is not None:
+            chunks = queue.Queue()
+            threading.Thread(target=read_stdin, args=(chunks,), daemon=True).start()
+
+        out = sys.stdout.buffer
+        start = last_report = time.perf_counter()
+        reported = 0
+        try:
+            while True:
+                while chunks is not None and not chunks.empty():
+                    chunk = chunks.get()
+                    if chunk is None:
+                        chunks = None
+                    else:
+                        pending += chunk
+                if pending:
+                    del pending[:rtt.write_nowait(args.down, pending)]
+
+                data = rtt.poll()
+                for index, chunk in data.items():
+                    if index == args.channel:
+                        if decoder is not None:
+                            for frame in decoder.feed(chunk):
+                                out.write(format_frame(frame).encode() + b'\n')
+                        else:
+                            out.write(chunk)
+                        out.flush()
+                    if index in logs:
+                        logs[index].write(chunk)
+                if not data and not pending:
+                    time.sleep(args.interval)
+
+                now = time.perf_counter()
+                if args.stats and now - last_report >= 1.0:
+                    total = sum(channel.bytes for channel in rtt.up)
+                    sent = sum(channel.bytes for channel in rtt.down)
+                    print(f"[{now - start:7.1f}s] {(total - reported) / (now - last_report) / 1024:8.1f} "
+                          f"KB/s, {total} bytes in {rtt.polls} polls, {sent} bytes sent"
+                          + (f", {decoder.frames} frames, {decoder.errors} bad" if decoder is not None else ''),
+                          file=sys.stderr)
+                    reported, last_report = total, now
+        except KeyboardInterrupt:
+            # The interrupt may have landed mid-response, so don't wait for
+            # outstanding RdOff updates
+            client.close()
+        finally:
+            for log in logs.values():
+                log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# airfrog SWD autotuner
+#
+# Sweeps SWD speed and bulk transfer chunk size over the binary API, bulk
+# reading a region whose contents don't change, and picks the fastest
+# configuration which reads it without errors.  The result is cached per
+# target (in ~/.cache/airfrog/tune.json) so later sessions can start tuned,
+# e.g. with stm32f4-perf-check.py --binary --tuned:
+#
+#   airfrog-tune.py 192.168.0.103
+#   airfrog-tune.py 192.168.0.103 --region 0x20000000 0x2000 --force
+#
+# The chosen speed is left set on airfrog.
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from airfrog.bin import Client, PORT as BIN_PORT, SPEED_NAMES
+from airfrog.tune import (
+    autotune, apply_cached, TuneError, DEFAULT_REGION, DEFAULT_CHUNK_WORDS, DEFAULT_REPEATS,
+    DEFAULT_CACHE,
+)
+from airfrog.transport import bin_address
+
+
+def print_trial(trial):
+    errors = ''
+    if trial.errors or trial.mismatches:
+        errors = f"  {trial.errors} errors, {trial.mismatches} mismatches"
+    if trial.reconnects:
+        errors += "  connection lost"
+    print(f"  {SPEED_NAMES[trial.speed]:<7} {trial.chunk_words:>6} {trial.bytes_per_s / 1024:9.1f}"
+          f"{errors}")
+
+
+def main():
+    speeds = {name.lower(): speed for speed, name in SPEED_NAMES.items()}
+
+    parser = argparse.ArgumentParser(description='Find the fastest reliable SWD speed and chunk size')
+    parser.add_argument('airfrog_host',
+                        help='IP address or hostname of airfrog, or a bin://host[:port] URL')
+    parser.add_argument('--port', type=int, default=BIN_PORT,
+                        help='binary API port, unless the URL gives one')
+    parser.add_argument('--region', nargs=2, metavar=('ADDR', 'BYTES'),
+                        type=lambda value: int(value, 0), default=DEFAULT_REGION,
+                        help='static memory region to read (default start of flash, 4KB)')
+    parser.add_argument('--speeds', default=','.join(speeds),
+                        help='comma separated SWD speeds to try (default all)')
+    parser.add_argument('--chunks', default=','.join(str(c) for c in DEFAULT_CHUNK_WORDS),
+                        help='comma separated bulk chunk sizes in words to try')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS,
+                        help='reads of the region at each configuration')
+    parser.add_argument('--cache', default=DEFAULT_CACHE, help='tuning cache file')
+    parser.add_argument('--force', action='store_true',
+                        help='re-tune even if this target has a cached result')
+    args = parser.parse_args()
+
+    try:
+        host, port = bin_address(args.airfrog_host, args.port)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        speed_list = [speeds[name.strip().lower()] for name in args.speeds.split(',')]
+    except KeyError as e:
+        parser.error(f"Unknown speed {e} - choose from {', '.join(speeds)}")
+    chunk_list = [int(c) for c in args.chunks.split(',')]
+    addr, nbytes = args.region
+    if addr % 4 or nbytes % 4 or nbytes <= 0:
+        parser.error("The region's address and size must be non-zero multiples of 4")
+
+    with Client(host, port=port) as client:
+        client.reset_target()
+        if not args.force:
+            result = apply_cached(client, args.cache)
+            if result is not None:
+                print(f"Using cached {result}")
+                print("Use --force to re-tune")
+                return
+
+        print(f"Reading {nbytes} bytes at 0x{addr:08X}, {args.repeats} times per configuration")
+        print(f"  {'Speed':<7} {'Chunk':>6} {'KB/s':>9}")
+        try:
+            result = autotune(client, (addr, nbytes), speed_list, chunk_list, args.repeats,
+                              args.cache, progress=print_trial)
+        except TuneError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Chose {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,31 @@
 # Reads various STM32F4 registers while the MCU is running whatever workload
 # is in firmware.
 
-import requests
 import time
 import json
 import argparse
+import os
 import sys
 
-# Base URL will be set from command line argument
-BASE_URL = None
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from airfrog.plan import ReadPlan, STM32F4_SIDE_EFFECTS
+from airfrog.rest import DEFAULT_POOL_SIZE
+from airfrog.transport import open_transport, api_urls
+from airfrog.schedule import Scheduler
+from airfrog.dwt import Unwrapper, required_sample_rate, workload_profile
+from airfrog.capture import CaptureWriter, PERF_FIELDS, load_capture, summarise
+from airfrog.svd import SvdIndex, format_register
+
+# Memory access transport (REST or binary API) will be created from command
+# line arguments
+TRANSPORT = None
+
+# Default time between samples, in seconds
+DEFAULT_PERIOD = 0.1
+
+# Peripherals decoded with --svd by default
+DEFAULT_SVD_PERIPHERALS = 'RCC,PWR,FLASH,GPIOA,GPIOB,GPIOC,DBGMCU'
 
 # Assumed clock frequencies for HSI and HSE
 HSI_FREQ = 16_000_000
@@ -34,6 +51,10 @@ DWT_SLEEPCNT_ADDR = 0xE0001010
 DWT_LSUCNT_ADDR = 0xE0001014
 DWT_FOLDCNT_ADDR = 0xE0001018
 
+# Extra metrics maintained by the target firmware, sampled with the DWT
+# counters
+ROM_BYTES_ADDR = 0x20000008
+
 # Cortex-M4 System Control Block
 #
 # Documented in ARM DDI0403
@@ -86,44 +107,38 @@ OTYPER_OFFSET = 0x04
 
 def write_memory(addr, value):
     """Write 32-bit value to memory address via airfrog API"""
-    url = f"{BASE_URL}/target/memory/write/0x{addr:X}"
-    response = requests.post(url, json={"data": f"0x{value:08X}"})
-    if response.status_code != 200:
-        raise Exception(f"Write failed: {response.text}")
+    TRANSPORT.write_memory(addr, value)
 
 def read_memory(addr):
     """Read 32-bit value from memory address via airfrog API"""
-    url = f"{BASE_URL}/target/memory/read/0x{addr:X}"
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f"Read failed: {response.text}")
-    return int(response.json()["data"], 16)
+    return TRANSPORT.read_memory(addr)
+
+def read_plan(plan):
+    """Read all the registers in a ReadPlan via airfrog API, returning {addr: value}"""
+    return TRANSPORT.read_plan(plan)
 
 def reset_target():
     """Reset and initialize target for debugging"""
     print("Resetting and initializing target...")
-    url = f"{BASE_URL}/target/reset"
-    response = requests.post(url, json={})
-    if response.status_code != 200:
-        raise Exception(f"Target reset failed: {response.text}")
+    status = TRANSPORT.reset_target()
     
     # Show target info from reset response
-    result = response.json()
-    if "status" in result:
-        status = result["status"]
+    if status is not None:
         print(f"  Target connected: {status.get('connected', 'unknown')}")
         print(f"  MCU: {status.get('mcu', 'unknown')}")
         print(f"  IDCODE: {status.get('idcode', 'unknown')}")
+    if getattr(TRANSPORT, 'tuning', None) is not None:
+        print(f"  Tuned: {TRANSPORT.tuning}")
     print("Target reset complete!\n")
     
-def read_gpio_speed(port):
+def read_gpio_speed(regs, port):
     """Read GPIO port speed from OSPEEDR register"""
     if port not in 'ABCDEFGH':
         raise ValueError("Invalid GPIO port. Must be A-H.")
     
     offset = (ord(port) - ord('A')) * GPIO_SIZE + GPIO_BASE
     ospeedr_addr = offset + OSPEEDR_OFFSET
-    ospeedr = read_memory(ospeedr_addr)
+    ospeedr = regs[ospeedr_addr]
     
     speeds = []
     for i in range(16):
@@ -140,14 +155,14 @@ def read_gpio_speed(port):
     print(f"    GPIO{port} OSPEEDR: 0x{ospeedr:08X}")
     print(f"      Speed settings 0-15: {','.join(speeds)}")
 
-def read_gpio_pupd(port):
+def read_gpio_pupd(regs, port):
     """Read GPIO port pull-up/pull-down from PUPDR register"""
     if port not in 'ABCDEFGH':
         raise ValueError("Invalid GPIO port. Must be A-H.")
     
     offset = (ord(port) - ord('A')) * GPIO_SIZE + GPIO_BASE
     pupdr_addr = offset + PUPDR_OFFSET
-    pupdr = read_memory(pupdr_addr)
+    pupdr = regs[pupdr_addr]
     
     pull_settings = []
     for i in range(16):
@@ -164,14 +179,14 @@ def read_gpio_pupd(port):
     print(f"    GPIO{port} PUPDR: 0x{pupdr:08X}")
     print(f"      Pull settings 0-15: {','.join(pull_settings)}")
 
-def read_gpio_mode(port):
+def read_gpio_mode(regs, port):
     """Read GPIO port mode from MODER register"""
     if port not in 'ABCDEFGH':
         raise ValueError("Invalid GPIO port. Must be A-H.")
     
     offset = (ord(port) - ord('A')) * GPIO_SIZE + GPIO_BASE
     moder_addr = offset + MODER_OFFSET
-    moder = read_memory(moder_addr)
+    moder = regs[moder_addr]
     
     modes = []
     for i in range(16):
@@ -188,14 +203,14 @@ def read_gpio_mode(port):
     print(f"    GPIO{port} MODER: 0x{moder:08X}")
     print(f"      Mode settings 0-15: {','.join(modes)}")
     
-def read_gpio_otype(port):
+def read_gpio_otype(regs, port):
     """Read GPIO port output type from OTYPER register"""
     if port not in 'ABCDEFGH':
         raise ValueError("Invalid GPIO port. Must be A-H.")
     
     offset = (ord(port) - ord('A')) * GPIO_SIZE + GPIO_BASE
     otyper_addr = offset + OTYPER_OFFSET
-    otyper = read_memory(otyper_addr)
+    otyper = regs[otyper_addr]
     
     types = []
     for i in range(16):
@@ -205,7 +220,7 @@ def read_gpio_otype(port):
     print(f"    GPIO{port} OTYPER: 0x{otyper:08X}")
     print(f"      Output types 0-15: {','.join(types)}")
 
-def read_flash_acr():
+def read_flash_acr(regs):
     """Read and display FLASH_ACR (Flash Access Control Register) at 0x40023C00
     
     Bit 10: DCEN (Data cache enable) - F405/411 don't have data cache, should read 0
@@ -213,7 +228,7 @@ def read_flash_acr():
     Bit 8:  PRFTEN (Prefetch enable)
     Bits 2:0: LATENCY (Flash wait states)
     """
-    flash_acr = read_memory(FLASH_ACR_ADDR)
+    flash_acr = regs[FLASH_ACR_ADDR]
     dcen = (flash_acr >> 10) & 1
     icen = (flash_acr >> 9) & 1
     prften = (flash_acr >> 8) & 1
@@ -226,7 +241,7 @@ def read_flash_acr():
     print(f"    PRFTEN (bit 8): {prften} (prefetch enabled)")
     print(f"    LATENCY (bits 3:0): {latency} (wait states)")
 
-def read_rcc_cr():
+def read_rcc_cr(regs):
     """Read and display RCC_CR (RCC Clock Control Register) at 0x40023800
     
     Bit 25: PLLRDY (PLL ready)
@@ -236,7 +251,7 @@ def read_rcc_cr():
     Bit 1:  HSIRDY (HSI ready)
     Bit 0:  HSION (HSI enable)
     """
-    rcc_cr = read_memory(RCC_CR_ADDR)
+    rcc_cr = regs[RCC_CR_ADDR]
     pllrdy = (rcc_cr >> 25) & 1
     pllon = (rcc_cr >> 24) & 1
     hserdy = (rcc_cr >> 17) & 1
@@ -248,7 +263,7 @@ def read_rcc_cr():
     print(f"    HSE: ON={hseon} RDY={hserdy}")
     print(f"    HSI: ON={hsion} RDY={hsirdy}")
 
-def read_rcc_pllcfgr():
+def read_rcc_pllcfgr(regs):
     """Read and display RCC_PLLCFGR (PLL Configuration Register) at 0x40023804
     
     Bits 27:24: PLLQ (division factor for USB/SDIO clocks)
@@ -257,7 +272,7 @@ def read_rcc_pllcfgr():
     Bits 14:6:  PLLN (multiplication factor)
     Bits 5:0:   PLLM (division factor for input clock)
     """
-    rcc_pllcfgr = read_memory(RCC_PLLCFGR_ADDR)
+    rcc_pllcfgr = regs[RCC_PLLCFGR_ADDR]
     pllq = (rcc_pllcfgr >> 24) & 0xF
     pllsrc = (rcc_pllcfgr >> 22) & 1
     pllp = ((rcc_pllcfgr >> 16) & 3) * 2 + 2  # 00=2, 01=4, 10=6, 11=8
@@ -311,7 +326,7 @@ def get_hpre_str(hpre):
     else:
         return "/1"
 
-def read_rcc_cfgr():
+def read_rcc_cfgr(regs):
     """Read and display RCC_CFGR (Clock Configuration Register) at 0x40023808
     
     Bits 15:13: PPRE2 (APB2 prescaler)
@@ -320,7 +335,7 @@ def read_rcc_cfgr():
     Bits 3:2:   SWS (System clock switch status)
     Bits 1:0:   SW (System clock switch)
     """
-    rcc_cfgr = read_memory(RCC_CFGR_ADDR)
+    rcc_cfgr = regs[RCC_CFGR_ADDR]
     ppre2 = (rcc_cfgr >> 13) & 7
     ppre2_str = get_pre_str(ppre2)
     ppre1 = (rcc_cfgr >> 10) & 7
@@ -335,15 +350,15 @@ def read_rcc_cfgr():
     print(f"    Prescalers:")
     print(f"      AHB={hpre_str} ({hpre})")
     print(f"      APB1={ppre1_str} ({ppre1})")
-    print(f"      APB2={ppre1_str} ({ppre2})")
+    print(f"      APB2={ppre2_str} ({ppre2})")
 
-def read_rcc_cir():
+def read_rcc_cir(regs):
     """Read and display RCC_CIR (Clock Interrupt Register) at 0x4002380C
     """
-    rcc_cir = read_memory(RCC_CIR_ADDR)
+    rcc_cir = regs[RCC_CIR_ADDR]
     print(f"  RCC_CIR: 0x{rcc_cir:08X}")
 
-def read_rcc_ahb1enr():
+def read_rcc_ahb1enr(regs):
     """Read and display GPIO port enables from RCC_AHB1ENR at 0x40023830
     
     Bit 8: GPIOIEN (GPIO port I clock enable) - F405/415/407/417 only
@@ -356,7 +371,7 @@ def read_rcc_ahb1enr():
     Bit 1: GPIOBEN (GPIO port B clock enable)
     Bit 0: GPIOAEN (GPIO port A clock enable)
     """
-    rcc_ahb1enr = read_memory(RCC_AHB1ENR_ADDR)
+    rcc_ahb1enr = regs[RCC_AHB1ENR_ADDR]
 
     print(f"  RCC_AHB1ENR: 0x{rcc_ahb1enr:08X}")
     
@@ -369,18 +384,18 @@ def read_rcc_ahb1enr():
     
     print(f"    GPIO enabled ports: {', '.join(enabled_ports) if enabled_ports else 'None'}")
 
-def read_rcc_apb1enr():
+def read_rcc_apb1enr(regs):
     """Read and display RCC_APB1ENR (APB1 Peripheral Clock Enable Register) at 0x40023840
     
     Bit 28: PWREN (Power interface clock enable)
     Plus other APB1 peripheral enables
     """
-    rcc_apb1enr = read_memory(RCC_APB1ENR_ADDR)
+    rcc_apb1enr = regs[RCC_APB1ENR_ADDR]
     pwren = (rcc_apb1enr >> 28) & 1
     print(f"  RCC_APB1ENR: 0x{rcc_apb1enr:08X}")
     print(f"    PWREN (bit 28): {pwren} (power interface clock)")
 
-def read_pwr_cr():
+def read_pwr_cr(regs):
     """Read and display PWR_CR (Power Control Register) at 0x40007000
     
     Bits 15:14: VOS (Voltage scaling selection)
@@ -393,7 +408,7 @@ def read_pwr_cr():
     Bit 1:      PDDS (Power down deepsleep)
     Bit 0:      LPDS (Low-power deepsleep)
     """
-    pwr_cr = read_memory(PWR_CR_ADDR)
+    pwr_cr = regs[PWR_CR_ADDR]
     vos = (pwr_cr >> 14) & 3
     fpds = (pwr_cr >> 9) & 1
     dbp = (pwr_cr >> 8) & 1
@@ -401,27 +416,27 @@ def read_pwr_cr():
     print(f"  PWR_CR: 0x{pwr_cr:08X}")
     print(f"    VOS (bits 15:14): {vos} (voltage scaling)")
 
-def read_pwr_csr():
+def read_pwr_csr(regs):
     """
     Read and display PWR_CSR (Power Control Status Register) at 0x40007004
 
     Bit 14:     VOS Rdy
     """
-    pwr_csr = read_memory(PWR_CSR_ADDR)
+    pwr_csr = regs[PWR_CSR_ADDR]
     vos_rdy = (pwr_csr >> 14) & 1
     print(f"  PWR_CSR: 0x{pwr_csr:08X}")
     print(f"    VOS Rdy (bit 14): {vos_rdy}")
 
-def read_scb_stcsr():
+def read_scb_stcsr(regs):
     """Read and display SCB_STCSR (SysTick Control and Status Register) at 0xE000E010
     """
-    scb_stcsr = read_memory(SCB_STCSR_ADDR)
+    scb_stcsr = regs[SCB_STCSR_ADDR]
     print(f"  SCB_STCSR: 0x{scb_stcsr:08X}")
     tickint = (scb_stcsr >> 1) & 1
     enable = scb_stcsr & 1
     print(f"    SysTick: ENABLE={enable} TICKINT={tickint}")
 
-def read_scb_icsr():
+def read_scb_icsr(regs):
     """Read and display SCB_ICSR (Interrupt Control and State Register) at 0xE000ED04
     
     Bit 31:     NMIPENDSET (NMI set-pending bit)
@@ -435,31 +450,31 @@ def read_scb_icsr():
     Bit 11:     RETTOBASE (Return to base level)
     Bits 8:0:   VECTACTIVE (Active vector number)
     """
-    scb_icsr = read_memory(SCB_ICSR_ADDR)
+    scb_icsr = regs[SCB_ICSR_ADDR]
     vectactive = scb_icsr & 0x1FF
     vectpending = (scb_icsr >> 12) & 0x1FF
     isrpending = (scb_icsr >> 22) & 1
     print(f"  SCB_ICSR: 0x{scb_icsr:08X}")
     print(f"    VECTACTIVE: {vectactive} VECTPENDING: {vectpending} ISRPENDING: {isrpending}")
 
-def read_and_check_nvic_iabrs():
+def read_and_check_nvic_iabrs(regs):
     """Read and check NVIC_IABR* interrupt active registers from 0xE000E300
     onwards
     """
     print(f"  Read NVIC_IABR registers:")
     for i in range(NUM_NVIC_IABR_REG):
-        iabr = read_memory(NVIC_IABR0_ADDR + (i * 4))
+        iabr = regs[NVIC_IABR0_ADDR + (i * 4)]
         if iabr:
             print(f"  NVIC_IABR{i}: 0x{iabr:08X}")
     print(f"  NVIC_IABR registers read complete.")
 
-def read_dbgmcu_idcode():
+def read_dbgmcu_idcode(regs):
     """Read and display DBGMCU_IDCODE register at 0xE0042000
     
     Bits 31:16: REV_ID (Revision identifier)
     Bits 11:0:  DEV_ID (Device identifier)
     """
-    dbgmcu_idcode = read_memory(DBGMCU_IDCODE)
+    dbgmcu_idcode = regs[DBGMCU_IDCODE]
     rev_id = (dbgmcu_idcode >> 16) & 0xFFFF
     dev_id = dbgmcu_idcode & 0xFFF
     
@@ -467,41 +482,72 @@ def read_dbgmcu_idcode():
     print(f"    DEV_ID: 0x{dev_id:03X}")
     print(f"    REV_ID: 0x{rev_id:04X}")  
 
+def system_state_plan():
+    """Return a ReadPlan covering every register read_system_state() shows"""
+    plan = ReadPlan(exclude=STM32F4_SIDE_EFFECTS)
+    plan.add_all([DBGMCU_IDCODE, FLASH_ACR_ADDR, RCC_AHB1ENR_ADDR, RCC_APB1ENR_ADDR,
+                  SCB_ICSR_ADDR, SCB_STCSR_ADDR])
+    plan.add(RCC_CR_ADDR, 4)
+    plan.add(PWR_CR_ADDR, 2)
+    for port in 'ABC':
+        plan.add(GPIO_BASE + (ord(port) - ord('A')) * GPIO_SIZE, 4)
+    plan.add(NVIC_IABR0_ADDR, NUM_NVIC_IABR_REG)
+    return plan
+
 def read_system_state():
     """Read and display all system configuration registers"""
     print("Reading system configuration...")
-    read_dbgmcu_idcode()
-    read_flash_acr()
-    read_rcc_cr()
-    read_rcc_pllcfgr()
-    read_rcc_cfgr()
-    read_rcc_cir()
-    read_rcc_ahb1enr()
-    read_rcc_apb1enr()
-    read_pwr_cr()
-    read_pwr_csr()
+    plan = system_state_plan()
+    regs = read_plan(plan)
+    print(f"  Read {len(plan)} registers in {len(plan.spans())} requests")
+    read_dbgmcu_idcode(regs)
+    read_flash_acr(regs)
+    read_rcc_cr(regs)
+    read_rcc_pllcfgr(regs)
+    read_rcc_cfgr(regs)
+    read_rcc_cir(regs)
+    read_rcc_ahb1enr(regs)
+    read_rcc_apb1enr(regs)
+    read_pwr_cr(regs)
+    read_pwr_csr(regs)
     for port in 'ABC':
         print(f"  GPIO{port}:")
-        read_gpio_mode(port)
-        read_gpio_otype(port)
-        read_gpio_pupd(port)
-        read_gpio_speed(port)
-    read_scb_icsr()
-    read_scb_stcsr()
-    read_and_check_nvic_iabrs()
+        read_gpio_mode(regs, port)
+        read_gpio_otype(regs, port)
+        read_gpio_pupd(regs, port)
+        read_gpio_speed(regs, port)
+    read_scb_icsr(regs)
+    read_scb_stcsr(regs)
+    read_and_check_nvic_iabrs(regs)
     print("System state read complete!\n")
     print()
 
+def read_svd_state(index, peripherals):
+    """Read and decode whole peripherals using an SVD register index"""
+    print(f"Reading {', '.join(peripherals)} using the {index.device} SVD...")
+    # ST's SVDs don't mark the data registers whose reads pop received data
+    plan = index.plan(peripherals, exclude=STM32F4_SIDE_EFFECTS + index.side_effects())
+    regs = read_plan(plan)
+    print(f"  Read {len(plan)} registers in {len(plan.spans())} requests")
+    for decoded in index.decode(regs):
+        print('  ' + format_register(decoded, zero_fields=False).replace('\n', '\n  '))
+    print()
+
 def read_dwt_state():
     """Read and display current DWT register states before modification"""
+    plan = ReadPlan()
+    plan.add(DEMCR_ADDR)
+    plan.add(DWT_CTRL_ADDR, 7)
+    regs = read_plan(plan)
+
     print("  Reading current CoreDebug DEMCR...")
-    current_demcr = read_memory(DEMCR_ADDR)
+    current_demcr = regs[DEMCR_ADDR]
     trcena = (current_demcr >> 24) & 1
     print(f"    Current DEMCR: 0x{current_demcr:08X}")
     print(f"    TRCENA (bit 24): {trcena}")
     
     print("  Reading current DWT_CTRL...")
-    current_dwt_ctrl = read_memory(DWT_CTRL_ADDR)
+    current_dwt_ctrl = regs[DWT_CTRL_ADDR]
     cyccntena = current_dwt_ctrl & 1
     cpievtena = (current_dwt_ctrl >> 17) & 1
     excevtena = (current_dwt_ctrl >> 18) & 1
@@ -515,12 +561,12 @@ def read_dwt_state():
     print(f"    Hardware support: CYCCNT={'NO' if nocyccnt else 'YES'} PROFCNT={'NO' if noprfcnt else 'YES'}")
     
     print("  Reading current counter values...")
-    print(f"    CYCCNT:   0x{read_memory(DWT_CYCCNT_ADDR):08X}")
-    print(f"    CPICNT:   0x{read_memory(DWT_CPICNT_ADDR):08X}")
-    print(f"    EXCCNT:   0x{read_memory(DWT_EXCCNT_ADDR):08X}")
-    print(f"    SLEEPCNT: 0x{read_memory(DWT_SLEEPCNT_ADDR):08X}")
-    print(f"    LSUCNT:   0x{read_memory(DWT_LSUCNT_ADDR):08X}")
-    print(f"    FOLDCNT:  0x{read_memory(DWT_FOLDCNT_ADDR):08X}")
+    print(f"    CYCCNT:   0x{regs[DWT_CYCCNT_ADDR]:08X}")
+    print(f"    CPICNT:   0x{regs[DWT_CPICNT_ADDR]:08X}")
+    print(f"    EXCCNT:   0x{regs[DWT_EXCCNT_ADDR]:08X}")
+    print(f"    SLEEPCNT: 0x{regs[DWT_SLEEPCNT_ADDR]:08X}")
+    print(f"    LSUCNT:   0x{regs[DWT_LSUCNT_ADDR]:08X}")
+    print(f"    FOLDCNT:  0x{regs[DWT_FOLDCNT_ADDR]:08X}")
 
 def configure_dwt():
     """Configure DWT registers for performance monitoring"""
@@ -545,23 +591,6 @@ def configure_dwt():
     write_memory(DWT_LSUCNT_ADDR, 0)
     write_memory(DWT_FOLDCNT_ADDR, 0)
 
-def check_wraps(current, previous):
-    """Return string with * for wrapped counters"""
-    if previous is None:
-        return ""
-    
-    wraps = ""
-    if (current['cpi_extra'] & 0xFF) < (previous['cpi_extra'] & 0xFF):
-        wraps += "*"
-    if (current['lsu'] & 0xFF) < (previous['lsu'] & 0xFF):
-        wraps += "*"
-    if (current['folded'] & 0xFF) < (previous['folded'] & 0xFF):
-        wraps += "*"
-    if (current['exception'] & 0xFF) < (previous['exception'] & 0xFF):
-        wraps += "*"
-    
-    return wraps
-
 def setup_dwt():
     """Initialize DWT performance counters"""
     print("Setting up DWT performance counters...")
@@ -569,78 +598,207 @@ def setup_dwt():
     configure_dwt()
     print("DWT setup complete!\n")
 
-def read_dwt_counters():
-    """Read all DWT performance counters and return as dict"""
+def dwt_counters_plan():
+    """Return a ReadPlan covering the DWT counters and extra metrics
+
+    DWT_CYCCNT..DWT_FOLDCNT are contiguous, so are captured by one bulk read.
+    """
+    plan = ReadPlan()
+    plan.add(DWT_CYCCNT_ADDR, 6)
+    plan.add(ROM_BYTES_ADDR)
+    return plan
+
+def read_dwt_counters(plan):
+    """Read all DWT performance counters and return as dict
+
+    The sample is timestamped (time.perf_counter()) at the midpoint of the
+    reads, which is the best estimate of when the target was sampled.
+    """
+    start = time.perf_counter()
+    regs = read_plan(plan)
+    end = time.perf_counter()
     return {
-        'cycles': read_memory(DWT_CYCCNT_ADDR),
-        'cpi_extra': read_memory(DWT_CPICNT_ADDR),        # Extra cycles beyond 1 per instruction
-        'exception': read_memory(DWT_EXCCNT_ADDR),        # Cycles spent in exception overhead
-        'sleep': read_memory(DWT_SLEEPCNT_ADDR),          # Cycles spent sleeping
-        'lsu': read_memory(DWT_LSUCNT_ADDR),              # Load/store unit operations
-        'folded': read_memory(DWT_FOLDCNT_ADDR),          # Instructions that were folded (optimized away)
-        'rom_bytes': read_memory(0x20000008)
+        'cycles': regs[DWT_CYCCNT_ADDR],
+        'cpi_extra': regs[DWT_CPICNT_ADDR],        # Extra cycles beyond 1 per instruction
+        'exception': regs[DWT_EXCCNT_ADDR],        # Cycles spent in exception overhead
+        'sleep': regs[DWT_SLEEPCNT_ADDR],          # Cycles spent sleeping
+        'lsu': regs[DWT_LSUCNT_ADDR],              # Load/store unit operations
+        'folded': regs[DWT_FOLDCNT_ADDR],          # Instructions that were folded (optimized away)
+        'rom_bytes': regs[ROM_BYTES_ADDR],
+        'time': (start + end) / 2,
+        'latency': end - start,
     }
 
-def calculate_metrics(current, previous):
-    """Calculate performance metrics from counter deltas"""
-    if previous is None:
+def calculate_metrics(current, previous, deltas):
+    """Calculate performance metrics from counter deltas
+
+    deltas are the unwrapped DWT counter deltas from an Unwrapper.
+    """
+    if previous is None or deltas is None:
         return {}
     
-    delta_cycles = current['cycles'] - previous['cycles']
     delta_rom_bytes = current['rom_bytes'] - previous['rom_bytes']
     
     # Handle 32-bit counter overflow
-    if delta_cycles < 0:
-        delta_cycles += (1 << 32)  # Add 2^32 to correct for wraparound
     if delta_rom_bytes < 0:
         delta_rom_bytes += (1 << 32)
         
     return {
-        'delta_cycles': delta_cycles,
-        'delta_rom_bytes': delta_rom_bytes
+        'delta_cycles': deltas.counts['cycles'],
+        'delta_rom_bytes': delta_rom_bytes,
+        'deltas': deltas.counts,
+        'profile': workload_profile(deltas),
+        # 8-bit counters may have wrapped more than once
+        'ambiguous': bool(deltas.ambiguous),
     }
 
+def print_profile_summary(unwrapper):
+    """Print the whole-run workload profile and whether it can be trusted"""
+    elapsed = unwrapper.elapsed
+    if not unwrapper.samples or not elapsed:
+        return
+    sysclk = unwrapper.totals['cycles'] / elapsed
+    sample_rate = unwrapper.samples / elapsed
+    print(f"Measured SYSCLK: {sysclk / 1_000_000:.2f} MHz")
+    print(f"  8-bit DWT counters need {required_sample_rate(sysclk):,.0f} samples/s to see every wrap - "
+          f"sampled at {sample_rate:.1f}/s")
+    print(f"  {unwrapper.ambiguous_samples} of {unwrapper.samples} samples may have missed wraps")
+    profile = workload_profile(unwrapper.totals)
+    if profile:
+        print(f"  Busy {profile['busy']:.1f}%  Sleep {profile['sleep']:.1f}%  "
+              f"Exception {profile['exception']:.1f}%  LSU {profile['lsu']:.1f}%  "
+              f"CPI {profile['cpi']:.1f}%  IPC {profile['ipc']:.2f}"
+              f"{'  (unreliable - missed wraps)' if unwrapper.ambiguous_samples else ''}")
+
+def analyse_capture(path):
+    """Print a summary of a capture file written with --capture"""
+    capture = load_capture(path)
+    print(f"{path}: {len(capture)} samples")
+    if len(capture) < 2:
+        return
+    print(f"  Duration: {capture['time'][-1] - capture['time'][0]:.1f}s")
+    for name, stats in summarise(capture).items():
+        pct = stats['percentiles']
+        if 'total' in stats:
+            print(f"  {name:>10}: total {stats['total']:,}  mean {stats['mean_rate']:,.0f}/s  "
+                  + "  ".join(f"p{p} {v:,.0f}/s" for p, v in pct.items()))
+        else:
+            print(f"  {name:>10}: mean {stats['mean'] * 1000:.2f}ms  "
+                  + "  ".join(f"p{p} {v * 1000:.2f}ms" for p, v in pct.items()))
+
+def measure_sample_rate(transport, plan, samples):
+    """Return the samples per second achieved reading a plan back to back"""
+    start = time.perf_counter()
+    for _ in range(samples):
+        transport.read_plan(plan)
+    return samples / (time.perf_counter() - start)
+
+def compare_transports(rest_url, bin_url, samples):
+    """Print the maximum DWT sample rate over each API and the binary API's gain"""
+    print(f"Comparing sample rates over {samples} samples...")
+    plan = dwt_counters_plan()
+    rates = {}
+    for url in (rest_url, bin_url):
+        with open_transport(url) as transport:
+            rates[transport.name] = measure_sample_rate(transport, plan, samples)
+            print(f"  {transport.name:>6}: {rates[transport.name]:8.1f} samples/s")
+    print(f"  Binary API gain: {rates['binary'] / rates['REST']:.1f}x\n")
+
 def main():
     """Main monitoring loop"""
-    global BASE_URL
+    global TRANSPORT
     
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Monitor STM32 DWT performance counters via airfrog')
-    parser.add_argument('airfrog_host', help='IP address or hostname of airfrog device (e.g., 192.168.4.1)')
+    parser.add_argument('airfrog_host', nargs='?',
+                        help='IP address or hostname of airfrog device (e.g., 192.168.4.1), '
+                             'or a URL - http://host for the REST API, bin://host for the binary API')
+    parser.add_argument('--binary', action='store_true',
+                        help='use the binary API (port 4146) rather than the REST API')
+    parser.add_argument('--tuned', action='store_true',
+                        help="with the binary API, use the target's SWD speed and chunk size "
+                             "cached by airfrog-tune.py")
+    parser.add_argument('--compare', type=int, metavar='SAMPLES', nargs='?', const=100,
+                        help='first measure the sample rate over both APIs (default 100 samples)')
+    parser.add_argument('--rest-port', type=int,
+                        help="with --compare, the REST API's port if the URL doesn't give it "
+                             "(default 80)")
+    parser.add_argument('--bin-port', type=int,
+                        help="with --compare, the binary API's port if the URL doesn't give it "
+                             "(default 4146)")
+    parser.add_argument('--connections', type=int, default=DEFAULT_POOL_SIZE,
+                        help='maximum HTTP connections to keep open to airfrog')
+    parser.add_argument('--period', type=float, default=DEFAULT_PERIOD,
+                        help=f'sample period in seconds (default {DEFAULT_PERIOD})')
+    parser.add_argument('--no-skip', action='store_true',
+                        help='take overrun samples late rather than skipping them')
+    parser.add_argument('--capture', metavar='FILE',
+                        help='also write raw samples to a .csv, .npy or .parquet file')
+    parser.add_argument('--analyse', metavar='FILE',
+                        help='summarise a capture file instead of monitoring')
+    parser.add_argument('--svd', metavar='FILE',
+                        help="also decode whole peripherals using the MCU's CMSIS-SVD file")
+    parser.add_argument('--peripherals', default=DEFAULT_SVD_PERIPHERALS,
+                        help=f'comma separated peripherals to decode with --svd '
+                             f'(default {DEFAULT_SVD_PERIPHERALS})')
     args = parser.parse_args()
     
-    # Set up base URL from command line argument
-    if not args.airfrog_host.startswith('http'):
-        BASE_URL = f"http://{args.airfrog_host}/api"
-    else:
-        BASE_URL = f"{args.airfrog_host}/api"
+    if args.analyse:
+        analyse_capture(args.analyse)
+        return
+    if args.airfrog_host is None:
+        parser.error("airfrog_host is required unless --analyse is given")
+    
+    # Compile (or load the cached) SVD index before connecting
+    svd_index = SvdIndex.load(args.svd) if args.svd else None
     
-    print(f"Connecting to airfrog at: {BASE_URL}")
+    # Set up the REST or binary API transport from command line argument
+    TRANSPORT = open_transport(args.airfrog_host, binary=args.binary, pool_size=args.connections,
+                               tuned=args.tuned)
     
+    print(f"Connecting to airfrog at: {TRANSPORT.url} ({TRANSPORT.name} API)")
+    
+    scheduler = None
+    capture = None
     try:
         reset_target()
         read_system_state()
+        if svd_index is not None:
+            read_svd_state(svd_index, [p.strip() for p in args.peripherals.split(',')])
         setup_dwt()
         
-        print("Monitoring DWT counters (Ctrl+C to stop)...")
-        print("=" * 90)
-        print(f"{'Time':>8} {'Cycles':>10} {'LSU':>6} {'Fold':>6} {'Exc':>6} {'Cycles/s':>10} {'CPS_avg':>8} {'RomB/s':>8} {'RB_avg':>8}")
-        print("=" * 90)
+        if args.compare:
+            rest_url, bin_url = api_urls(args.airfrog_host, binary=args.binary,
+                                         rest_port=args.rest_port, bin_port=args.bin_port)
+            compare_transports(rest_url, bin_url, args.compare)
+        
+        print(f"Monitoring DWT counters every {args.period * 1000:.0f}ms (Ctrl+C to stop)...")
+        print("=" * 130)
+        print(f"{'Time':>8} {'Cycles':>10} {'LSU':>6} {'Fold':>6} {'Exc':>6} {'Cycles/s':>10} {'CPS_avg':>8} {'RomB/s':>8} {'RB_avg':>8} {'Per_ms':>7} {'Lat_ms':>6} {'Busy%':>5} {'Slp%':>5} {'Exc%':>5} {'LSU%':>5}")
+        print("=" * 130)
         
         previous_counters = None
         previous_time = None
-        start_time = time.time()
+        start_time = time.perf_counter()
+        plan = dwt_counters_plan()
+        unwrapper = Unwrapper()
         
         total_cycles = 0
-        total_cycles_per_sec = 0
-        counter = 0
-        total_rom_bytes_per_sec = 0
+        total_rom_bytes = 0
+        total_interval = 0
+        
+        if args.capture:
+            capture = CaptureWriter(args.capture, PERF_FIELDS)
         
-        while True:
-            cycle_read_time = time.time()
-            current_counters = read_dwt_counters()
+        scheduler = Scheduler(args.period, skip_overruns=not args.no_skip)
+        for tick in scheduler:
+            current_counters = read_dwt_counters(plan)
+            cycle_read_time = current_counters['time']
+            if capture is not None:
+                capture.append(current_counters)
             
-            metrics = calculate_metrics(current_counters, previous_counters)
+            deltas = unwrapper.update(current_counters, cycle_read_time)
+            metrics = calculate_metrics(current_counters, previous_counters, deltas)
             
             if metrics:
                 # Calculate timing
@@ -648,36 +806,57 @@ def main():
                 cycles_per_second = metrics['delta_cycles'] / actual_interval
                 rom_bytes_per_second = metrics['delta_rom_bytes'] / actual_interval
                 
-                # Update rolling averages
-                counter += 1
+                # Update true averages - total counts over total time, rather
+                # than the mean of per-sample rates
                 total_cycles += metrics['delta_cycles']
+                total_rom_bytes += metrics['delta_rom_bytes']
+                total_interval += actual_interval
                 
-                total_cycles_per_sec += cycles_per_second
-                total_rom_bytes_per_sec += rom_bytes_per_second
+                cycles_per_sec_average = total_cycles / total_interval
+                rom_bytes_per_sec_average = total_rom_bytes / total_interval
                 
-                cycles_per_sec_average = total_cycles_per_sec / counter
-                rom_bytes_per_sec_average = total_rom_bytes_per_sec / counter
+                elapsed = cycle_read_time - start_time
                 
-                elapsed = time.time() - start_time
+                if unwrapper.sysclk is None:
+                    # Now SYSCLK is known, whole CYCCNT wraps can be recovered
+                    unwrapper.sysclk = cycles_per_second
+                profile = metrics['profile'] or dict.fromkeys(('busy', 'sleep', 'exception', 'lsu'), 0.0)
                 
                 print(f"{elapsed:6.1f} "
                     f"{metrics['delta_cycles']:10d} "
-                    f"{current_counters['lsu']:6d} "
-                    f"{current_counters['folded']:6d} "
-                    f"{current_counters['exception']:6d} "
+                    f"{metrics['deltas']['lsu']:6d} "
+                    f"{metrics['deltas']['folded']:6d} "
+                    f"{metrics['deltas']['exception']:6d} "
                     f"{cycles_per_second:11.0f} "
                     f"{cycles_per_sec_average:8.0f} "
                     f"{rom_bytes_per_second:8.0f} "
-                    f"{rom_bytes_per_sec_average:8.0f}")
+                    f"{rom_bytes_per_sec_average:8.0f} "
+                    f"{actual_interval * 1000:7.1f} "
+                    f"{current_counters['latency'] * 1000:6.1f} "
+                    f"{profile['busy']:5.1f} "
+                    f"{profile['sleep']:5.1f} "
+                    f"{profile['exception']:5.1f} "
+                    f"{profile['lsu']:5.1f}"
+                    f"{' ?' if metrics['ambiguous'] else ''}"
+                    f"{' overrun' if tick.overrun else ''}")
             
             previous_counters = current_counters.copy()
             previous_time = cycle_read_time
             
     except KeyboardInterrupt:
         print("\nMonitoring stopped.")
+        if scheduler is not None:
+            print(f"Samples: {scheduler.ticks}, overran {scheduler.overruns}, skipped {scheduler.skipped}")
+            print_profile_summary(unwrapper)
+        print(f"{TRANSPORT.name} API: {TRANSPORT.stats}")
     except Exception as e:
         print(f"Error: {e}")
         sys.exit(1)
+    finally:
+        TRANSPORT.close()
+        if capture is not None:
+            capture.close()
+            print(f"Captured {capture.rows} samples to {args.capture}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file